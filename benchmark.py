@@ -1,7 +1,17 @@
+import argparse
 import asyncio
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
+import json
 import logging
-import requests
+from multiprocessing import get_context
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
 import time
 
 from database import Database, BaseEntity
@@ -9,61 +19,303 @@ from database import Database, BaseEntity
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
-N_TIMES = 10
+
+ENGINES = ('lmdb', 'sqlite')
+SIZES = (1_000, 10_000)
+# одиночные операции на больших наборах меряются на выборке, а не на каждой строке
+SAMPLE_OPS = 2_000
+CONCURRENCY = 32
+HOMEWORLDS = [f"planet-{i}" for i in range(50)]
 
 
 @dataclass
 class Character(BaseEntity):
+    __key__ = "id"
+    __indexes__ = ("homeworld",)
+    id: int
     name: str
     height: int
+    mass: float
+    homeworld: str
 
     def __post_init__(self) -> None:
         super().__init__()
 
 
-lmdb = Database("/tmp/benchmark/lmdb")
-sqlite = Database("/tmp/benchmark/sqlite", engine='sqlite')
+@dataclass
+class Wide(BaseEntity):
+    __key__ = "id"
+    id: int
+    i0: int
+    i1: int
+    i2: int
+    i3: int
+    i4: int
+    i5: int
+    i6: int
+    i7: int
+    f0: float
+    f1: float
+    f2: float
+    f3: float
+    f4: float
+    f5: float
+    f6: float
+    f7: float
+    s0: str
+    s1: str
+    s2: str
+    s3: str
+    s4: str
+    s5: str
+    s6: str
+    s7: str
+    flag: bool
+    payload: bytes
+
+    def __post_init__(self) -> None:
+        super().__init__()
+
+
+# Синтетические данные: один seed - одни и те же строки на любой машине
+def make_characters(rng: random.Random, size: int) -> list[Character]:
+    return [Character(i,
+                      f"character-{rng.getrandbits(32):08x}",
+                      rng.randint(60, 260),
+                      round(rng.uniform(20, 200), 1),
+                      rng.choice(HOMEWORLDS))
+            for i in range(size)]
+
+
+def make_wides(rng: random.Random, size: int) -> list[Wide]:
+    entities = []
+    for i in range(size):
+        ints = [rng.getrandbits(40) for _ in range(8)]
+        floats = [rng.random() for _ in range(8)]
+        strings = [f"{rng.getrandbits(64):016x}" * rng.randint(1, 4) for _ in range(8)]
+        entities.append(Wide(i, *ints, *floats, *strings, rng.random() < 0.5, rng.randbytes(32)))
+    return entities
+
+
+GENERATORS = {'character': (Character, make_characters), 'wide': (Wide, make_wides)}
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт КиБ, macOS - байты
+    return round(peak / 2**20 if sys.platform == 'darwin' else peak / 2**10, 1)
+
+
+def percentile(latencies: list[float], share: float) -> float:
+    if not latencies:
+        return 0.0
+    latencies = sorted(latencies)
+    return latencies[min(len(latencies) - 1, int(share * len(latencies)))]
+
+
+def report(scenario: str, ops: int, seconds: float, latencies: list[float] | None = None) -> dict:
+    latencies = latencies or []
+    return {'scenario': scenario,
+            'ops': ops,
+            'seconds': round(seconds, 6),
+            'throughput': round(ops / seconds, 1) if seconds else None,
+            'p50_ms': round(1000 * percentile(latencies, 0.50), 4) if latencies else None,
+            'p99_ms': round(1000 * percentile(latencies, 0.99), 4) if latencies else None}
+
+
+async def timed_each(scenario: str, calls: list) -> dict:
+    latencies = []
+    start = time.perf_counter()
+    for call in calls:
+        began = time.perf_counter()
+        await call()
+        latencies.append(time.perf_counter() - began)
+    return report(scenario, len(calls), time.perf_counter() - start, latencies)
+
+
+async def timed_once(scenario: str, ops: int, call) -> dict:
+    start = time.perf_counter()
+    await call()
+    seconds = time.perf_counter() - start
+    return report(scenario, ops, seconds, [seconds])
+
+
+async def timed_concurrent(scenario: str, calls: list, concurrency: int) -> dict:
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(call) -> None:
+        async with semaphore:
+            began = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - began)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run(call) for call in calls))
+    return report(scenario, len(calls), time.perf_counter() - start, latencies)
+
+
+async def bench_entity(db: Database, entity_name: str, size: int, seed: int) -> list[dict]:
+    entity_cls, generate = GENERATORS[entity_name]
+    rng = random.Random(seed)
+    entities = generate(rng, size)
+    sample = rng.sample(entities, min(SAMPLE_OPS, size))
+    keys = [entity.id for entity in sample]
+    results = []
+    # таблица открывается лениво при первом обращении (и выводит имя через inflect):
+    # открываем её до замеров, чтобы это не попало в задержку первого push
+    await db.count(entity_cls)
+
+    # одиночная запись - на отдельном наборе ключей, чтобы не мешать пакетной
+    singles = generate(random.Random(seed + 1), len(sample))
+    for offset, entity in enumerate(singles):
+        entity.id = size + offset
+    results.append(await timed_each('push', [lambda entity=entity: db.push(entity) for entity in singles]))
+    results.append(await timed_once('push_many', size, lambda: db.push_many(entities)))
+
+    results.append(await timed_each('pull_by_key', [lambda key=key: db.pull(entity_cls, id=key) for key in keys]))
+    results.append(await timed_once('pull_many_by_key', len(keys), lambda: db.pull_many_by_key(entity_cls, keys)))
+    results.append(await timed_concurrent('pull_by_key_concurrent',
+                                          [lambda key=key: db.pull(entity_cls, id=key) for key in keys],
+                                          CONCURRENCY))
+    if entity_cls is Character:
+        worlds = [rng.choice(HOMEWORLDS) for _ in range(20)]
+        results.append(await timed_each('pull_by_index',
+                                        [lambda world=world: db.pull(Character, homeworld=world) for world in worlds]))
+        heights = [rng.randint(60, 260) for _ in range(5)]
+        results.append(await timed_each('pull_scan',
+                                        [lambda height=height: db.pull(Character, height=height) for height in heights]))
+        results.append(await timed_each('pull_range',
+                                        [lambda key=key: db.pull(Character, id__between=(key, key + 99)) for key in keys[:50]]))
+    results.append(await timed_once('pull_all', size + len(singles), lambda: db.pull(entity_cls)))
+
+    results.append(await timed_each('drop', [lambda entity=entity: db.drop(entity) for entity in singles]))
+    results.append(await timed_once('drop_many', size, lambda: db.drop_many(entities)))
+    return results
+
+
+async def bench_engine(engine: str, size: int, seed: int, workdir: str, entity_names: list[str]) -> list[dict]:
+    path = os.path.join(workdir, f"{engine}-{size}")
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    db = Database(os.path.join(path, "db"), engine=engine)
+    results = []
+    try:
+        for entity_name in entity_names:
+            logger.info(f"{engine}: {entity_name} x {size}")
+            for result in await bench_entity(db, entity_name, size, seed):
+                results.append({'engine': engine, 'entity': entity_name, 'size': size} | result)
+    finally:
+        await db.close()
+        shutil.rmtree(path, ignore_errors=True)
+    # пик памяти - один на прогон движка и размера: ru_maxrss не убывает за жизнь процесса
+    peak = peak_rss_mb()
+    return [result | {'peak_rss_mb': peak} for result in results]
+
+
+# Каждый прогон - в отдельном процессе, иначе пик памяти и кэши достаются следующим прогонам
+def bench_process(engine: str, size: int, seed: int, workdir: str, entity_names: list[str]) -> list[dict]:
+    return asyncio.run(bench_engine(engine, size, seed, workdir, entity_names))
+
 
+# Из нескольких прогонов остаётся медианный по пропускной способности, чтобы сравнение не ловило шум
+def median_runs(runs: list[list[dict]]) -> list[dict]:
+    results = []
+    for attempts in zip(*runs):
+        attempts = sorted(attempts, key=lambda result: result['throughput'] or 0)
+        results.append(attempts[len(attempts) // 2] | {'repeat': len(attempts)})
+    return results
 
-def timer(func):
-    def timed_func(**args):
-        start = time.time()
-        for i in range(N_TIMES):
-            func(**args)
-        end = time.time()
-        total = round(1000 * (end - start) / N_TIMES, 3)
-        logger.info(f'Mean time for {N_TIMES} runs taken in seconds for {func.__name__} - {total}ms')
-    return timed_func
 
+def run(args: argparse.Namespace) -> None:
+    if args.repeat <= 0:
+        raise ValueError('"repeat" must be greater than zero!')
+    workdir = args.workdir or tempfile.mkdtemp(prefix="database-benchmark-")
+    results = []
+    for size in args.sizes:
+        for engine in args.engines:
+            runs = []
+            for _ in range(args.repeat):
+                with ProcessPoolExecutor(1, mp_context=get_context('spawn')) as executor:
+                    runs.append(executor.submit(bench_process, engine, size, args.seed, workdir,
+                                                args.entities).result())
+            results += median_runs(runs)
+    output = {'meta': {'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'seed': args.seed,
+                       'repeat': args.repeat,
+                       'sizes': args.sizes,
+                       'engines': args.engines,
+                       'entities': args.entities,
+                       'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')},
+              'results': results}
+    text = json.dumps(output, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text)
+        logger.info(f"Results written to {args.output}")
+    else:
+        print(text)
 
-async def get_people(db: Database, number: int) -> None:
-    url = f"https://swapi.dev/api/people/{number}/"
-    response = requests.get(url)
-    data = response.json()
-    character = Character(data['name'], data['height'])
-    await database_manage(db, character)
 
+# Регрессия - падение пропускной способности или рост p99 больше чем на threshold
+def compare(args: argparse.Namespace) -> int:
+    with open(args.baseline) as file:
+        baseline = json.load(file)['results']
+    with open(args.candidate) as file:
+        candidate = json.load(file)['results']
 
-async def database_manage(db: Database, character: Character) -> None:
-    await db.push(character)
+    def index(results: list[dict]) -> dict[tuple, dict]:
+        return {(result['engine'], result['entity'], result['size'], result['scenario']): result
+                for result in results}
 
+    baseline, candidate = index(baseline), index(candidate)
+    regressions = 0
+    print(f"{'engine':8} {'entity':10} {'size':>8} {'scenario':24} {'throughput':>12} {'p99':>10}")
+    for name in sorted(baseline.keys() & candidate.keys()):
+        old, new = baseline[name], candidate[name]
+        marks, regressed = [], False
+        # знак: у пропускной способности плохо падение, у p99 - рост
+        for metric, worse in (('throughput', -1), ('p99_ms', 1)):
+            if not old.get(metric) or new.get(metric) is None:
+                marks.append("-")
+                continue
+            change = new[metric] / old[metric] - 1
+            marks.append(f"{change:+.1%}")
+            regressed |= worse * change > args.threshold
+        regressions += regressed
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{name[0]:8} {name[1]:10} {name[2]:>8} {name[3]:24} {marks[0]:>12} {marks[1]:>10}{flag}")
+    for name in sorted(baseline.keys() - candidate.keys()):
+        print(f"missing in candidate: {name}")
+    return 1 if regressions else 0
 
-async def asyncio_wrapper(db: Database, input_value: int):
-    tasks = [get_people(db, i) for i in input_value]
-    asyncio.gather(*tasks)
 
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Offline benchmark of the LMDB and SQLite engines")
+    commands = parser.add_subparsers(dest='command', required=True)
 
-@timer
-def using_lmdb(input_value):
-    asyncio.run(asyncio_wrapper(db=lmdb, input_value=input_value))
+    run_parser = commands.add_parser('run', help="run the benchmark and print or save JSON results")
+    run_parser.add_argument('--engines', nargs='+', choices=ENGINES, default=list(ENGINES))
+    run_parser.add_argument('--sizes', nargs='+', type=int, default=list(SIZES))
+    run_parser.add_argument('--entities', nargs='+', choices=list(GENERATORS), default=list(GENERATORS))
+    run_parser.add_argument('--seed', type=int, default=42)
+    run_parser.add_argument('--repeat', type=int, default=3, help="runs per engine and size, median is kept")
+    run_parser.add_argument('--workdir', help="directory for temporary databases")
+    run_parser.add_argument('--output', '-o', help="JSON file for the results")
 
+    compare_parser = commands.add_parser('compare', help="compare two result files, exit 1 on regressions")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help="allowed relative slowdown, 0.1 = 10%%")
 
-@timer
-def using_sqlite(input_value):
-    asyncio.run(asyncio_wrapper(db=sqlite, input_value=input_value))
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+        return 0
+    return compare(args)
 
 
 if __name__ == '__main__':
-    input_value = list(range(1, 10))
-    using_lmdb(input_value=input_value)
-    using_sqlite(input_value=input_value)
+    sys.exit(main())
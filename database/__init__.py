@@ -1,2 +1,3 @@
 from .entities import BaseEntity
 from .database import Database
+from .engines.metrics import Metrics, MetricsRegistry, LoggingSink
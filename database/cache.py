@@ -0,0 +1,114 @@
+from collections import OrderedDict
+import sys
+from time import monotonic
+
+from .engines.codecs import coerce
+
+
+# Примерный размер закэшированных строк: сами словари и значения колонок, без общих объектов
+def estimate_size(value: object) -> int:
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sys.getsizeof(item) for item in value.values())
+    if isinstance(value, list):
+        return sys.getsizeof(value) + sum(estimate_size(item) for item in value)
+    return sys.getsizeof(value)
+
+
+# Кэш строк одной таблицы: ('key', значение ключа) -> строка, ('query', условия...) -> список строк.
+# Вытеснение - LRU по числу записей и примерному объёму, устаревание - по ttl секунд
+class EntityCache:
+    entries: OrderedDict[tuple, tuple[object, float | None, int]]
+
+    def __init__(self,
+                 key: str | None = None,
+                 max_entries: int = 10_000,
+                 ttl: float | None = None,
+                 max_bytes: int | None = None,
+                 key_annotation: object = None) -> None:
+        if max_entries <= 0:
+            raise ValueError('"max_entries" must be greater than zero!')
+        if ttl is not None and ttl <= 0:
+            raise ValueError('"ttl" must be greater than zero!')
+        if max_bytes is not None and max_bytes <= 0:
+            raise ValueError('"max_bytes" must be greater than zero!')
+        self.key = key
+        # записи по ключу хранятся под приведённым к типу колонки значением, как его ищет Database
+        self.key_annotation = key_annotation
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.query_keys = set()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # растёт при каждой записи в таблицу: результат чтения, начатого до записи, не кэшируется
+        self.generation = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, cache_key: tuple) -> object | None:
+        entry = self.entries.get(cache_key)
+        if entry is not None:
+            value, expires, _ = entry
+            if expires is None or expires > monotonic():
+                self.entries.move_to_end(cache_key)
+                self.hits += 1
+                return value
+            self.discard(cache_key)
+        self.misses += 1
+        return None
+
+    def put(self,
+            cache_key: tuple,
+            value: object,
+            generation: int | None = None) -> None:
+        if generation is not None and generation != self.generation:
+            return
+        self.discard(cache_key)
+        size = estimate_size(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        expires = monotonic() + self.ttl if self.ttl is not None else None
+        self.entries[cache_key] = (value, expires, size)
+        self.size += size
+        if cache_key[0] == 'query':
+            self.query_keys.add(cache_key)
+        while len(self.entries) > self.max_entries or self.max_bytes is not None and self.size > self.max_bytes:
+            self.discard(next(iter(self.entries)))
+            self.evictions += 1
+
+    def discard(self, cache_key: tuple) -> None:
+        entry = self.entries.pop(cache_key, None)
+        if entry is not None:
+            self.size -= entry[2]
+            self.query_keys.discard(cache_key)
+
+    # После записи в таблицу: результаты по условиям сбрасываются целиком,
+    # закэшированные строки по ключу заменяются новыми (insert) или удаляются (delete)
+    def invalidate(self,
+                   operation: str,
+                   rows: list[dict[str, object]]) -> None:
+        self.generation += 1
+        for cache_key in list(self.query_keys):
+            self.discard(cache_key)
+        if self.key is None:
+            return
+        for row_data in rows:
+            try:
+                cache_key = ('key', coerce(row_data.get(self.key), self.key_annotation))
+            except (TypeError, ValueError):
+                # ключ, не приводимый к типу колонки, в кэш попасть не мог
+                continue
+            if operation == 'insert' and cache_key in self.entries:
+                self.put(cache_key, dict(row_data))
+            else:
+                self.discard(cache_key)
+
+    def clear(self) -> None:
+        self.generation += 1
+        self.entries.clear()
+        self.query_keys.clear()
+        self.size = 0
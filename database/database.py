@@ -1,50 +1,480 @@
-from .engines import LMDBEngine, SQLiteEngine
-from .entities import BaseEntity
+import asyncio
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterable
+import os
+from typing import TextIO
+
+from .cache import EntityCache
+from .engines import LMDBEngine, MemoryEngine, ShardedLMDBEngine, SQLiteEngine, TieredEngine
+from .engines.codecs import coerce
+from .engines.metrics import Metrics
+from .entities import BaseEntity, known_table_names
+from .frames import FrameBuilder
+from .transfer import RowWriter, read_rows
+
+
+# Ленивое чтение без копирования: сущности из pull читают колонки из снимка при первом
+# обращении, поэтому пользоваться ими можно только внутри async with db.snapshot()
+class Snapshot:
+    def __init__(self,
+                 engine_snapshot: object,
+                 table: Callable[[type[BaseEntity]], Awaitable[str]]) -> None:
+        self.engine_snapshot = engine_snapshot
+        self.table = table
+
+    async def __aenter__(self) -> 'Snapshot':
+        self.engine_snapshot.open()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.engine_snapshot.close()
+
+    async def pull(self,
+                   entity_cls: BaseEntity,
+                   order_by: str | Iterable[str] | None = None,
+                   limit: int | None = None,
+                   offset: int = 0,
+                   **conditions) -> list[BaseEntity]:
+        rows = await self.engine_snapshot.select_lazy(await self.table(entity_cls),
+                                                      conditions if conditions else None,
+                                                      order_by,
+                                                      limit,
+                                                      offset)
+        from_lazy = entity_cls._from_lazy
+        return [from_lazy(data, load) for data, load in rows]
 
 
 class Database:
     def __init__(self,
                  path: str,
                  engine: str = 'lmdb',
+                 write_behind: bool = False,
+                 flush_rows: int = 1000,
+                 flush_interval: float = 0.05,
+                 metrics: Metrics | None = None,
+                 hot: Iterable[type[BaseEntity]] = (),
                  **engine_kwargs) -> None:
         if engine == 'lmdb':
             self.engine = LMDBEngine(path, **engine_kwargs)
         elif engine == 'sqlite':
             self.engine = SQLiteEngine(path, **engine_kwargs)
+        elif engine == 'lmdb-sharded':
+            self.engine = ShardedLMDBEngine(path, **engine_kwargs)
+        elif engine == 'memory':
+            self.engine = MemoryEngine(path, **engine_kwargs)
         else:
             raise ValueError(f"Unknown engine '{engine}' passed!")
+        if flush_rows <= 0:
+            raise ValueError('"flush_rows" must be greater than zero!')
+        # замеры операций движка: задержки, прочитанные и отданные строки, байты, транзакции
+        self.metrics = metrics
+        self.engine.metrics = metrics
         self._init_db()
+        # hot - сущности, таблицы которых целиком держатся в памяти перед движком:
+        # чтения идут из памяти, записи - в движок и в память
+        hot = list(hot)
+        if hot:
+            if engine == 'memory':
+                raise ValueError('"hot" requires a durable engine!')
+            self.engine = TieredEngine(self.engine, {entity_cls.__tablename__ for entity_cls in hot})
 
-    async def push(self, entity: BaseEntity) -> None:
-        data = entity._serialize()
-        await self.engine.insert(entity.__tablename__, data)
-
-    async def pull(self, entity_cls: BaseEntity, **conditions) -> list[BaseEntity]:
-        entity = self._revoke_entity(entity_cls)
-        rows = await self.engine.select(entity.__tablename__,
-                                        conditions if conditions else None)
-        result = []
-        for data in rows:
-            entity = self._revoke_entity(entity_cls)
-            result.append(entity._unserialize(data))
-        return result
-
-    async def drop(self, entity: BaseEntity) -> None:
+        # отложенная запись: push/drop копятся в буфере и уходят в движок одной транзакцией
+        # по достижении flush_rows строк или через flush_interval секунд после первой
+        self.write_behind = write_behind
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        # future есть только у durable-записей: остальных вызывающих никто не ждёт
+        self._buffer: list[tuple[str, BaseEntity, dict[str, object], asyncio.Future | None]] = []
+        # первая ошибка фоновой записи, которую некому было получить; её поднимают flush и close
+        self._flush_error: Exception | None = None
+        self._flush_handle: asyncio.TimerHandle | None = None
+        self._flush_tasks: set[asyncio.Task] = set()
+        self._flush_lock = asyncio.Lock()
+        # кэши чтения по имени таблицы, включаются для отдельных сущностей через enable_cache
+        self.caches: dict[str, EntityCache] = dict()
+
+    async def push(self, entity: BaseEntity, durable: bool = False) -> None:
         data = entity._serialize()
-        await self.engine.delete(entity.__tablename__, data)
+        table_name = await self._table(type(entity))
+        if self.write_behind:
+            future = self._enqueue('insert', entity, data, durable)
+            if durable:
+                await future
+            return
+        await self.engine.insert(table_name, data)
+        self._set_key(entity, data)
+        self._invalidate_cache(table_name, 'insert', [data])
+
+    async def push_many(self,
+                        entities: Iterable[BaseEntity],
+                        chunk_size: int | None = None) -> None:
+        # пакетная запись идёт мимо буфера, но после уже накопленных операций
+        await self.flush()
+        for table_name, (group, rows) in (await self._group_by_table(entities, BaseEntity._serialize)).items():
+            await self.engine.insert_many(table_name, rows, chunk_size)
+            for entity, data in zip(group, rows):
+                self._set_key(entity, data)
+            self._invalidate_cache(table_name, 'insert', rows)
+
+    # Условия: name="Bob", ts__between=(t1, t2), id__in=[...], name__prefix="Bo", ts__lt=t ...
+    async def pull(self,
+                   entity_cls: BaseEntity,
+                   order_by: str | Iterable[str] | None = None,
+                   limit: int | None = None,
+                   offset: int = 0,
+                   **conditions) -> list[BaseEntity]:
+        from_row = entity_cls._from_row
+        table_name = await self._table(entity_cls)
+        cache = self.caches.get(table_name)
+        cache_key = self._cache_key(entity_cls, conditions, order_by, limit, offset) if cache is not None else None
+        if cache_key is not None:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                return [from_row(data) for data in (cached if cache_key[0] == 'query' else [cached])]
+            generation = cache.generation
+
+        rows = await self.engine.select(table_name,
+                                        conditions if conditions else None,
+                                        order_by,
+                                        limit,
+                                        offset)
+        if cache_key is not None and (cache_key[0] == 'query' or rows):
+            cache.put(cache_key, rows if cache_key[0] == 'query' else rows[0], generation)
+        return [from_row(data) for data in rows]
+
+    # Значения колонок без сборки сущностей: для одной колонки (строкой) - список значений,
+    # для списка колонок - список кортежей
+    async def pull_columns(self,
+                           entity_cls: BaseEntity,
+                           columns: str | Iterable[str],
+                           order_by: str | Iterable[str] | None = None,
+                           limit: int | None = None,
+                           offset: int = 0,
+                           **conditions) -> list[object] | list[tuple]:
+        flat = isinstance(columns, str)
+        columns = [columns] if flat else list(columns)
+        rows = await self.engine.select(await self._table(entity_cls),
+                                        conditions if conditions else None,
+                                        order_by,
+                                        limit,
+                                        offset,
+                                        columns)
+        annotations = [entity_cls.__properties__[column] for column in columns]
+        if flat:
+            (column,), (annotation,) = columns, annotations
+            return [coerce(data[column], annotation) for data in rows]
+        return [tuple(coerce(data[column], annotation) for column, annotation in zip(columns, annotations))
+                for data in rows]
+
+    # Результат выборки по колонкам: {колонка: array.array или массив NumPy} без сборки сущностей.
+    # Строки идут страницами по batch_size, поэтому в памяти одновременно лишь одна страница словарей
+    async def pull_frame(self,
+                         entity_cls: BaseEntity,
+                         columns: Iterable[str] | None = None,
+                         batch_size: int | None = None,
+                         as_numpy: bool | None = None,
+                         **conditions) -> dict[str, object]:
+        columns = list(columns) if columns is not None else list(entity_cls.__columns__)
+        builder = FrameBuilder({column: entity_cls.__properties__.get(column) for column in columns}, as_numpy)
+        async for rows in self.engine.select_batches(await self._table(entity_cls),
+                                                     conditions if conditions else None,
+                                                     batch_size,
+                                                     columns):
+            builder.extend(rows)
+        return builder.result()
+
+    async def count(self, entity_cls: BaseEntity, **conditions) -> int:
+        return await self.engine.count(await self._table(entity_cls), conditions if conditions else None)
+
+    async def exists(self, entity_cls: BaseEntity, **conditions) -> bool:
+        return await self.engine.exists(await self._table(entity_cls), conditions if conditions else None)
+
+    async def pull_many_by_key(self, entity_cls: BaseEntity, keys: Iterable[object]) -> list[BaseEntity]:
+        from_row = entity_cls._from_row
+        table_name = await self._table(entity_cls)
+        cache = self.caches.get(table_name)
+        if cache is None or entity_cls.__key__ is None:
+            rows = await self.engine.select_many_by_key(table_name, keys)
+            return [from_row(data) for data in rows]
+
+        # из движка читаются только ключи, которых нет в кэше
+        annotation = entity_cls.__properties__[entity_cls.__key__]
+        keys = [coerce(key, annotation) for key in keys]
+        found = dict()
+        for key in keys:
+            if (data := cache.get(('key', key))) is not None:
+                found[key] = data
+        missing = [key for key in keys if key not in found]
+        if missing:
+            generation = cache.generation
+            for data in await self.engine.select_many_by_key(table_name, missing):
+                key = coerce(data[entity_cls.__key__], annotation)
+                found[key] = data
+                cache.put(('key', key), data, generation)
+        return [from_row(found[key]) for key in keys if key in found]
+
+    async def stream(self,
+                     entity_cls: BaseEntity,
+                     batch_size: int | None = None,
+                     batched: bool = False,
+                     **conditions) -> AsyncIterator[BaseEntity | list[BaseEntity]]:
+        from_row = entity_cls._from_row
+        async for rows in self.engine.select_batches(await self._table(entity_cls),
+                                                     conditions if conditions else None,
+                                                     batch_size):
+            entities = [from_row(data) for data in rows]
+            if batched:
+                yield entities
+            else:
+                for entity in entities:
+                    yield entity
+
+    async def drop(self, entity: BaseEntity, durable: bool = False) -> None:
+        data = self._drop_data(entity)
+        table_name = await self._table(type(entity))
+        if self.write_behind:
+            future = self._enqueue('delete', entity, data, durable)
+            if durable:
+                await future
+            return
+        await self.engine.delete(table_name, data)
+        self._invalidate_cache(table_name, 'delete', [data])
+
+    async def drop_many(self,
+                        entities: Iterable[BaseEntity],
+                        chunk_size: int | None = None) -> None:
+        await self.flush()
+        for table_name, (_, rows) in (await self._group_by_table(entities, self._drop_data)).items():
+            await self.engine.delete_many(table_name, rows, chunk_size)
+            self._invalidate_cache(table_name, 'delete', rows)
 
+    # Потоковая загрузка мимо push: source - сущности либо файл JSON Lines или CSV (путь или
+    # открытый текстовый файл, тогда с format). В памяти одновременно лишь одна пачка строк,
+    # поэтому ключи автоинкремента в переданные сущности не проставляются
+    async def bulk_load(self,
+                        entity_cls: BaseEntity,
+                        source: Iterable[BaseEntity] | str | os.PathLike | TextIO,
+                        format: str | None = None,
+                        chunk_size: int | None = None) -> int:
+        if chunk_size is not None and chunk_size <= 0:
+            raise ValueError('"chunk_size" must be greater than zero!')
+        await self.flush()
+        table_name = await self._table(entity_cls)
+        if isinstance(source, (str, os.PathLike)) or hasattr(source, 'read'):
+            rows = read_rows(source, entity_cls.__properties__, format)
+        else:
+            rows = (entity._serialize() for entity in source)
+        try:
+            return await self.engine.bulk_load(table_name, rows, chunk_size)
+        finally:
+            rows.close()
+            # строк слишком много, чтобы сверять кэш с каждой
+            if (cache := self.caches.get(table_name)) is not None:
+                cache.clear()
+
+    # Потоковая выгрузка строк сущности (условия - как в pull) в файл JSON Lines или CSV:
+    # sink - путь или открытый текстовый файл, тогда с format. Отдаёт число выгруженных строк
+    async def export(self,
+                     entity_cls: BaseEntity,
+                     sink: str | os.PathLike | TextIO,
+                     format: str | None = None,
+                     batch_size: int | None = None,
+                     **conditions) -> int:
+        await self.flush()
+        writer = RowWriter(sink, entity_cls.__properties__, format)
+        try:
+            async for rows in self.engine.select_batches(await self._table(entity_cls),
+                                                         conditions if conditions else None,
+                                                         batch_size):
+                writer.write(rows)
+        finally:
+            writer.close()
+        return writer.rows_written
+
+    # Кэш чтения для сущности: pull и pull_many_by_key сначала смотрят в него,
+    # push и drop через эту Database обновляют его сразу после записи
+    def enable_cache(self,
+                     entity_cls: BaseEntity,
+                     max_entries: int = 10_000,
+                     ttl: float | None = None,
+                     max_bytes: int | None = None) -> EntityCache:
+        key_annotation = entity_cls.__properties__[entity_cls.__key__] if entity_cls.__key__ is not None else None
+        cache = EntityCache(entity_cls.__key__, max_entries, ttl, max_bytes, key_annotation)
+        self.caches[entity_cls.__tablename__] = cache
+        return cache
+
+    def disable_cache(self, entity_cls: BaseEntity) -> None:
+        self.caches.pop(entity_cls.__tablename__, None)
+
+    def snapshot(self) -> Snapshot:
+        return Snapshot(self.engine.snapshot(), self._table)
+
+    # Копия базы в каталог path; отложенные записи сначала сбрасываются в движок
+    async def compact_backup(self, path: str) -> None:
+        await self.flush()
+        await self.engine.compact_backup(path)
+
+    # Сбрасывает буфер; если раньше фоновая запись не-durable операций упала, поднимает её ошибку
+    async def flush(self) -> None:
+        await self._flush(raise_errors=True)
+        error, self._flush_error = self._flush_error, None
+        if error is not None:
+            raise error
+
+    async def close(self) -> None:
+        try:
+            await self.flush()
+        finally:
+            self.engine.close()
+
+    def _enqueue(self,
+                 operation: str,
+                 entity: BaseEntity,
+                 data: dict[str, object],
+                 durable: bool) -> asyncio.Future | None:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future() if durable else None
+        self._buffer.append((operation, entity, data, future))
+        if len(self._buffer) >= self.flush_rows:
+            self._start_flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.flush_interval, self._start_flush)
+        return future
+
+    def _start_flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        # ошибка фоновой записи доходит до durable-вызывающих через их future,
+        # а если в пачке были не-durable операции - до следующего flush или close
+        task = asyncio.ensure_future(self._flush(raise_errors=False))
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def _flush(self, raise_errors: bool) -> None:
+        async with self._flush_lock:
+            if self._flush_handle is not None:
+                self._flush_handle.cancel()
+                self._flush_handle = None
+            buffer, self._buffer = self._buffer, []
+            if not buffer:
+                return
+
+            # подряд идущие операции над одной таблицей склеиваются в одну пачку
+            operations = []
+            for operation, entity, data, _ in buffer:
+                table_name = await self._table(type(entity))
+                if operations and operations[-1][:2] == (operation, table_name):
+                    operations[-1][2].append(data)
+                else:
+                    operations.append((operation, table_name, [data]))
+            try:
+                await self.engine.write_batch(operations)
+            except Exception as error:
+                for operation, table_name, rows in operations:
+                    self._invalidate_cache(table_name, operation, rows)
+                for *_, future in buffer:
+                    if future is not None and not future.done():
+                        future.set_exception(error)
+                if raise_errors:
+                    raise
+                if self._flush_error is None and any(future is None for *_, future in buffer):
+                    self._flush_error = error
+                return
+            for operation, table_name, rows in operations:
+                self._invalidate_cache(table_name, operation, rows)
+            for operation, entity, data, future in buffer:
+                if operation == 'insert':
+                    self._set_key(entity, data)
+                if future is not None and not future.done():
+                    future.set_result(None)
+
+    async def _group_by_table(self,
+                              entities: Iterable[BaseEntity],
+                              serialize: Callable[[BaseEntity], dict[str, object]]
+                              ) -> dict[str, tuple[list[BaseEntity], list[dict[str, object]]]]:
+        groups = dict()
+        for entity in entities:
+            group, rows = groups.setdefault(await self._table(type(entity)), ([], []))
+            group.append(entity)
+            rows.append(serialize(entity))
+        return groups
+
+    # Ключ кэша: по значению ключа для выборки по одному ключу, иначе нормализованные условия.
+    # None - выборку не кэшировать (в условиях нехэшируемые значения)
+    def _cache_key(self,
+                   entity_cls: BaseEntity,
+                   conditions: dict[str, object],
+                   order_by: str | Iterable[str] | None,
+                   limit: int | None,
+                   offset: int) -> tuple | None:
+        key = entity_cls.__key__
+        if (key is not None and list(conditions) == [key] and conditions[key] is not None
+                and limit != 0 and offset == 0):
+            return ('key', coerce(conditions[key], entity_cls.__properties__[key]))
+        if isinstance(order_by, str):
+            order_by = [order_by]
+        cache_key = ('query',
+                     tuple(sorted((name, tuple(value) if isinstance(value, (list, set, frozenset)) else value)
+                                  for name, value in conditions.items())),
+                     tuple(order_by) if order_by is not None else None,
+                     limit,
+                     offset)
+        try:
+            hash(cache_key)
+        except TypeError:
+            return None
+        return cache_key
+
+    def _invalidate_cache(self,
+                          table_name: str,
+                          operation: str,
+                          rows: list[dict[str, object]]) -> None:
+        cache = self.caches.get(table_name)
+        if cache is not None:
+            cache.invalidate(operation, rows)
+
+    # Сущность с ключом удаляется по ключу, без сравнения остальных колонок
+    def _drop_data(self, entity: BaseEntity) -> dict[str, object]:
+        if entity.__key__ is not None:
+            return {entity.__key__: getattr(entity, entity.__key__)}
+        return entity._serialize()
+
+    # Проставляет сущности ключ, выданный движком при автоинкременте
+    def _set_key(self, entity: BaseEntity, data: dict[str, object]) -> None:
+        if entity.__autoincrement__:
+            setattr(entity, entity.__key__, data[entity.__key__])
+
+    # Таблицы открываются лениво, при первом обращении к классу сущности; здесь только
+    # читается каталог имён, чтобы известным сущностям не выводить имена заново
     def _init_db(self) -> None:
-        for entity_cls in self._get_all_entities():
-            entity = self._revoke_entity(entity_cls)
-            self.engine.create_table(entity.__tablename__,
-                                     entity._get_props())
-
-    def _get_all_entities(self, cls=BaseEntity) -> list[BaseEntity]:
-        return set(cls.__subclasses__()).union(
-            [s for c in cls.__subclasses__() for s in self._get_all_entities(cls=c)]
-        )
-
-    def _revoke_entity(self, entity_cls) -> BaseEntity:
-        entity: BaseEntity = entity_cls.__new__(entity_cls)
-        super(type(entity), entity).__init__()
-        return entity
+        self._tables: dict[type[BaseEntity], str] = dict()
+        # по таблице: первые обращения из нескольких задач сразу открывают её один раз
+        self._table_locks: dict[str, asyncio.Lock] = dict()
+        self._entity_names = self.engine.entity_names()
+        known_table_names.update(self._entity_names)
+
+    async def _table(self, entity_cls: type[BaseEntity]) -> str:
+        table_name = self._tables.get(entity_cls)
+        if table_name is None:
+            async with self._table_locks.setdefault(entity_cls.__tablename__, asyncio.Lock()):
+                table_name = self._tables.get(entity_cls)
+                if table_name is None:
+                    table_name = self._tables[entity_cls] = await self._open_table(entity_cls)
+        return table_name
+
+    # Создание таблицы и запись в каталог имён идут через run_schema, а не в потоке событий:
+    # это DDL, транзакции записи и, на существующих данных, построение индексов
+    async def _open_table(self, entity_cls: type[BaseEntity]) -> str:
+        table_name = entity_cls.__tablename__
+        # ленивый наследник живёт в таблице своей сущности
+        if table_name not in self.engine.tables:
+            await self.engine.run_schema(self.engine.create_table,
+                                         table_name,
+                                         entity_cls.__properties__,
+                                         entity_cls.__key__,
+                                         list(entity_cls.__indexes__),
+                                         entity_cls.__autoincrement__)
+        if self._entity_names.get(entity_cls.__name__) != table_name:
+            await self.engine.run_schema(self.engine.save_entity_name, entity_cls.__name__, table_name)
+            self._entity_names[entity_cls.__name__] = table_name
+        return table_name
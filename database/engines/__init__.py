@@ -1,3 +1,6 @@
 from .base_engine import BaseEngine
 from .sqlite_engine import SQLiteEngine
 from .lmdb_engine import LMDBEngine
+from .sharded_lmdb_engine import ShardedLMDBEngine
+from .memory_engine import MemoryEngine
+from .tiered_engine import TieredEngine
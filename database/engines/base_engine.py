@@ -1,31 +1,99 @@
 from abc import abstractmethod, ABC
+import asyncio
+from collections.abc import AsyncIterator, Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from multiprocessing import cpu_count
 import os
 
 from libscrc import iso
 
+from .codecs import coerce, column_kind
+from .metrics import Metrics, NULL_PROBE, Probe
+from .query import Filter, Order, parse_conditions, parse_order
+
+
+# строк в одной транзакции массовой загрузки
+BULK_CHUNK_SIZE = 100_000
+
 
 def crc64(obj: object) -> int:
     return iso(str(obj).encode())
 
 
+def chunked(rows: Iterable[dict], size: int) -> Iterator[list[dict]]:
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
 class Table(ABC):
     columns: dict[str, object]
     key: str = None
+    autoincrement: bool = False
+    indexes: list[str]
+    index_columns: list[tuple[str, ...]]
 
+    # indexes - колонки или кортежи колонок составных индексов
     def __init__(self,
-                 columns: list[str],
-                 key: str | None = None) -> None:
+                 columns: dict[str, object],
+                 key: str | None = None,
+                 indexes: list[str | tuple[str, ...]] | None = None,
+                 autoincrement: bool = False) -> None:
         self.columns = columns
         if key is not None:
             if key not in columns:
                 raise ValueError(f"Key {key} not presented in column list!")
             self.key = key
+        if autoincrement:
+            if key is None or column_kind(columns[key]) != 'int':
+                raise ValueError("Autoincrement requires an integer key!")
+            self.autoincrement = True
+        # indexes - одиночные индексы по колонкам, index_columns - все объявленные индексы
+        self.indexes = []
+        self.index_columns = []
+        for index in indexes or []:
+            index = (index,) if isinstance(index, str) else tuple(index)
+            if not index:
+                raise ValueError("Index requires at least one column!")
+            for column in index:
+                if column not in columns:
+                    raise ValueError(f"Indexed column {column} not presented in column list!")
+            # ключ и так ищется напрямую
+            if index[0] == key or index in self.index_columns:
+                continue
+            self.index_columns.append(index)
+            # движки без составных индексов индексируют первую колонку
+            if index[0] not in self.indexes:
+                self.indexes.append(index[0])
+
+    def coerce(self, column: str, value: object) -> object:
+        return coerce(value, self.columns[column])
 
+    def filters(self, conditions: dict[str, object] | None) -> list[Filter]:
+        return parse_conditions(self.columns, conditions)
+
+    def order(self, order_by: str | Iterable[str] | None) -> Order:
+        return parse_order(self.columns, order_by)
+
+    def projection(self, columns: Iterable[str] | None) -> tuple[str, ...] | None:
+        if columns is None:
+            return None
+        columns = tuple(columns)
+        if not columns:
+            raise ValueError("Projection requires at least one column!")
+        for column in columns:
+            if column not in self.columns:
+                raise KeyError(f"Key {column} not presented in column list!")
+        return columns
+
+    # columns - колонки, которые нужны из строки (None - все)
     @abstractmethod
     def process_db_row(self,
                        row_data: object,
                        row_key: str,
-                       conditions: dict[str, object] | None = None) -> list[dict]:
+                       conditions: list[Filter] | None = None,
+                       columns: tuple[str, ...] | None = None) -> list[dict]:
         raise NotImplementedError
 
     @abstractmethod
@@ -37,17 +105,56 @@ class Table(ABC):
 class BaseEngine(ABC):
     path: str
     tables: dict[str, Table]
+    chunk_size: int
+    threads_count: int
+    read_executor: ThreadPoolExecutor | None
+    write_executor: ThreadPoolExecutor | None
+    metrics: Metrics | None
+    # False - движок не ведёт ввод-вывод в своих потоках (работает в памяти или через другие
+    # движки), и пулы читателей и писателя ему не создаются
+    threaded_io: bool = True
 
-    def __init__(self, path: str) -> None:
+    def __init__(self,
+                 path: str,
+                 chunk_size: int = 10_000,
+                 threads_count: int = -1) -> None:
+        if chunk_size <= 0:
+            raise ValueError('"chunk_size" must be greater than zero!')
+        if threads_count == -1:
+            self.threads_count = cpu_count()
+        elif threads_count <= 0:
+            raise ValueError('"threads_count" must be greater than zero or -1 to use all CPU cores!')
+        else:
+            self.threads_count = threads_count
         self.path = path
-        os.makedirs(os.sep.join(os.path.normpath(path).split(os.sep)[:-1]), exist_ok=True)
+        self.chunk_size = chunk_size
+        # путь без каталога (":memory:", имя файла в текущем каталоге) создавать нечего
+        if directory := os.sep.join(os.path.normpath(path).split(os.sep)[:-1]):
+            os.makedirs(directory, exist_ok=True)
         self.tables = dict()
+        # замеры операций; None - выключены и ничего не стоят
+        self.metrics = None
+
+        # читатели идут параллельно, все записи - через единственный поток-писатель
+        self.read_executor = None
+        self.write_executor = None
+        if self.threaded_io:
+            self.read_executor = ThreadPoolExecutor(self.threads_count,
+                                                    thread_name_prefix=f"{type(self).__name__}-reader")
+            self.write_executor = ThreadPoolExecutor(1, thread_name_prefix=f"{type(self).__name__}-writer")
+
+    def close(self) -> None:
+        if self.threaded_io:
+            self.read_executor.shutdown()
+            self.write_executor.shutdown()
 
     @abstractmethod
     def create_table(self,
                      name: str,
-                     columns: list[str],
-                     key: str | None = None) -> None:
+                     columns: dict[str, object],
+                     key: str | None = None,
+                     indexes: list[str | tuple[str, ...]] | None = None,
+                     autoincrement: bool = False) -> None:
         raise NotImplementedError
 
     @abstractmethod
@@ -60,12 +167,48 @@ class BaseEngine(ABC):
     def delete_table(self, name: str) -> None:
         raise NotImplementedError
 
+    # Условия - равенства и "колонка__оператор" (lt, le, gt, ge, between, in, prefix),
+    # order_by - "колонка" или "-колонка" (по убыванию) либо их список,
+    # columns - вернуть только эти колонки, остальные не раскодируются
     @abstractmethod
     async def select(self,
                      table_name: str,
-                     conditions: dict[str, object] | None = None) -> list[dict]:
+                     conditions: dict[str, object] | None = None,
+                     order_by: str | Iterable[str] | None = None,
+                     limit: int | None = None,
+                     offset: int = 0,
+                     columns: Iterable[str] | None = None) -> list[dict]:
         raise NotImplementedError
 
+    @abstractmethod
+    async def count(self,
+                    table_name: str,
+                    conditions: dict[str, object] | None = None) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def exists(self,
+                     table_name: str,
+                     conditions: dict[str, object] | None = None) -> bool:
+        raise NotImplementedError
+
+    # Постраничная выборка: память ограничена размером страницы, а не таблицы
+    @abstractmethod
+    def select_batches(self,
+                       table_name: str,
+                       conditions: dict[str, object] | None = None,
+                       batch_size: int | None = None,
+                       columns: Iterable[str] | None = None) -> AsyncIterator[list[dict]]:
+        raise NotImplementedError
+
+    # Строки по списку значений ключа в одной читающей транзакции, в порядке ключей
+    @abstractmethod
+    async def select_many_by_key(self,
+                                 table_name: str,
+                                 keys: Iterable[object]) -> list[dict]:
+        raise NotImplementedError
+
+    # insert и insert_many с автоинкрементом проставляют выданный ключ в переданные строки
     @abstractmethod
     async def insert(self,
                      table_name: str,
@@ -77,3 +220,74 @@ class BaseEngine(ABC):
                      table_name: str,
                      row_data: dict[str, object]) -> None:
         raise NotImplementedError
+
+    @abstractmethod
+    async def insert_many(self,
+                          table_name: str,
+                          rows: Iterable[dict[str, object]],
+                          chunk_size: int | None = None) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def delete_many(self,
+                          table_name: str,
+                          rows: Iterable[dict[str, object]],
+                          chunk_size: int | None = None) -> None:
+        raise NotImplementedError
+
+    # Применяет операции ('insert' или 'delete', таблица, строки) по порядку в одной транзакции
+    @abstractmethod
+    async def write_batch(self, operations: list[tuple[str, str, list[dict[str, object]]]]) -> None:
+        raise NotImplementedError
+
+    # Потоковая загрузка: строки берутся из rows пачками по chunk_size, каждая пачка пишется
+    # одной транзакцией, поэтому в памяти лишь одна пачка. Отдаёт число загруженных строк
+    async def bulk_load(self,
+                        table_name: str,
+                        rows: Iterable[dict[str, object]],
+                        chunk_size: int | None = None) -> int:
+        loaded = 0
+        for chunk in chunked(rows, chunk_size or BULK_CHUNK_SIZE):
+            await self.insert_many(table_name, chunk, len(chunk))
+            loaded += len(chunk)
+        return loaded
+
+    # Каталог имён сущностей, хранимый в самой базе: имя класса -> имя таблицы.
+    # По нему Database не выводит имена таблиц заново при каждом запуске
+    @abstractmethod
+    def entity_names(self) -> dict[str, str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_entity_name(self,
+                         entity_name: str,
+                         table_name: str) -> None:
+        raise NotImplementedError
+
+    # Снимок для ленивого чтения без копирования; есть не у всех движков
+    def snapshot(self) -> object:
+        raise NotImplementedError(f"{type(self).__name__} doesn't support snapshots!")
+
+    # Дефрагментированная копия базы в каталог path на ходу; есть не у всех движков
+    async def compact_backup(self, path: str) -> None:
+        raise NotImplementedError(f"{type(self).__name__} doesn't support compact backups!")
+
+    # Синхронные операции со схемой (create_table, save_entity_name) для вызова из потока событий.
+    # Они идут в отдельном потоке, но не в потоке-писателе: SQLiteEngine сам отправляет туда DDL и ждёт
+    async def run_schema(self, func: Callable, *args) -> object:
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    # Замер операции: with self._measure(...) as probe, функции для потоков - через probe.wrap
+    def _measure(self,
+                 operation: str,
+                 table_name: str | None,
+                 conditions: dict[str, object] | None = None) -> Probe:
+        if self.metrics is None:
+            return NULL_PROBE
+        return self.metrics.probe(operation, table_name, conditions)
+
+    async def _run_read(self, func: Callable, *args) -> object:
+        return await asyncio.get_running_loop().run_in_executor(self.read_executor, func, *args)
+
+    async def _run_write(self, func: Callable, *args) -> object:
+        return await asyncio.get_running_loop().run_in_executor(self.write_executor, func, *args)
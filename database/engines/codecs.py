@@ -0,0 +1,360 @@
+from abc import abstractmethod, ABC
+from collections.abc import Callable
+from pickle import dumps, loads
+from struct import Struct, error as StructError
+from types import NoneType, UnionType
+from typing import Union, get_args, get_origin
+
+
+# Виды колонок: числа хранятся упакованными, остальное - с префиксом длины
+FIXED_KINDS = {'int': 'q', 'float': 'd', 'bool': '?'}
+FIXED_SIZES = {kind: Struct('<' + code).size for kind, code in FIXED_KINDS.items()}
+KINDS = {int: 'int', float: 'float', bool: 'bool', str: 'str', bytes: 'bytes'}
+ANNOTATION_NAMES = {'int': int, 'float': float, 'bool': bool, 'str': str, 'bytes': bytes}
+
+PICKLE_PROTOCOL_MARK = 0x80
+BINARY_FORMAT = 0x01
+HEADER = Struct('<BH')
+LENGTH = Struct('<I')
+FLOAT_KEY = Struct('>d')
+INT_KEY_OFFSET = 2**63
+
+Layout = list[tuple[str, str]]
+
+# типы колонок по аннотациям: разбор аннотации на каждое значение дороже самой записи
+_column_types: dict[object, object] = dict()
+
+
+def column_type(annotation: object) -> object:
+    try:
+        return _column_types[annotation]
+    except KeyError:
+        python_type = _column_types[annotation] = resolve_column_type(annotation)
+        return python_type
+    except TypeError:
+        # нехэшируемая аннотация
+        return resolve_column_type(annotation)
+
+
+def resolve_column_type(annotation: object) -> object:
+    if isinstance(annotation, str):
+        annotation = ANNOTATION_NAMES.get(annotation.removesuffix(' | None'), object)
+    # int | None и Optional[int] хранятся как int с признаком NULL
+    if get_origin(annotation) in (Union, UnionType):
+        args = [arg for arg in get_args(annotation) if arg is not NoneType]
+        if len(args) == 1:
+            return column_type(args[0])
+    return annotation
+
+
+def column_kind(annotation: object) -> str:
+    return KINDS.get(column_type(annotation), 'object')
+
+
+def coerce(value: object, annotation: object) -> object:
+    python_type = column_type(annotation)
+    if value is None or not isinstance(python_type, type) or isinstance(value, python_type):
+        return value
+    # старые строки хранили всё через str()
+    if python_type is bool and isinstance(value, str):
+        return value == 'True'
+    return python_type(value)
+
+
+# Ключи кодируются так, чтобы побайтовый порядок совпадал с порядком значений:
+# целые - big-endian со сдвигом знака, вещественные - IEEE 754 с инверсией для отрицательных
+def encode_key(value: object, annotation: object) -> bytes:
+    kind = column_kind(annotation)
+    value = coerce(value, annotation)
+    if kind in ('int', 'bool'):
+        if not -INT_KEY_OFFSET <= value < INT_KEY_OFFSET:
+            raise ValueError(f"Integer key {value} is out of the 64-bit range!")
+        return (int(value) + INT_KEY_OFFSET).to_bytes(8, 'big')
+    if kind == 'float':
+        bits = int.from_bytes(FLOAT_KEY.pack(value), 'big')
+        bits = bits ^ (2**64 - 1) if bits >> 63 else bits | 1 << 63
+        return bits.to_bytes(8, 'big')
+    if kind == 'bytes':
+        return bytes(value)
+    return str(value).encode()
+
+
+def decode_key(key: bytes, annotation: object) -> object:
+    kind = column_kind(annotation)
+    if kind in ('int', 'bool'):
+        return coerce(int.from_bytes(key, 'big') - INT_KEY_OFFSET, annotation)
+    if kind == 'float':
+        bits = int.from_bytes(key, 'big')
+        bits = bits ^ 1 << 63 if bits >> 63 else bits ^ (2**64 - 1)
+        return FLOAT_KEY.unpack(bits.to_bytes(8, 'big'))[0]
+    if kind == 'bytes':
+        return bytes(key)
+    return coerce(bytes(key).decode(), annotation)
+
+
+class BaseCodec(ABC):
+    columns: dict[str, object]
+    history: list[Layout]
+
+    def __init__(self,
+                 columns: dict[str, object],
+                 history: list[Layout] | None = None) -> None:
+        self.columns = columns
+        self.history = list(history or [])
+
+    @abstractmethod
+    def encode(self, row_data: dict[str, object]) -> bytes:
+        raise NotImplementedError
+
+    # columns - раскодировать только эти колонки (None - все)
+    @abstractmethod
+    def decode(self,
+               value: bytes,
+               columns: tuple[str, ...] | None = None) -> dict[str, object]:
+        raise NotImplementedError
+
+    # Функция, достающая из значения строки только колонки columns - списком в том же порядке.
+    # Отсутствующие в строке колонки - None
+    def extractor(self, columns: tuple[str, ...]) -> Callable[[bytes], list[object]]:
+        def extract(value: bytes) -> list[object]:
+            data = self.decode(value, columns)
+            return [data.get(column) for column in columns]
+
+        return extract
+
+    def _decode_pickle(self,
+                       value: bytes,
+                       columns: tuple[str, ...] | None = None) -> dict[str, object]:
+        data = loads(value)
+        if columns is not None:
+            data = {column: data[column] for column in columns if column in data}
+        for column in data:
+            if column in self.columns:
+                data[column] = coerce(data[column], self.columns[column])
+        return data
+
+
+# Словарь колонок целиком через pickle, как хранились строки до появления кодеков
+class PickleCodec(BaseCodec):
+    def encode(self, row_data: dict[str, object]) -> bytes:
+        return dumps(row_data)
+
+    def decode(self,
+               value: bytes,
+               columns: tuple[str, ...] | None = None) -> dict[str, object]:
+        return self._decode_pickle(value, columns)
+
+
+# Строка = заголовок (формат, версия схемы) + битовая маска NULL
+# + упакованные числовые колонки + колонки переменной длины с префиксом длины.
+# Имена колонок в строке не хранятся: раскладка берётся из истории схем по версии
+class BinaryCodec(BaseCodec):
+    def __init__(self,
+                 columns: dict[str, object],
+                 history: list[Layout] | None = None) -> None:
+        super().__init__(columns, history)
+        layout = [(column, column_kind(annotation)) for column, annotation in columns.items()]
+        if layout in self.history:
+            self.version = self.history.index(layout)
+        else:
+            self.version = len(self.history)
+            self.history.append(layout)
+        self.layout = layout
+        self.header = HEADER.pack(BINARY_FORMAT, self.version)
+        self.decoders = [self._compile_decoder(old_layout) for old_layout in self.history]
+        # декодеры под набор колонок строятся при первом запросе
+        self.projections: dict[tuple[str, ...], list[Callable[[bytes], dict[str, object]]]] = dict()
+        self.extractors: dict[tuple[str, ...], Callable[[bytes], list[object]]] = dict()
+
+        self.fixed_columns = [(column, column_type(columns[column]))
+                              for column, kind in layout if kind in FIXED_KINDS]
+        self.var_columns = [(column, kind) for column, kind in layout if kind not in FIXED_KINDS]
+        self.fixed = Struct('<' + ''.join(FIXED_KINDS[kind] for _, kind in layout if kind in FIXED_KINDS))
+        self.mask_size = (len(layout) + 7) // 8
+
+    def encode(self, row_data: dict[str, object]) -> bytes:
+        mask = 0
+        for position, (column, _) in enumerate(self.layout):
+            if row_data.get(column) is None:
+                mask |= 1 << position
+
+        fixed = []
+        for column, python_type in self.fixed_columns:
+            value = row_data.get(column)
+            if value is None:
+                value = 0
+            elif value.__class__ is not python_type:
+                value = coerce(value, self.columns[column])
+            fixed.append(value)
+
+        try:
+            packed = self.fixed.pack(*fixed)
+        except StructError:
+            # целое вне int64 в упакованную колонку не влезает: такая строка целиком уходит
+            # в pickle, как до появления кодеков, и decode узнаёт её по первому байту
+            return dumps(row_data)
+        parts = [self.header, mask.to_bytes(self.mask_size, 'little'), packed]
+        for column, kind in self.var_columns:
+            value = row_data.get(column)
+            if value is None:
+                data = b''
+            elif kind == 'str':
+                data = str(value).encode()
+            elif kind == 'bytes':
+                data = bytes(value)
+            else:
+                data = dumps(value)
+            parts.append(LENGTH.pack(len(data)))
+            parts.append(data)
+        return b''.join(parts)
+
+    def decode(self,
+               value: bytes,
+               columns: tuple[str, ...] | None = None) -> dict[str, object]:
+        if value[0] == PICKLE_PROTOCOL_MARK:
+            return self._decode_pickle(value, columns)
+        _, version = HEADER.unpack_from(value)
+        if columns is None:
+            return self.decoders[version](value)
+        decoders = self.projections.get(columns)
+        if decoders is None:
+            decoders = self.projections[columns] = [self._compile_decoder(old_layout, columns)
+                                                    for old_layout in self.history]
+        return decoders[version](value)
+
+    def extractor(self, columns: tuple[str, ...]) -> Callable[[bytes], list[object]]:
+        extract = self.extractors.get(columns)
+        if extract is not None:
+            return extract
+        by_version = [self._compile_extractor(old_layout, columns) for old_layout in self.history]
+        decode_pickle = self._decode_pickle
+
+        def extract(value: bytes) -> list[object]:
+            if value[0] == PICKLE_PROTOCOL_MARK:
+                data = decode_pickle(value, columns)
+                return [data.get(column) for column in columns]
+            # версия схемы - uint16 little-endian сразу за байтом формата
+            return by_version[value[1] | value[2] << 8](value)
+
+        self.extractors[columns] = extract
+        return extract
+
+    # Извлечение колонок без словаря: числовые распаковываются одним Struct с пропуском
+    # ненужных, колонки переменной длины читаются только до последней нужной
+    def _compile_extractor(self,
+                           layout: Layout,
+                           columns: tuple[str, ...]) -> Callable[[bytes], list[object]]:
+        targets = {column: number for number, column in enumerate(columns)}
+        fixed_layout = [(column, kind) for column, kind in layout if kind in FIXED_KINDS]
+        fixed = Struct('<' + ''.join(FIXED_KINDS[kind] if column in targets else f'{FIXED_SIZES[kind]}x'
+                                     for column, kind in fixed_layout))
+        fixed_targets = [targets[column] for column, _ in fixed_layout if column in targets]
+        var_layout = [(column, kind) for column, kind in layout if kind not in FIXED_KINDS]
+        wanted_var = [number for number, (column, _) in enumerate(var_layout) if column in targets]
+        var_layout = var_layout[:wanted_var[-1] + 1] if wanted_var else []
+        var_targets = [(targets.get(column), kind) for column, kind in var_layout]
+        mask_size = (len(layout) + 7) // 8
+        null_targets = [(targets[column], position) for position, (column, _) in enumerate(layout)
+                        if column in targets]
+        kinds = dict(layout)
+        changed = [(targets[column], self.columns[column]) for column in columns
+                   if column in kinds and column in self.columns and column_kind(self.columns[column]) != kinds[column]]
+        width = len(columns)
+        data_offset = HEADER.size + mask_size
+        unpack_from = fixed.unpack_from
+
+        # только числовые колонки в порядке раскладки - список получается прямо из Struct
+        if not var_layout and not changed and fixed_targets == list(range(width)):
+            def extract_fixed(value: bytes) -> list[object]:
+                values = list(unpack_from(value, data_offset))
+                mask = int.from_bytes(value[HEADER.size:data_offset], 'little')
+                if mask:
+                    for target, position in null_targets:
+                        if mask >> position & 1:
+                            values[target] = None
+                return values
+
+            return extract_fixed
+
+        def extract(value: bytes) -> list[object]:
+            values = [None] * width
+            for target, item in zip(fixed_targets, unpack_from(value, data_offset)):
+                values[target] = item
+            offset = data_offset + fixed.size
+            for target, kind in var_targets:
+                (length,) = LENGTH.unpack_from(value, offset)
+                offset += LENGTH.size + length
+                if target is None:
+                    continue
+                raw = value[offset - length:offset]
+                if kind == 'str':
+                    values[target] = bytes(raw).decode()
+                elif kind == 'bytes':
+                    values[target] = bytes(raw)
+                else:
+                    values[target] = loads(raw) if length else None
+            mask = int.from_bytes(value[HEADER.size:data_offset], 'little')
+            if mask:
+                for target, position in null_targets:
+                    if mask >> position & 1:
+                        values[target] = None
+            for target, annotation in changed:
+                values[target] = coerce(values[target], annotation)
+            return values
+
+        return extract
+
+    def _compile_decoder(self,
+                         layout: Layout,
+                         projection: tuple[str, ...] | None = None) -> Callable[[bytes], dict[str, object]]:
+        def wanted(column: str) -> bool:
+            return projection is None or column in projection
+
+        fixed_columns = [column for column, kind in layout if kind in FIXED_KINDS and wanted(column)]
+        var_columns = [(column, kind) for column, kind in layout if kind not in FIXED_KINDS]
+        # ненужные числовые колонки пропускаются байтами-заполнителями, а не распаковываются
+        fixed = Struct('<' + ''.join(FIXED_KINDS[kind] if wanted(column) else f'{FIXED_SIZES[kind]}x'
+                                     for column, kind in layout if kind in FIXED_KINDS))
+        mask_size = (len(layout) + 7) // 8
+        positions = {column: position for position, (column, _) in enumerate(layout) if wanted(column)}
+        # колонки, сменившие тип со старой версии схемы, приводятся к текущему
+        changed = [column for column, kind in layout
+                   if column in self.columns and column_kind(self.columns[column]) != kind and wanted(column)]
+        removed = [column for column, _ in layout if column not in self.columns and wanted(column)]
+        columns = self.columns
+
+        def decode(value: bytes) -> dict[str, object]:
+            offset = HEADER.size
+            mask = int.from_bytes(value[offset:offset + mask_size], 'little')
+            offset += mask_size
+            data = dict(zip(fixed_columns, fixed.unpack_from(value, offset)))
+            offset += fixed.size
+            for column, kind in var_columns:
+                (length,) = LENGTH.unpack_from(value, offset)
+                offset += LENGTH.size + length
+                if projection is not None and column not in projection:
+                    continue
+                raw = value[offset - length:offset]
+                if kind == 'str':
+                    data[column] = bytes(raw).decode()
+                elif kind == 'bytes':
+                    data[column] = bytes(raw)
+                else:
+                    data[column] = loads(raw) if length else None
+            if mask:
+                for column, position in positions.items():
+                    if mask >> position & 1:
+                        data[column] = None
+            for column in changed:
+                data[column] = coerce(data[column], columns[column])
+            for column in removed:
+                del data[column]
+            return data
+
+        return decode
+
+
+CODECS: dict[str, type[BaseCodec]] = {
+    'pickle': PickleCodec,
+    'binary': BinaryCodec,
+}
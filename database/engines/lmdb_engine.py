@@ -1,166 +1,882 @@
-from copy import deepcopy
-from multiprocessing import cpu_count
+from collections.abc import AsyncIterator, Callable, Iterable, Iterator
+from contextlib import contextmanager
+from functools import partial
+from operator import itemgetter
+import os
 from pickle import dumps, loads
-import shutil
+import sys
+import threading
 
 import lmdb
 
-from .base_engine import BaseEngine, Table, crc64
+from .base_engine import BULK_CHUNK_SIZE, BaseEngine, Table, chunked, crc64
+from .codecs import BaseCodec, CODECS, decode_key, encode_key
+from .metrics import current_probe
+from .query import Bounds, Filter, Order, check_window, column_bounds, compile_predicate, matches, sort_rows
 
 
-# Сохраняет все данные через pickle
+# Индексы хранят значения в типизированной сортируемой кодировке: по ним работают диапазоны.
+# Версия входит в имя базы индекса, индексы старого формата удаляются и строятся заново
+INDEX_VERSION = 2
+NULL_INDEX_KEY = b"\x00"
+FULL_RANGE: Bounds = (None, True, None, True)
+# сколько запись, упёршаяся в MapFull, ждёт окончания читающих транзакций для роста карты
+RESIZE_TIMEOUT = 10.0
+
+
+# Транзакции держат блокировку совместно, смена размера карты - монопольно: set_mapsize
+# нельзя вызывать, пока в процессе есть хоть одна активная транзакция. Пока рост ждёт,
+# новые транзакции не начинаются, иначе поток читателей его никогда не пропустит
+class ResizeLock:
+    def __init__(self) -> None:
+        self.condition = threading.Condition()
+        self.holders = 0
+        self.resizing = False
+
+    def acquire_shared(self) -> None:
+        with self.condition:
+            self.condition.wait_for(lambda: not self.resizing)
+            self.holders += 1
+
+    def release_shared(self) -> None:
+        with self.condition:
+            self.holders -= 1
+            if not self.holders:
+                self.condition.notify_all()
+
+    # False - за timeout секунд транзакции не закончились (например, открыт долгий снимок)
+    def acquire_exclusive(self, timeout: float) -> bool:
+        with self.condition:
+            if not self.condition.wait_for(lambda: not self.resizing, timeout):
+                return False
+            self.resizing = True
+            if self.condition.wait_for(lambda: not self.holders, timeout):
+                return True
+            self.resizing = False
+            self.condition.notify_all()
+            return False
+
+    def release_exclusive(self) -> None:
+        with self.condition:
+            self.resizing = False
+            self.condition.notify_all()
+
+
+# Значения строки кодируются кодеком таблицы, ключ хранится отдельно как ключ LMDB
 class LMDBTable(Table):
+    codec: BaseCodec
+
+    def value_columns(self) -> dict[str, object]:
+        return {column: annotation for column, annotation in self.columns.items() if column != self.key}
+
     def process_db_row(self,
                        row_data: bytes,
                        row_key: str,
-                       conditions: dict[str, object] | None = None) -> list[dict]:
-        data = loads(row_data)
-        if self.key is not None:
-            data[self.key] = row_key.decode()
-
-        if conditions is not None:
-            for key in conditions:
-                if key not in self.columns:
-                    raise KeyError(f"Key {key} not presented in column list!")
-                if data[key] != str(conditions[key]):
-                    return []
+                       conditions: list[Filter] | None = None,
+                       columns: tuple[str, ...] | None = None) -> list[dict]:
+        # значение строки не читается вовсе, если нужен только ключ
+        if columns is None or columns not in ((), (self.key,)):
+            data = self.codec.decode(row_data, columns)
+        else:
+            data = dict()
+        if self.key is not None and (columns is None or self.key in columns):
+            data[self.key] = self.decode_key(row_key)
+
+        if conditions and not matches(data, conditions):
+            return []
         return [data]
 
     def make_db_row(self,
                     row_data: dict) -> tuple:
         if self.key is not None:
-            key = str(row_data[self.key]).encode()
-            del row_data[key]
+            key = self.encode_key(row_data[self.key])
+            row_data = dict(row_data)
+            del row_data[self.key]
         else:
-            key = crc64(row_data).to_bytes(8)
+            # хэш от строкового вида строки, как до типизированного хранения
+            key = crc64({column: str(value) for column, value in row_data.items()}).to_bytes(8)
 
-        value = dumps(row_data)
+        value = self.codec.encode(row_data)
         return (key, value)
 
+    # Проверка условий по сырой строке (значение, ключ): из значения достаются только колонки
+    # условий, и строка раскодируется целиком, лишь если подошла. None - условий нет
+    def predicate(self, filters: list[Filter]) -> Callable[[bytes, bytes], bool] | None:
+        if not filters:
+            return None
+        # в порядке колонок таблицы: так числовые колонки распаковываются без перестановки
+        order = list(self.columns)
+        columns = tuple(sorted({column for column, _, _ in filters}, key=order.index))
+        check = compile_predicate(filters, columns)
+        if self.key not in columns:
+            extract = self.codec.extractor(columns)
+            return lambda value, key: check(extract(value))
+
+        position = columns.index(self.key)
+        value_columns = tuple(column for column in columns if column != self.key)
+        extract = self.codec.extractor(value_columns) if value_columns else lambda value: []
+        decode_key = self.decode_key
+
+        def accept(value: bytes, key: bytes) -> bool:
+            values = extract(value)
+            values.insert(position, decode_key(key))
+            return check(values)
+
+        return accept
+
+    # Колонки, которые надо раскодировать под проекцию: сама проекция, условия и сортировка
+    def needed_columns(self,
+                       columns: tuple[str, ...] | None,
+                       filters: list[Filter],
+                       order: Order) -> tuple[str, ...] | None:
+        if columns is None:
+            return None
+        needed = dict.fromkeys(columns)
+        needed.update(dict.fromkeys(column for column, _, _ in filters))
+        needed.update(dict.fromkeys(column for column, _ in order))
+        return tuple(needed)
+
+    def encode_key(self, value: object) -> bytes:
+        return encode_key(value, self.columns[self.key])
+
+    def decode_key(self, key: bytes) -> object:
+        return decode_key(key, self.columns[self.key])
+
+    def sort_key(self, key: bytes) -> bytes | int:
+        # integerkey-базы LMDB сравнивает как нативные беззнаковые числа
+        if self.key is None:
+            return int.from_bytes(key, sys.byteorder)
+        return key
+
+
+# Снимок - читающая транзакция с buffers=True: значения строк отдаются как memoryview
+# прямо в отображённый файл, без копирования, и остаются валидными до закрытия снимка.
+# Пока снимок открыт, LMDB не переиспользует страницы, поэтому держать его стоит недолго
+class LMDBSnapshot:
+    engine: 'LMDBEngine'
+    txn: lmdb.Transaction | None
+
+    def __init__(self, engine: 'LMDBEngine') -> None:
+        self.engine = engine
+        self.txn = None
+        # одну транзакцию нельзя использовать из двух потоков сразу
+        self.lock = threading.Lock()
+
+    # Снимок держит блокировку роста карты, пока открыт
+    def open(self) -> None:
+        self.txn = self.engine._lmdb_begin(buffers=True)
+
+    def close(self) -> None:
+        with self.lock:
+            if self.txn is not None:
+                self.txn.abort()
+                self.txn = None
+                self.engine.resize_lock.release_shared()
+
+    # Строки как (колонки условий и сортировки, загрузчик остальных колонок по имени)
+    async def select_lazy(self,
+                          table_name: str,
+                          conditions: dict[str, object] | None = None,
+                          order_by: str | Iterable[str] | None = None,
+                          limit: int | None = None,
+                          offset: int = 0) -> list[tuple[dict, Callable[[str], object]]]:
+        check_window(limit, offset)
+        with self.engine._measure('snapshot_select', table_name, conditions) as probe:
+            return probe.returned(await self.engine._run_read(probe.wrap(self._select_lazy), table_name,
+                                                              conditions, order_by, limit, offset))
+
+    def _select_lazy(self,
+                     table_name: str,
+                     conditions: dict[str, object] | None,
+                     order_by: str | Iterable[str] | None,
+                     limit: int | None,
+                     offset: int) -> list[tuple[dict, Callable[[str], object]]]:
+        table: LMDBTable = self.engine.tables[table_name]
+        filters, order = table.filters(conditions), table.order(order_by)
+        with self.lock:
+            if self.txn is None:
+                raise RuntimeError("Snapshot is closed!")
+            rows = self.engine._lmdb_query(self.txn, table_name, filters, order, limit, offset,
+                                           table.needed_columns((), filters, order))
+        return [(data, partial(self._load, table, key, value)) for data, key, value in rows]
+
+    def _load(self,
+              table: LMDBTable,
+              key: memoryview,
+              value: memoryview,
+              column: str) -> object:
+        # после закрытия снимка память под memoryview уже может быть занята другими данными
+        if self.txn is None:
+            raise RuntimeError("Snapshot is closed, lazy columns can't be read!")
+        return table.process_db_row(value, key, columns=(column,))[0].get(column)
+
 
 class LMDBEngine(BaseEngine):
     environment: lmdb.Environment
+    catalog_descriptor: lmdb._Database
+    schemas_descriptor: lmdb._Database
+    entities_descriptor: lmdb._Database
     db_descriptors: dict[str, lmdb._Database]
+    index_descriptors: dict[str, dict[str, lmdb._Database]]
 
+    # map_size - начальный размер карты: при заполнении больше чем на high_water или при MapFull
+    # она растёт в growth_factor раз, но не больше max_map_size (None - без ограничения).
+    # readonly - только чтение таблиц, уже заведённых пишущим движком (воркеры шардов):
+    # такой движок читает синхронно в своём процессе, пулы потоков ему не нужны
     def __init__(self,
                  path: str,
                  threads_count: int = -1,
-                 map_size: int = 2**32) -> None:
-        super().__init__(path)
-
-        if threads_count == -1:
-            self.threads_count = cpu_count()
-        elif threads_count <= 0:
-            raise ValueError('"threads_count" must be greater than zero or -1 to use all CPU cores!')
-        else:
-            self.threads_count = threads_count
+                 map_size: int = 2**26,
+                 chunk_size: int = 10_000,
+                 codec: str | type[BaseCodec] = 'binary',
+                 max_map_size: int | None = None,
+                 growth_factor: float = 2.0,
+                 high_water: float = 0.8,
+                 readonly: bool = False) -> None:
+        self.readonly = readonly
+        self.threaded_io = not readonly
+        super().__init__(path, chunk_size, threads_count)
+        if map_size <= 0:
+            raise ValueError('"map_size" must be greater than zero!')
+        if max_map_size is not None and max_map_size < map_size:
+            raise ValueError('"max_map_size" must not be less than "map_size"!')
+        if growth_factor <= 1:
+            raise ValueError('"growth_factor" must be greater than one!')
+        if not 0 < high_water <= 1:
+            raise ValueError('"high_water" must be greater than zero and not greater than one!')
         self.map_size = map_size
+        self.max_map_size = max_map_size
+        self.growth_factor = growth_factor
+        self.high_water = high_water
+        self.resize_lock = ResizeLock()
+        if isinstance(codec, str):
+            if codec not in CODECS:
+                raise ValueError(f"Unknown codec '{codec}' passed!")
+            codec = CODECS[codec]
+        self.codec_cls = codec
 
         self.environment = self._lmdb_open(self.path)
+        # карта существующей базы может оказаться больше запрошенной
+        self.map_size = self.environment.info()["map_size"]
+        self.page_size = self.environment.stat()["psize"]
+        # каталог: имя таблицы -> имя именованной базы LMDB, в которой лежат её строки
+        self.catalog_descriptor = self.environment.open_db(b"__catalog__", create=not readonly)
+        # история раскладок строк каждой базы, по ней кодек читает старые версии
+        self.schemas_descriptor = self.environment.open_db(b"__schemas__", create=not readonly)
+        # каталог имён сущностей: имя класса -> имя таблицы
+        self.entities_descriptor = self.environment.open_db(b"__entities__", create=not readonly)
         self.db_descriptors = dict()
+        self.index_descriptors = dict()
 
     def create_table(self,
                      name: str,
-                     columns: list[str],
-                     key: str | None = None) -> None:
-        self.tables[name] = LMDBTable(columns, key)
-        self._lmdb_get_db_descriptor(self.environment,
-                                     self.tables[name],
-                                     name)
-
-    # TODO: сейчас экстенсивно копируем все таблицы, переоткрывая нужную, надо побыстрее
+                     columns: dict[str, object],
+                     key: str | None = None,
+                     indexes: list[str | tuple[str, ...]] | None = None,
+                     autoincrement: bool = False) -> None:
+        self.tables[name] = LMDBTable(columns, key, indexes, autoincrement)
+        if self.readonly:
+            self._lmdb_open_existing(self.tables[name], name)
+            return
+        self._lmdb_grow_on_full(self._lmdb_get_db_descriptor,
+                                self.environment,
+                                self.tables[name],
+                                name)
+        self._lmdb_grow_on_full(self._lmdb_build_indexes,
+                                self.environment,
+                                self.tables[name],
+                                name)
+
+    # Переименование меняет только запись в каталоге, данные не трогаются
     def rename_table(self,
                      old_name: str,
                      new_name: str) -> None:
-        tmp_env = self._lmdb_create_tmp()
-
-        for table_name in self.tables:
-            table_db = self.db_descriptors[table_name]
-            if table_name == old_name:
-                table_name = new_name
-            tmp_db = tmp_env.open_db(table_name.encode(),
-                                     integerkey=self.tables[table_name].key is None)
-            with self.environment.begin(db=table_db) as table_txn:
-                with tmp_env.begin(db=tmp_db) as tmp_txn:
-                    for key, value in table_txn.cursor():
-                        tmp_txn.put(key, value)
-        tmp_env.close()
-        self.environment.close()
+        with self._lmdb_txn(write=True, db=self.catalog_descriptor) as txn:
+            if txn.get(new_name.encode()) is not None:
+                raise ValueError(f"Table {new_name} already exists!")
+            physical_name = self._lmdb_physical_name(txn, old_name)
+            txn.put(new_name.encode(), physical_name.encode())
+            txn.delete(old_name.encode())
 
-        self._lmdb_copy_tmp()
+        self.tables[new_name] = self.tables.pop(old_name)
+        self.db_descriptors[new_name] = self.db_descriptors.pop(old_name)
+        self.index_descriptors[new_name] = self.index_descriptors.pop(old_name)
 
-        self.tables[new_name] = deepcopy(self.tables[old_name])
-        del self.tables[old_name]
-        self._lmdb_sync()
-
-    # TODO: сейчас экстенсивно копируем все таблицы, кроме удаляемой, надо побыстрее
     def delete_table(self, name: str) -> None:
-        tmp_env = self._lmdb_create_tmp()
+        with self._lmdb_txn(write=True, db=self.catalog_descriptor) as txn:
+            for index_db in self.index_descriptors[name].values():
+                txn.drop(index_db, delete=True)
+            txn.drop(self.db_descriptors[name], delete=True)
+            txn.delete(self._lmdb_physical_name(txn, name).encode(), db=self.schemas_descriptor)
+            txn.delete(name.encode())
 
-        for table_name in self.tables:
-            if table_name == name:
-                continue
-            table_db = self.db_descriptors[table_name]
-            tmp_db = tmp_env.open_db(table_name.encode(),
-                                     integerkey=self.tables[table_name].key is None)
-            with self.environment.begin(db=table_db) as table_txn:
-                with tmp_env.begin(db=tmp_db) as tmp_txn:
-                    for key, value in table_txn.cursor():
-                        tmp_txn.put(key, value)
-        tmp_env.close()
-        self.environment.close()
+        del self.tables[name]
+        del self.db_descriptors[name]
+        del self.index_descriptors[name]
 
-        self._lmdb_copy_tmp()
+    def entity_names(self) -> dict[str, str]:
+        with self._lmdb_txn(db=self.entities_descriptor) as txn:
+            return {entity_name.decode(): table_name.decode() for entity_name, table_name in txn.cursor()}
 
-        del self.tables[name]
-        self._lmdb_sync()
+    def save_entity_name(self,
+                         entity_name: str,
+                         table_name: str) -> None:
+        with self._lmdb_txn(write=True, db=self.entities_descriptor) as txn:
+            txn.put(entity_name.encode(), table_name.encode())
 
     async def select(self,
                      table_name: str,
-                     conditions: dict[str, object] | None = None) -> list[dict]:
-        result = []
-        table: LMDBTable = self.tables[table_name]
-        if table.key is not None and table.key in conditions:
-            with self.environment.begin(db=self.db_descriptors[table_name]) as txn:
-                value = txn.get(str(conditions[table.key]).encode())
-                if value is not None:
-                    result += table.process_db_row(value, conditions[table.key], conditions)
-        else:
-            with self.environment.begin(db=self.db_descriptors[table_name]) as txn:
-                for key, value in txn.cursor():
-                    row = table.process_db_row(value, key, conditions)
-                    result += row
-        return result
+                     conditions: dict[str, object] | None = None,
+                     order_by: str | Iterable[str] | None = None,
+                     limit: int | None = None,
+                     offset: int = 0,
+                     columns: Iterable[str] | None = None) -> list[dict]:
+        check_window(limit, offset)
+        with self._measure('select', table_name, conditions) as probe:
+            return probe.returned(await self._run_read(probe.wrap(self._lmdb_select), table_name,
+                                                       conditions, order_by, limit, offset, columns))
+
+    async def count(self,
+                    table_name: str,
+                    conditions: dict[str, object] | None = None) -> int:
+        with self._measure('count', table_name, conditions) as probe:
+            return await self._run_read(probe.wrap(self._lmdb_count), table_name, conditions)
+
+    async def exists(self,
+                     table_name: str,
+                     conditions: dict[str, object] | None = None) -> bool:
+        with self._measure('exists', table_name, conditions) as probe:
+            return await self._run_read(probe.wrap(self._lmdb_count), table_name, conditions, 1) > 0
+
+    async def select_many_by_key(self,
+                                 table_name: str,
+                                 keys: Iterable[object]) -> list[dict]:
+        if self.tables[table_name].key is None:
+            raise ValueError(f"Table {table_name} has no key!")
+        with self._measure('select_many_by_key', table_name) as probe:
+            return probe.returned(await self._run_read(probe.wrap(self._lmdb_select_many_by_key),
+                                                       table_name, list(keys)))
 
     async def insert(self,
                      table_name: str,
                      row_data: dict[str, object]) -> None:
-        table: LMDBTable = self.tables[table_name]
-        with self.environment.begin(write=True, db=self.db_descriptors[table_name]) as txn:
-            key, value = table.make_db_row(row_data)
-            txn.put(key, value)
+        with self._measure('insert', table_name) as probe:
+            await self._run_write(probe.wrap(self._lmdb_write), table_name, [row_data], self._lmdb_put_rows)
+
+    async def insert_many(self,
+                          table_name: str,
+                          rows: Iterable[dict[str, object]],
+                          chunk_size: int | None = None) -> None:
+        with self._measure('insert_many', table_name) as probe:
+            for chunk in chunked(rows, chunk_size or self.chunk_size):
+                await self._run_write(probe.wrap(self._lmdb_write), table_name, chunk, self._lmdb_put_rows)
+
+    # Пачка сортируется по ключу и, если ложится после последнего ключа таблицы, дописывается
+    # в конец через putmulti(append=True), без поиска места вставки и старых версий строк.
+    # Весь поток не сортируется, чтобы память не зависела от его длины: источник, упорядоченный
+    # по ключу, и таблицы с автоинкрементом дописываются в конец на всём протяжении загрузки
+    async def bulk_load(self,
+                        table_name: str,
+                        rows: Iterable[dict[str, object]],
+                        chunk_size: int | None = None) -> int:
+        loaded = 0
+        with self._measure('bulk_load', table_name) as probe:
+            for chunk in chunked(rows, chunk_size or BULK_CHUNK_SIZE):
+                await self._run_write(probe.wrap(self._lmdb_write), table_name, chunk, self._lmdb_put_rows)
+                loaded += len(chunk)
+        return loaded
 
     async def delete(self,
                      table_name: str,
                      row_data: dict[str, object]) -> None:
+        with self._measure('delete', table_name) as probe:
+            await self._run_write(probe.wrap(self._lmdb_write), table_name, [row_data], self._lmdb_delete_rows)
+
+    async def delete_many(self,
+                          table_name: str,
+                          rows: Iterable[dict[str, object]],
+                          chunk_size: int | None = None) -> None:
+        with self._measure('delete_many', table_name) as probe:
+            for chunk in chunked(rows, chunk_size or self.chunk_size):
+                await self._run_write(probe.wrap(self._lmdb_write), table_name, chunk, self._lmdb_delete_rows)
+
+    async def select_batches(self,
+                             table_name: str,
+                             conditions: dict[str, object] | None = None,
+                             batch_size: int | None = None,
+                             columns: Iterable[str] | None = None) -> AsyncIterator[list[dict]]:
+        after = None
+        with self._measure('select_batches', table_name, conditions) as probe:
+            while True:
+                rows, after = await self._run_read(probe.wrap(self._lmdb_select_page), table_name, conditions,
+                                                   after, batch_size or self.chunk_size, columns)
+                if rows:
+                    yield probe.returned(rows)
+                if after is None:
+                    return
+
+    async def write_batch(self, operations: list[tuple[str, str, list[dict[str, object]]]]) -> None:
+        with self._measure('write_batch', None) as probe:
+            await self._run_write(probe.wrap(self._lmdb_write_batch), operations)
+
+    def snapshot(self) -> LMDBSnapshot:
+        return LMDBSnapshot(self)
+
+    # Дефрагментированная копия базы в каталог path (env.copy(compact=True)): копия идёт из
+    # читающей транзакции, читатели и писатель в это время продолжают работать
+    async def compact_backup(self, path: str) -> None:
+        os.makedirs(path, exist_ok=True)
+        if os.listdir(path):
+            raise ValueError(f"Backup directory {path} is not empty!")
+        with self._measure('compact_backup', None):
+            await self._run_read(self._lmdb_copy, path)
+
+    def close(self) -> None:
+        super().close()
+        self.environment.close()
+
+    async def _run_write(self, func: Callable, *args) -> object:
+        return await super()._run_write(self._lmdb_grow_on_full, func, *args)
+
+    def _lmdb_select(self,
+                     table_name: str,
+                     conditions: dict[str, object] | None = None,
+                     order_by: str | Iterable[str] | None = None,
+                     limit: int | None = None,
+                     offset: int = 0,
+                     columns: Iterable[str] | None = None) -> list[dict]:
         table: LMDBTable = self.tables[table_name]
-        if table.key is not None and table.key in row_data:
-            key = str(row_data[table.key]).encode()
-            with self.environment.begin(write=True, db=self.db_descriptors[table_name]) as txn:
-                txn.delete(key)
+        filters, order = table.filters(conditions), table.order(order_by)
+        columns = table.projection(columns)
+        # условия проверяются по сырой строке, раскодировать нужно только проекцию и сортировку
+        decode = table.needed_columns(columns, [], order)
+        with self._lmdb_txn(db=self.db_descriptors[table_name]) as txn:
+            rows = self._lmdb_query(txn, table_name, filters, order, limit, offset, decode)
+        # колонки, раскодированные только ради условий и сортировки, отбрасываются
+        if decode != columns:
+            return [{column: data.get(column) for column in columns} for data, _, _ in rows]
+        return [data for data, _, _ in rows]
+
+    # Подходящие строки как (раскодированные колонки decode, ключ, значение) с учётом порядка и окна
+    def _lmdb_query(self,
+                    txn: lmdb.Transaction,
+                    table_name: str,
+                    filters: list[Filter],
+                    order: Order,
+                    limit: int | None,
+                    offset: int,
+                    decode: tuple[str, ...] | None) -> list[tuple[dict, bytes, bytes]]:
+        result = []
+        table: LMDBTable = self.tables[table_name]
+        if limit == 0:
+            return result
+        candidates, ordered = self._lmdb_candidates(txn, table_name, filters, order)
+        accept = table.predicate(filters)
+        if accept is not None:
+            candidates = ((position, key, value) for position, key, value in candidates if accept(value, key))
+        if not ordered:
+            for _, key, value in candidates:
+                for data in table.process_db_row(value, key, columns=decode):
+                    result.append((data, key, value))
+            end = offset + limit if limit is not None else None
+            return sort_rows(result, order, itemgetter(0))[offset:end]
+
+        # строки уже идут в нужном порядке: offset пропускается, проход обрывается на limit
+        for _, key, value in candidates:
+            if offset:
+                offset -= 1
+                continue
+            result.append((table.process_db_row(value, key, columns=decode)[0], key, value))
+            if len(result) == limit:
+                break
+        return result
+
+    # Число подходящих строк, но не больше limit. Без условий оно берётся из статистики базы,
+    # по одному индексу - из числа значений ключа индекса, иначе читаются только колонки условий
+    def _lmdb_count(self,
+                    table_name: str,
+                    conditions: dict[str, object] | None = None,
+                    limit: int | None = None) -> int:
+        table: LMDBTable = self.tables[table_name]
+        db = self.db_descriptors[table_name]
+        filters = table.filters(conditions)
+        with self._lmdb_txn(db=db) as txn:
+            if not filters:
+                count = txn.stat(db)["entries"]
+                self._lmdb_plan("entries")
+            elif (count := self._lmdb_index_count(txn, table_name, filters)) is not None:
+                self._lmdb_plan(f"index count {filters[0][0]}")
+            else:
+                count = 0
+                accept = table.predicate(filters)
+                candidates, _ = self._lmdb_candidates(txn, table_name, filters, [])
+                for _, key, value in candidates:
+                    if accept(value, key):
+                        count += 1
+                        if count == limit:
+                            break
+        return count if limit is None else min(count, limit)
+
+    def _lmdb_index_count(self,
+                          txn: lmdb.Transaction,
+                          table_name: str,
+                          filters: list[Filter]) -> int | None:
+        if len(filters) != 1:
+            return None
+        column, operator, operand = filters[0]
+        index_db = self.index_descriptors[table_name].get(column)
+        if index_db is None or operator not in ('eq', 'in'):
+            return None
+        table: LMDBTable = self.tables[table_name]
+        values = [operand] if operator == 'eq' else operand
+        index_keys = {self._lmdb_index_key(table, column, value) for value in values}
+        # обрезанный ключ индекса общий у разных значений, такие строки надо проверять
+        if any(len(index_key) == self.environment.max_key_size() for index_key in index_keys):
+            return None
+        cursor = txn.cursor(db=index_db)
+        return sum(cursor.count() for index_key in index_keys if cursor.set_key(index_key))
+
+    def _lmdb_select_many_by_key(self,
+                                 table_name: str,
+                                 keys: list[object]) -> list[dict]:
+        table: LMDBTable = self.tables[table_name]
+        with self._lmdb_txn(db=self.db_descriptors[table_name]) as txn:
+            items = txn.cursor().getmulti([table.encode_key(key) for key in keys])
+            items, _ = self._lmdb_plan("key", items, True)
+        result = []
+        for key, value in items:
+            result += table.process_db_row(value, key)
+        return result
+
+    # Одна страница потоковой выборки в своей короткой читающей транзакции.
+    # Возвращает подошедшие строки и позицию, с которой продолжать (None - дальше пусто)
+    def _lmdb_select_page(self,
+                          table_name: str,
+                          conditions: dict[str, object] | None,
+                          after: object | None,
+                          batch_size: int,
+                          columns: Iterable[str] | None = None) -> tuple[list[dict], object | None]:
+        result = []
+        table: LMDBTable = self.tables[table_name]
+        filters = table.filters(conditions)
+        columns = table.projection(columns)
+        accept = table.predicate(filters)
+        scanned, position = 0, None
+        with self._lmdb_txn(db=self.db_descriptors[table_name]) as txn:
+            candidates, _ = self._lmdb_candidates(txn, table_name, filters, [], after)
+            for position, key, value in candidates:
+                if accept is None or accept(value, key):
+                    result += table.process_db_row(value, key, columns=columns)
+                scanned += 1
+                if scanned == batch_size:
+                    break
+            else:
+                position = None
+        return result, position
+
+    # Выбирает план выборки под условия и порядок: прямые get по ключу, равенство по самому
+    # селективному индексу, диапазон по ключу, диапазон или порядок по индексу, полный проход.
+    # Отдаёт (позиция, ключ, значение) и признак того, что строки идут уже в порядке order.
+    # after - позиция последней отданной строки, проход продолжается строго после неё
+    def _lmdb_candidates(self,
+                         txn: lmdb.Transaction,
+                         table_name: str,
+                         filters: list[Filter],
+                         order: Order,
+                         after: object | None = None) -> tuple[Iterator[tuple[object, bytes, bytes]], bool]:
+        table: LMDBTable = self.tables[table_name]
+        db = self.db_descriptors[table_name]
+        descending = bool(order) and order[0][1]
+        key_order = not order or table.key is not None and len(order) == 1 and order[0][0] == table.key
+
+        if table.key is not None:
+            for column, operator, operand in filters:
+                if column == table.key and operator in ('eq', 'in'):
+                    values = [operand] if operator == 'eq' else operand
+                    keys = sorted({table.encode_key(value) for value in values}, reverse=descending and key_order)
+                    if after is not None:
+                        keys = keys[keys.index(after) + 1:]
+                    return self._lmdb_plan("key",
+                                           ((key, key, value) for key in keys
+                                            if (value := txn.get(key, db=db)) is not None),
+                                           key_order)
+
+        best = self._lmdb_best_index(txn, table_name, filters)
+        if best is not None:
+            column, index_keys = best
+            ranges = [(index_key, True, index_key, True) for index_key in index_keys]
+            return self._lmdb_plan(f"index {column}",
+                                   self._lmdb_index_scan(txn, table_name, column, ranges, False, after),
+                                   not order or order == [(column, False)])
+
+        bounds = column_bounds(filters, table.key) if table.key is not None else None
+        if bounds is None:
+            for column in self.index_descriptors[table_name]:
+                column_order = len(order) == 1 and order[0][0] == column
+                index_bounds = column_bounds(filters, column)
+                if index_bounds is not None or column_order and not key_order:
+                    ranges = [self._lmdb_index_bounds(table, column, index_bounds or FULL_RANGE)]
+                    return self._lmdb_plan(f"index range {column}",
+                                           self._lmdb_index_scan(txn, table_name, column, ranges, descending, after),
+                                           not order or column_order)
+
+        if bounds is not None:
+            low, low_inclusive, high, high_inclusive = bounds
+            bounds = (table.encode_key(low) if low is not None else None, low_inclusive,
+                      table.encode_key(high) if high is not None else None, high_inclusive)
+        rows = self._lmdb_range(txn.cursor(db=db), bounds or FULL_RANGE, descending and key_order, after)
+        return self._lmdb_plan("key range" if bounds is not None else "full scan",
+                               ((key, key, value) for key, value in rows),
+                               key_order)
+
+    # План выборки и прочитанные по нему строки попадают в замер текущей операции, если он идёт
+    def _lmdb_plan(self,
+                   plan: str,
+                   candidates: Iterable[tuple] = (),
+                   ordered: bool = False) -> tuple[Iterator[tuple], bool]:
+        probe = current_probe()
+        if probe is not None:
+            probe.plan = plan
+            candidates = probe.scanned(candidates)
+        return candidates, ordered
+
+    # Ключи самого селективного индекса под условия равенства или in
+    def _lmdb_best_index(self,
+                         txn: lmdb.Transaction,
+                         table_name: str,
+                         filters: list[Filter]) -> tuple[str, list[bytes]] | None:
+        table: LMDBTable = self.tables[table_name]
+        best, best_count = None, None
+        for column, operator, operand in filters:
+            index_db = self.index_descriptors[table_name].get(column)
+            if index_db is None or operator not in ('eq', 'in'):
+                continue
+            values = [operand] if operator == 'eq' else operand
+            index_keys = sorted({self._lmdb_index_key(table, column, value) for value in values})
+            cursor = txn.cursor(db=index_db)
+            count = sum(cursor.count() for index_key in index_keys if cursor.set_key(index_key))
+            if best_count is None or count < best_count:
+                best, best_count = (column, index_keys), count
+        return best
+
+    # Строки по интервалам значений индекса; позиция - пара (ключ индекса, ключ строки)
+    def _lmdb_index_scan(self,
+                         txn: lmdb.Transaction,
+                         table_name: str,
+                         column: str,
+                         ranges: list[Bounds],
+                         descending: bool,
+                         after: tuple[bytes, bytes] | None) -> Iterator[tuple[object, bytes, bytes]]:
+        db = self.db_descriptors[table_name]
+        cursor = txn.cursor(db=self.index_descriptors[table_name][column])
+        for bounds in ranges:
+            for index_key, key in self._lmdb_range(cursor, bounds, descending, after, dupsort=True):
+                yield (index_key, key), key, txn.get(key, db=db)
+
+    # Проход курсора по интервалу ключей в прямом или обратном порядке с остановкой на границе.
+    # after - позиция последнего отданного элемента: ключ, а в dupsort-базе пара (ключ, значение)
+    def _lmdb_range(self,
+                    cursor: lmdb.Cursor,
+                    bounds: Bounds,
+                    descending: bool = False,
+                    after: object | None = None,
+                    dupsort: bool = False) -> Iterator[tuple[bytes, bytes]]:
+        low, low_inclusive, high, high_inclusive = bounds
+        position = cursor.item if dupsort else cursor.key
+        after_key = after[0] if dupsort and after is not None else after
+        if not descending:
+            if after is not None and (low is None or after_key >= low):
+                found = self._lmdb_seek(cursor, after, dupsort)
+                if found and position() == after:
+                    found = cursor.next()
+            elif low is not None:
+                found = self._lmdb_seek(cursor, low, past=not low_inclusive)
+            else:
+                found = cursor.first()
+            step = cursor.next
         else:
-            with self.environment.begin(write=True, db=self.db_descriptors[table_name]) as txn:
-                keys_for_delete = []
-                for key, value in txn.cursor():
-                    row = table.process_db_row(value, key, conditions=row_data)
-                    if row:
-                        keys_for_delete.append(key)
-                for key in keys_for_delete:
-                    txn.delete(key)
+            if after is not None and (high is None or after_key <= high):
+                found = self._lmdb_seek(cursor, after, dupsort)
+            elif high is not None:
+                found = self._lmdb_seek(cursor, high, past=high_inclusive)
+            else:
+                found = False
+            # курсор стоит на первом элементе за интервалом, назад от него - внутрь
+            found = cursor.prev() if found else cursor.last()
+            step = cursor.prev
+
+        while found:
+            key = cursor.key()
+            # в снимке ключ - memoryview, а его сравнение с границей возможно только как bytes
+            if low is not None or high is not None:
+                key = bytes(key)
+            below = low is not None and (key < low or key == low and not low_inclusive)
+            above = high is not None and (key > high or key == high and not high_inclusive)
+            if below if descending else above:
+                return
+            if not (below or above):
+                yield key, cursor.value()
+            found = step()
+
+    # Ставит курсор на первый элемент не меньше позиции; past=True - на первый ключ больше неё
+    def _lmdb_seek(self,
+                   cursor: lmdb.Cursor,
+                   position: object,
+                   dupsort: bool = False,
+                   past: bool = False) -> bool:
+        if dupsort:
+            key, value = position
+            if cursor.set_range_dup(key, value):
+                return True
+            # все значения ключа меньше value - нужен следующий ключ
+            past = True
+        else:
+            key = position
+        if not cursor.set_range(key):
+            return False
+        if past and cursor.key() == key:
+            return cursor.next_nodup()
+        return True
+
+    def _lmdb_write(self,
+                    table_name: str,
+                    rows: list[dict[str, object]],
+                    write_rows: Callable[[lmdb.Transaction, str, list[dict[str, object]]], None]) -> None:
+        with self._lmdb_txn(write=True, db=self.db_descriptors[table_name]) as txn:
+            write_rows(txn, table_name, rows)
+
+    def _lmdb_write_batch(self, operations: list[tuple[str, str, list[dict[str, object]]]]) -> None:
+        write_rows = {'insert': self._lmdb_put_rows, 'delete': self._lmdb_delete_rows}
+        with self._lmdb_txn(write=True) as txn:
+            for operation, table_name, rows in operations:
+                write_rows[operation](txn, table_name, rows)
+
+    def _lmdb_put_rows(self,
+                       txn: lmdb.Transaction,
+                       table_name: str,
+                       rows: list[dict[str, object]]) -> None:
+        table: LMDBTable = self.tables[table_name]
+        db = self.db_descriptors[table_name]
+        if table.autoincrement:
+            self._lmdb_assign_keys(txn, table_name, rows)
+        # dict оставляет последнюю версию строки при повторе ключа внутри пачки
+        items = dict()
+        for row_data in rows:
+            key, value = table.make_db_row(row_data)
+            items[key] = (value, row_data)
+        items = sorted(items.items(), key=lambda item: table.sort_key(item[0]))
+
+        cursor = txn.cursor(db=db)
+        # append=True допустим, только если вся пачка ложится строго после последнего ключа
+        append = not cursor.last() or table.sort_key(cursor.key()) < table.sort_key(items[0][0])
+        if table.indexes:
+            # при дописывании в конец старых версий строк нет и снимать с индексов нечего
+            if not append:
+                for key, _ in items:
+                    old_value = txn.get(key, db=db)
+                    if old_value is not None:
+                        self._lmdb_unindex_row(txn, table_name, key, old_value)
+            # записи индексов уходят в каждый индекс одним putmulti по порядку
+            for column, index_db in self.index_descriptors[table_name].items():
+                entries = sorted((self._lmdb_index_key(table, column, row_data.get(column)), key)
+                                 for key, (_, row_data) in items)
+                txn.cursor(db=index_db).putmulti(entries)
+        cursor.putmulti([(key, value) for key, (value, _) in items], append=append)
+        if (probe := current_probe()) is not None:
+            probe.rows_written += len(items)
+            probe.bytes_written += sum(len(key) + len(value) for key, (value, _) in items)
+
+    def _lmdb_assign_keys(self,
+                          txn: lmdb.Transaction,
+                          table_name: str,
+                          rows: list[dict[str, object]]) -> None:
+        table: LMDBTable = self.tables[table_name]
+        pending = [row_data for row_data in rows if row_data.get(table.key) is None]
+        if not pending:
+            return
+
+        cursor = txn.cursor(db=self.db_descriptors[table_name])
+        next_key = table.decode_key(cursor.key()) + 1 if cursor.last() else 1
+        # ключи, заданные явно в этой же пачке, тоже заняты
+        for row_data in rows:
+            if row_data.get(table.key) is not None:
+                next_key = max(next_key, table.coerce(table.key, row_data[table.key]) + 1)
+        for row_data in pending:
+            row_data[table.key] = next_key
+            next_key += 1
+
+    def _lmdb_delete_rows(self,
+                          txn: lmdb.Transaction,
+                          table_name: str,
+                          rows: list[dict[str, object]]) -> None:
+        table: LMDBTable = self.tables[table_name]
+        db = self.db_descriptors[table_name]
+        keys_for_delete = set()
+        for row_data in rows:
+            if table.key is not None and table.key in row_data:
+                keys_for_delete.add(table.encode_key(row_data[table.key]))
+            elif table.key is None and list(row_data) == list(table.columns):
+                # ключ строки без явного ключа - crc64 от всей строки, ищем его напрямую
+                key, _ = table.make_db_row(row_data)
+                keys_for_delete.add(key)
+            else:
+                filters = table.filters(row_data)
+                accept = table.predicate(filters)
+                candidates, _ = self._lmdb_candidates(txn, table_name, filters, [])
+                for _, key, value in candidates:
+                    if accept is None or accept(value, key):
+                        keys_for_delete.add(key)
+
+        probe = current_probe()
+        for key in keys_for_delete:
+            value = txn.get(key, db=db)
+            if value is None:
+                continue
+            if table.indexes:
+                self._lmdb_unindex_row(txn, table_name, key, value)
+            txn.delete(key, db=db)
+            if probe is not None:
+                probe.rows_written += 1
+
+    def _lmdb_index_key(self,
+                        table: LMDBTable,
+                        column: str,
+                        value: object) -> bytes:
+        # NULL сортируется первым; префикс "=" - потому что LMDB не принимает пустые ключи.
+        # Длинные значения обрезаются до предела ключа, лишние совпадения отсекают условия
+        if value is None:
+            return NULL_INDEX_KEY
+        return (b"=" + encode_key(value, table.columns[column]))[:self.environment.max_key_size()]
+
+    def _lmdb_index_bounds(self,
+                           table: LMDBTable,
+                           column: str,
+                           bounds: Bounds) -> Bounds:
+        low, low_inclusive, high, high_inclusive = bounds
+        max_key_size = self.environment.max_key_size()
+        if low is not None:
+            low = self._lmdb_index_key(table, column, low)
+            # по обрезанной границе строгость не проверить, её добирают условия
+            low_inclusive = low_inclusive or len(low) == max_key_size
+        if high is not None:
+            high = self._lmdb_index_key(table, column, high)
+            high_inclusive = high_inclusive or len(high) == max_key_size
+        return low, low_inclusive, high, high_inclusive
+
+    def _lmdb_unindex_row(self,
+                          txn: lmdb.Transaction,
+                          table_name: str,
+                          key: bytes,
+                          value: bytes) -> None:
+        table: LMDBTable = self.tables[table_name]
+        row_data = table.process_db_row(value, key)[0]
+        for column, index_db in self.index_descriptors[table_name].items():
+            txn.delete(self._lmdb_index_key(table, column, row_data.get(column)), key, db=index_db)
 
     def _lmdb_open(self, path: str) -> lmdb.Environment:
         return lmdb.open(path,
                          map_size=self.map_size,
+                         readonly=self.readonly,
                          subdir=True,
                          metasync=False,
                          sync=False,
@@ -169,25 +885,150 @@ class LMDBEngine(BaseEngine):
                          max_dbs=2**16,
                          max_spare_txns=self.threads_count)
 
+    # Транзакция под блокировкой роста карты; её надо отпустить через resize_lock.release_shared()
+    def _lmdb_begin(self, **kwargs) -> lmdb.Transaction:
+        while True:
+            self.resize_lock.acquire_shared()
+            try:
+                return self.environment.begin(**kwargs)
+            except lmdb.MapResizedError:
+                self.resize_lock.release_shared()
+                # карту увеличил другой процесс: её новый размер принимается, когда в этом
+                # процессе не останется транзакций
+                if not self._lmdb_resize(0):
+                    raise
+            except BaseException:
+                self.resize_lock.release_shared()
+                raise
+
+    @contextmanager
+    def _lmdb_txn(self, **kwargs) -> Iterator[lmdb.Transaction]:
+        txn = self._lmdb_begin(**kwargs)
+        try:
+            with txn:
+                yield txn
+        finally:
+            self.resize_lock.release_shared()
+
+    # Запись, упёршаяся в MapFull, повторяется целиком на увеличенной карте: неудавшаяся
+    # транзакция уже отменена, а выданные автоинкрементом ключи остались в строках
+    def _lmdb_grow_on_full(self, func: Callable, *args) -> object:
+        while True:
+            seen = self.map_size
+            try:
+                result = func(*args)
+            except lmdb.MapFullError:
+                size = self._lmdb_grown_size(seen)
+                if size is None or not self._lmdb_resize(size):
+                    raise
+                continue
+            # заранее, пока запись не упёрлась в край, и без ожидания, если идут транзакции
+            used = (self.environment.info()["last_pgno"] + 1) * self.page_size
+            if used >= self.high_water * self.map_size and (size := self._lmdb_grown_size(seen)) is not None:
+                self._lmdb_resize(size, 0)
+            return result
+
+    # Следующий размер карты после seen; None - уже достигнут max_map_size
+    def _lmdb_grown_size(self, seen: int) -> int | None:
+        size = int(seen * self.growth_factor)
+        if self.max_map_size is not None:
+            size = min(size, self.max_map_size)
+        size -= size % self.page_size
+        return size if size > seen else None
+
+    # Меняет размер карты, когда в процессе не останется транзакций (size=0 - принять размер
+    # из файла). False - транзакции не закончились за timeout секунд
+    def _lmdb_resize(self,
+                     size: int,
+                     timeout: float = RESIZE_TIMEOUT) -> bool:
+        if not self.resize_lock.acquire_exclusive(timeout):
+            return False
+        try:
+            # пока ждали, карту мог увеличить другой поток
+            if size == 0 or size > self.map_size:
+                self.environment.set_mapsize(size)
+                self.map_size = self.environment.info()["map_size"]
+        finally:
+            self.resize_lock.release_exclusive()
+        return True
+
+    def _lmdb_copy(self, path: str) -> None:
+        with self._lmdb_txn() as txn:
+            self.environment.copy(path, compact=True, txn=txn)
+
     def _lmdb_get_db_descriptor(self,
                                 env: lmdb.Environment,
                                 table: LMDBTable,
                                 table_name: str) -> None:
-        self.db_descriptors[table_name] = env.open_db(table_name.encode(),
-                                                      integerkey=table.key is None)
+        with self._lmdb_txn(write=True, db=self.catalog_descriptor) as txn:
+            physical_name = self._lmdb_physical_name(txn, table_name)
+            self.db_descriptors[table_name] = env.open_db(physical_name.encode(),
+                                                          txn=txn,
+                                                          integerkey=table.key is None)
+            self.index_descriptors[table_name] = dict()
+            main_descriptor = env.open_db(None, txn=txn)
+            for column in table.indexes:
+                legacy_name = f"{physical_name}:{column}".encode()
+                if txn.get(legacy_name, db=main_descriptor) is not None:
+                    txn.drop(env.open_db(legacy_name, txn=txn, dupsort=True), delete=True)
+                index_name = f"{physical_name}:{column}:v{INDEX_VERSION}".encode()
+                self.index_descriptors[table_name][column] = env.open_db(index_name, txn=txn, dupsort=True)
 
-    def _lmdb_sync(self) -> None:
-        self.environment = self._lmdb_open(self.path)
-        for table_name in self.tables:
-            self._lmdb_get_db_descriptor(self.environment,
-                                         self.tables[table_name],
-                                         table_name)
-
-    def _lmdb_create_tmp(self) -> lmdb.Environment:
-        shutil.rmtree("/tmp/lmdb-copy", ignore_errors=True)
-        return self._lmdb_open("/tmp/lmdb-copy")
-
-    def _lmdb_copy_tmp(self) -> lmdb.Environment:
-        shutil.rmtree(self.path)
-        shutil.copytree("/tmp/lmdb-copy", self.path)
-        shutil.rmtree("/tmp/lmdb-copy")
+            history = txn.get(physical_name.encode(), db=self.schemas_descriptor)
+            history = loads(history) if history is not None else []
+            table.codec = self.codec_cls(table.value_columns(), history)
+            if table.codec.history != history:
+                txn.put(physical_name.encode(), dumps(table.codec.history), db=self.schemas_descriptor)
+
+    # Открывает таблицу без записи: каталог, индексы и история раскладок уже есть в базе.
+    # Базы открываются вне транзакции чтения: открытые в ней дескрипторы живут только до её конца
+    def _lmdb_open_existing(self,
+                            table: LMDBTable,
+                            table_name: str) -> None:
+        with self._lmdb_txn(db=self.catalog_descriptor) as txn:
+            physical_name = txn.get(table_name.encode())
+            if physical_name is None:
+                raise KeyError(f"Table {table_name} not presented in {self.path}!")
+            history = txn.get(physical_name, db=self.schemas_descriptor)
+        physical_name = physical_name.decode()
+        self.db_descriptors[table_name] = self.environment.open_db(physical_name.encode(),
+                                                                   integerkey=table.key is None,
+                                                                   create=False)
+        self.index_descriptors[table_name] = {
+            column: self.environment.open_db(f"{physical_name}:{column}:v{INDEX_VERSION}".encode(),
+                                             dupsort=True, create=False)
+            for column in table.indexes}
+        table.codec = self.codec_cls(table.value_columns(), loads(history) if history is not None else [])
+
+    # Находит базу таблицы в каталоге, а для новой таблицы заводит запись.
+    # Базы без записи в каталоге (созданные до его появления) называются по имени таблицы
+    def _lmdb_physical_name(self,
+                            txn: lmdb.Transaction,
+                            table_name: str) -> str:
+        physical_name = txn.get(table_name.encode())
+        if physical_name is not None:
+            return physical_name.decode()
+
+        taken = {value for _, value in txn.cursor()}
+        physical_name, suffix = table_name, 0
+        # имя может быть занято таблицей, переименованной из table_name
+        while physical_name.encode() in taken:
+            suffix += 1
+            physical_name = f"{table_name}#{suffix}"
+        txn.put(table_name.encode(), physical_name.encode())
+        return physical_name
+
+    # Достраивает пустые индексы по уже лежащим в таблице строкам
+    def _lmdb_build_indexes(self,
+                            env: lmdb.Environment,
+                            table: LMDBTable,
+                            table_name: str) -> None:
+        with self._lmdb_txn(write=True, db=self.db_descriptors[table_name]) as txn:
+            if txn.stat(self.db_descriptors[table_name])["entries"] == 0:
+                return
+            for column, index_db in self.index_descriptors[table_name].items():
+                if txn.stat(index_db)["entries"] != 0:
+                    continue
+                for key, value in txn.cursor():
+                    row_data = table.process_db_row(value, key)[0]
+                    txn.put(self._lmdb_index_key(table, column, row_data.get(column)), key, db=index_db)
@@ -0,0 +1,334 @@
+from collections.abc import AsyncIterator, Callable, Iterable
+
+from .base_engine import BaseEngine, Table, chunked, crc64
+from .codecs import coerce, column_kind
+from .metrics import current_probe
+from .query import Filter, Order, check_window, compile_predicate
+
+
+# Строки хранятся кортежами значений в порядке колонок, уже приведёнными к типам колонок:
+# чтение ничего не раскодирует, только собирает словарь. Ключ строки - значение ключа таблицы,
+# у таблиц без ключа - crc64 всей строки, как в LMDB
+class MemoryTable(Table):
+    rows: dict[object, tuple]
+    hash_indexes: dict[str, dict[object, set]]
+
+    def __init__(self,
+                 columns: dict[str, object],
+                 key: str | None = None,
+                 indexes: list[str | tuple[str, ...]] | None = None,
+                 autoincrement: bool = False) -> None:
+        super().__init__(columns, key, indexes, autoincrement)
+        self.rows = dict()
+        self.names = tuple(columns)
+        self.positions = {column: position for position, column in enumerate(columns)}
+        # значение индексированной колонки -> ключи строк; значения object-колонок
+        # могут быть нехэшируемыми, такие колонки не индексируются
+        self.hash_indexes = {column: dict() for column in self.indexes if column_kind(columns[column]) != 'object'}
+        self.last_key = 0
+
+    def process_db_row(self,
+                       row_data: tuple,
+                       row_key: object,
+                       conditions: list[Filter] | None = None,
+                       columns: tuple[str, ...] | None = None) -> list[dict]:
+        if columns is None:
+            return [dict(zip(self.names, row_data))]
+        positions = self.positions
+        return [{column: row_data[positions[column]] for column in columns}]
+
+    def make_db_row(self,
+                    row_data: dict) -> tuple:
+        values = tuple(coerce(row_data[column], annotation) for column, annotation in self.columns.items())
+        if self.key is not None:
+            return (values[self.positions[self.key]], values)
+        return (crc64({column: str(value) for column, value in row_data.items()}), values)
+
+    def put(self,
+            row_key: object,
+            values: tuple) -> None:
+        self.remove(row_key)
+        self.rows[row_key] = values
+        for column, index in self.hash_indexes.items():
+            index.setdefault(values[self.positions[column]], set()).add(row_key)
+        if self.autoincrement and row_key > self.last_key:
+            self.last_key = row_key
+
+    def remove(self, row_key: object) -> bool:
+        values = self.rows.pop(row_key, None)
+        if values is None:
+            return False
+        for column, index in self.hash_indexes.items():
+            value = values[self.positions[column]]
+            row_keys = index[value]
+            row_keys.discard(row_key)
+            if not row_keys:
+                del index[value]
+        return True
+
+    # Строки-кандидаты (ключ строки, значения) под условия и план: равенство или in по ключу,
+    # по самому селективному хэш-индексу, иначе все строки таблицы
+    def candidates(self, filters: list[Filter]) -> tuple[Iterable[tuple[object, tuple]], str]:
+        rows = self.rows
+        best = None
+        for column, operator, operand in filters:
+            if operator not in ('eq', 'in'):
+                continue
+            values = dict.fromkeys([operand] if operator == 'eq' else operand)
+            if column == self.key:
+                return [(value, rows[value]) for value in values if value in rows], "key"
+            index = self.hash_indexes.get(column)
+            if index is not None:
+                row_keys = [row_key for value in values for row_key in index.get(value, ())]
+                if best is None or len(row_keys) < len(best[0]):
+                    best = (row_keys, f"index {column}")
+        if best is not None:
+            return [(row_key, rows[row_key]) for row_key in best[0]], best[1]
+        return rows.items(), "full scan"
+
+    # Сортировка кортежей как sort_rows: NULL идут первыми
+    def sort(self,
+             rows: list[tuple],
+             order: Order) -> list[tuple]:
+        for column, descending in reversed(order):
+            position = self.positions[column]
+            rows.sort(key=lambda row: (row[position] is not None, row[position]), reverse=descending)
+        return rows
+
+
+# Таблицы целиком в памяти процесса: без транзакций, файлов и раскодирования строк.
+# Операции выполняются прямо в потоке событий, поэтому подходит для небольших таблиц-справочников.
+# path ни на что не влияет, данные живут до закрытия движка
+class MemoryEngine(BaseEngine):
+    tables: dict[str, MemoryTable]
+    threaded_io = False
+
+    def __init__(self,
+                 path: str = ":memory:",
+                 chunk_size: int = 10_000,
+                 threads_count: int = -1) -> None:
+        super().__init__(path, chunk_size, threads_count)
+        self.entity_catalog = dict()
+
+    def create_table(self,
+                     name: str,
+                     columns: dict[str, object],
+                     key: str | None = None,
+                     indexes: list[str | tuple[str, ...]] | None = None,
+                     autoincrement: bool = False) -> None:
+        if name in self.tables:
+            return
+        self.tables[name] = MemoryTable(columns, key, indexes, autoincrement)
+
+    def rename_table(self,
+                     old_name: str,
+                     new_name: str) -> None:
+        if new_name in self.tables:
+            raise ValueError(f"Table {new_name} already exists!")
+        self.tables[new_name] = self.tables.pop(old_name)
+
+    def delete_table(self, name: str) -> None:
+        del self.tables[name]
+
+    def entity_names(self) -> dict[str, str]:
+        return dict(self.entity_catalog)
+
+    def save_entity_name(self,
+                         entity_name: str,
+                         table_name: str) -> None:
+        self.entity_catalog[entity_name] = table_name
+
+    # схема живёт в словарях, ждать нечего
+    async def run_schema(self, func: Callable, *args) -> object:
+        return func(*args)
+
+    async def select(self,
+                     table_name: str,
+                     conditions: dict[str, object] | None = None,
+                     order_by: str | Iterable[str] | None = None,
+                     limit: int | None = None,
+                     offset: int = 0,
+                     columns: Iterable[str] | None = None) -> list[dict]:
+        check_window(limit, offset)
+        with self._measure('select', table_name, conditions) as probe:
+            return probe.returned(probe.wrap(self._memory_select)(table_name, conditions, order_by,
+                                                                  limit, offset, columns))
+
+    async def count(self,
+                    table_name: str,
+                    conditions: dict[str, object] | None = None) -> int:
+        with self._measure('count', table_name, conditions) as probe:
+            return probe.wrap(self._memory_count)(table_name, conditions)
+
+    async def exists(self,
+                     table_name: str,
+                     conditions: dict[str, object] | None = None) -> bool:
+        with self._measure('exists', table_name, conditions) as probe:
+            return probe.wrap(self._memory_count)(table_name, conditions, 1) > 0
+
+    async def select_many_by_key(self,
+                                 table_name: str,
+                                 keys: Iterable[object]) -> list[dict]:
+        table = self.tables[table_name]
+        if table.key is None:
+            raise ValueError(f"Table {table_name} has no key!")
+        with self._measure('select_many_by_key', table_name) as probe:
+            return probe.returned(probe.wrap(self._memory_select_many_by_key)(table, keys))
+
+    async def insert(self,
+                     table_name: str,
+                     row_data: dict[str, object]) -> None:
+        with self._measure('insert', table_name) as probe:
+            probe.wrap(self._memory_write_batch)([('insert', table_name, [row_data])])
+
+    async def delete(self,
+                     table_name: str,
+                     row_data: dict[str, object]) -> None:
+        with self._measure('delete', table_name) as probe:
+            probe.wrap(self._memory_write_batch)([('delete', table_name, [row_data])])
+
+    async def insert_many(self,
+                          table_name: str,
+                          rows: Iterable[dict[str, object]],
+                          chunk_size: int | None = None) -> None:
+        with self._measure('insert_many', table_name) as probe:
+            for chunk in chunked(rows, chunk_size or self.chunk_size):
+                probe.wrap(self._memory_write_batch)([('insert', table_name, chunk)])
+
+    async def delete_many(self,
+                          table_name: str,
+                          rows: Iterable[dict[str, object]],
+                          chunk_size: int | None = None) -> None:
+        with self._measure('delete_many', table_name) as probe:
+            for chunk in chunked(rows, chunk_size or self.chunk_size):
+                probe.wrap(self._memory_write_batch)([('delete', table_name, chunk)])
+
+    # Страницы берутся из списка подходящих строк на момент начала выборки
+    async def select_batches(self,
+                             table_name: str,
+                             conditions: dict[str, object] | None = None,
+                             batch_size: int | None = None,
+                             columns: Iterable[str] | None = None) -> AsyncIterator[list[dict]]:
+        table = self.tables[table_name]
+        columns = table.projection(columns)
+        with self._measure('select_batches', table_name, conditions) as probe:
+            rows = probe.wrap(self._memory_matches)(table, table.filters(conditions))
+            for chunk in chunked(rows, batch_size or self.chunk_size):
+                yield probe.returned([table.process_db_row(values, None, columns=columns)[0] for _, values in chunk])
+
+    async def write_batch(self, operations: list[tuple[str, str, list[dict[str, object]]]]) -> None:
+        with self._measure('write_batch', None) as probe:
+            probe.wrap(self._memory_write_batch)(operations)
+
+    def _memory_select(self,
+                       table_name: str,
+                       conditions: dict[str, object] | None,
+                       order_by: str | Iterable[str] | None,
+                       limit: int | None,
+                       offset: int,
+                       columns: Iterable[str] | None) -> list[dict]:
+        table = self.tables[table_name]
+        filters, order = table.filters(conditions), table.order(order_by)
+        columns = table.projection(columns)
+        if limit == 0:
+            return []
+        end = offset + limit if limit is not None else None
+        # без сортировки проход обрывается, как только набралось окно
+        rows = [values for _, values in self._memory_matches(table, filters, None if order else end)]
+        if order:
+            rows = table.sort(rows, order)
+        return [table.process_db_row(values, None, columns=columns)[0] for values in rows[offset:end]]
+
+    def _memory_count(self,
+                      table_name: str,
+                      conditions: dict[str, object] | None = None,
+                      limit: int | None = None) -> int:
+        table = self.tables[table_name]
+        filters = table.filters(conditions)
+        if not filters:
+            count = len(table.rows)
+            return count if limit is None else min(count, limit)
+        return len(self._memory_matches(table, filters, limit))
+
+    def _memory_select_many_by_key(self,
+                                   table: MemoryTable,
+                                   keys: Iterable[object]) -> list[dict]:
+        rows = table.rows
+        found = [rows[key] for key in (table.coerce(table.key, key) for key in keys) if key in rows]
+        if (probe := current_probe()) is not None:
+            probe.plan = "key"
+            probe.rows_scanned += len(found)
+        return [table.process_db_row(values, None)[0] for values in found]
+
+    # Подходящие строки как (ключ строки, значения); limit - остановиться, найдя столько строк
+    def _memory_matches(self,
+                        table: MemoryTable,
+                        filters: list[Filter],
+                        limit: int | None = None) -> list[tuple[object, tuple]]:
+        candidates, plan = table.candidates(filters)
+        check = compile_predicate(filters, table.names)
+        matches, scanned = [], 0
+        for row_key, values in candidates:
+            scanned += 1
+            if check(values):
+                matches.append((row_key, values))
+                if len(matches) == limit:
+                    break
+        if (probe := current_probe()) is not None:
+            probe.plan = plan
+            probe.rows_scanned += scanned
+        return matches
+
+    # Пачка сначала целиком готовится (ключи, приведённые значения, условия), потом применяется:
+    # ошибка в данных не оставляет пачку применённой наполовину
+    def _memory_write_batch(self, operations: list[tuple[str, str, list[dict[str, object]]]]) -> None:
+        prepared = []
+        for operation, table_name, rows in operations:
+            table = self.tables[table_name]
+            if operation == 'insert':
+                if table.autoincrement:
+                    self._memory_assign_keys(table, rows)
+                prepared.append((operation, table, [table.make_db_row(row_data) for row_data in rows]))
+            else:
+                prepared.append((operation, table, [self._memory_delete_target(table, row_data) for row_data in rows]))
+
+        probe = current_probe()
+        for operation, table, targets in prepared:
+            written = 0
+            if operation == 'insert':
+                for row_key, values in targets:
+                    table.put(row_key, values)
+                written = len(targets)
+            else:
+                for row_key, filters in targets:
+                    if filters is None:
+                        written += table.remove(row_key)
+                        continue
+                    for row_key, _ in self._memory_matches(table, filters):
+                        written += table.remove(row_key)
+            if probe is not None:
+                probe.rows_written += written
+
+    # Что удалять: (ключ строки, None) - строку по ключу, (None, условия) - строки по условиям
+    def _memory_delete_target(self,
+                              table: MemoryTable,
+                              row_data: dict[str, object]) -> tuple[object, list[Filter] | None]:
+        if table.key is not None and table.key in row_data:
+            return (table.coerce(table.key, row_data[table.key]), None)
+        if table.key is None and list(row_data) == list(table.columns):
+            row_key, _ = table.make_db_row(row_data)
+            return (row_key, None)
+        return (None, table.filters(row_data))
+
+    def _memory_assign_keys(self,
+                            table: MemoryTable,
+                            rows: list[dict[str, object]]) -> None:
+        next_key = table.last_key + 1
+        # ключи, заданные явно в этой же пачке, тоже заняты
+        for row_data in rows:
+            if row_data.get(table.key) is not None:
+                next_key = max(next_key, table.coerce(table.key, row_data[table.key]) + 1)
+        for row_data in rows:
+            if row_data.get(table.key) is None:
+                row_data[table.key] = next_key
+                next_key += 1
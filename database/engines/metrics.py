@@ -0,0 +1,248 @@
+from bisect import bisect_left
+from collections.abc import Callable, Iterable, Iterator
+from functools import partial
+import logging
+import threading
+from time import perf_counter
+
+
+# Границы корзин гистограммы задержек в секундах: степени двойки от ~1 мкс до 64 с
+LATENCY_BUCKETS = tuple(2.0 ** exponent for exponent in range(-20, 7))
+
+# замер операции, которую сейчас выполняет поток движка
+_current = threading.local()
+
+
+def current_probe() -> 'Probe | None':
+    return getattr(_current, 'probe', None)
+
+
+# Замер одной операции движка. Счётчики заполняют сами движки: сколько строк прочитано
+# и отдано, сколько байт прочитано и записано, сколько транзакций открыто и каким планом шли
+class Probe:
+    __slots__ = ('metrics', 'operation', 'table', 'conditions', 'plan', 'started', 'seconds', 'error',
+                 'rows_scanned', 'rows_returned', 'rows_written', 'bytes_read', 'bytes_written', 'transactions')
+
+    def __init__(self,
+                 metrics: 'Metrics | None',
+                 operation: str,
+                 table: str | None,
+                 conditions: dict[str, object] | None = None) -> None:
+        self.metrics = metrics
+        self.operation = operation
+        self.table = table
+        self.conditions = conditions
+        self.plan = None
+        self.started = 0.0
+        self.seconds = 0.0
+        self.error = None
+        self.rows_scanned = 0
+        self.rows_returned = 0
+        self.rows_written = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.transactions = 0
+
+    def __enter__(self) -> 'Probe':
+        self.started = perf_counter()
+        return self
+
+    def __exit__(self, exc_type: type | None, *_) -> bool:
+        self.seconds = perf_counter() - self.started
+        # брошенный на середине select_batches - не ошибка
+        if exc_type is not None and exc_type is not GeneratorExit:
+            self.error = exc_type.__name__
+        self.metrics.record(self)
+        return False
+
+    def returned(self, rows: list) -> list:
+        self.rows_returned += len(rows)
+        return rows
+
+    # Функция для потока движка: на время её работы замер доступен через current_probe()
+    def wrap(self, func: Callable) -> Callable:
+        return partial(self._run, func)
+
+    def scanned(self, candidates: Iterator[tuple]) -> Iterator[tuple]:
+        for candidate in candidates:
+            self.rows_scanned += 1
+            self.bytes_read += len(candidate[-1] or b"")
+            yield candidate
+
+    # Строки, полученные от движка, который не сообщает, сколько прочитал сам
+    def fetched(self, values: list[tuple]) -> list[tuple]:
+        self.rows_scanned += len(values)
+        self.bytes_read += sum(len(value) for row_values in values for value in row_values
+                               if isinstance(value, (str, bytes)))
+        return values
+
+    def _run(self, func: Callable, *args) -> object:
+        _current.probe = self
+        self.transactions += 1
+        try:
+            return func(*args)
+        finally:
+            _current.probe = None
+
+
+# Замер при выключенных метриках: ничего не считает и не оборачивает
+class NullProbe(Probe):
+    __slots__ = ()
+
+    def __init__(self) -> None:
+        super().__init__(None, '', None)
+
+    def __enter__(self) -> 'Probe':
+        return self
+
+    def __exit__(self, *_) -> bool:
+        return False
+
+    def returned(self, rows: list) -> list:
+        return rows
+
+    def fetched(self, values: list[tuple]) -> list[tuple]:
+        return values
+
+    def wrap(self, func: Callable) -> Callable:
+        return func
+
+
+NULL_PROBE = NullProbe()
+
+
+# Подключается к движку через Database(metrics=...) или engine.metrics.
+# sinks - любые callable от завершённого Probe: MetricsRegistry, LoggingSink или свой обработчик.
+# Операции дольше slow_query_threshold секунд пишутся в лог медленных запросов
+class Metrics:
+    sinks: list[Callable[[Probe], None]]
+
+    def __init__(self,
+                 sinks: Iterable[Callable[[Probe], None]] = (),
+                 slow_query_threshold: float | None = None,
+                 slow_query_logger: logging.Logger | None = None) -> None:
+        if slow_query_threshold is not None and slow_query_threshold < 0:
+            raise ValueError('"slow_query_threshold" must be zero or greater!')
+        self.sinks = list(sinks)
+        self.slow_query_threshold = slow_query_threshold
+        self.slow_query_logger = slow_query_logger or logging.getLogger("database.slow_queries")
+
+    def add_sink(self, sink: Callable[[Probe], None]) -> None:
+        self.sinks.append(sink)
+
+    def probe(self,
+              operation: str,
+              table: str | None,
+              conditions: dict[str, object] | None = None) -> Probe:
+        return Probe(self, operation, table, conditions)
+
+    def record(self, probe: Probe) -> None:
+        for sink in self.sinks:
+            sink(probe)
+        if self.slow_query_threshold is not None and probe.seconds >= self.slow_query_threshold:
+            self.slow_query_logger.warning(f"Slow {describe(probe)}")
+
+
+def describe(probe: Probe) -> str:
+    text = (f"{probe.operation} on {probe.table}: {probe.seconds * 1000:.3f} ms, "
+            f"scanned {probe.rows_scanned}, returned {probe.rows_returned}, written {probe.rows_written}, "
+            f"read {probe.bytes_read} B, wrote {probe.bytes_written} B, transactions {probe.transactions}")
+    if probe.plan is not None:
+        text += f", plan {probe.plan}"
+    if probe.conditions:
+        text += f", conditions {probe.conditions}"
+    if probe.error is not None:
+        text += f", error {probe.error}"
+    return text
+
+
+# Накопленная статистика одной пары (операция, таблица)
+class OperationStats:
+    def __init__(self) -> None:
+        self.count = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.rows_scanned = 0
+        self.rows_returned = 0
+        self.rows_written = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.transactions = 0
+
+    def add(self, probe: Probe) -> None:
+        self.count += 1
+        self.errors += probe.error is not None
+        self.seconds += probe.seconds
+        self.max_seconds = max(self.max_seconds, probe.seconds)
+        self.buckets[bisect_left(LATENCY_BUCKETS, probe.seconds)] += 1
+        self.rows_scanned += probe.rows_scanned
+        self.rows_returned += probe.rows_returned
+        self.rows_written += probe.rows_written
+        self.bytes_read += probe.bytes_read
+        self.bytes_written += probe.bytes_written
+        self.transactions += probe.transactions
+
+    # Верхняя граница корзины, в которую попадает доля share замеров
+    def quantile(self, share: float) -> float:
+        rank = share * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank and seen:
+                return min(bound, self.max_seconds)
+        return self.max_seconds
+
+    def as_dict(self) -> dict[str, object]:
+        return {'count': self.count,
+                'errors': self.errors,
+                'seconds': self.seconds,
+                'mean': self.seconds / self.count if self.count else 0.0,
+                'p50': self.quantile(0.5),
+                'p90': self.quantile(0.9),
+                'p99': self.quantile(0.99),
+                'max': self.max_seconds,
+                'rows_scanned': self.rows_scanned,
+                'rows_returned': self.rows_returned,
+                'rows_written': self.rows_written,
+                'bytes_read': self.bytes_read,
+                'bytes_written': self.bytes_written,
+                'transactions': self.transactions}
+
+
+# Приёмник, копящий гистограммы и счётчики в памяти процесса
+class MetricsRegistry:
+    stats: dict[tuple[str, str | None], OperationStats]
+
+    def __init__(self) -> None:
+        self.stats = dict()
+        self.lock = threading.Lock()
+
+    def __call__(self, probe: Probe) -> None:
+        with self.lock:
+            stats = self.stats.get((probe.operation, probe.table))
+            if stats is None:
+                stats = self.stats[(probe.operation, probe.table)] = OperationStats()
+            stats.add(probe)
+
+    def snapshot(self) -> dict[tuple[str, str | None], dict[str, object]]:
+        with self.lock:
+            return {name: stats.as_dict() for name, stats in self.stats.items()}
+
+    def reset(self) -> None:
+        with self.lock:
+            self.stats.clear()
+
+
+# Приёмник, пишущий каждую операцию в лог
+class LoggingSink:
+    def __init__(self,
+                 logger: logging.Logger | None = None,
+                 level: int = logging.DEBUG) -> None:
+        self.logger = logger or logging.getLogger("database.metrics")
+        self.level = level
+
+    def __call__(self, probe: Probe) -> None:
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, describe(probe))
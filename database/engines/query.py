@@ -0,0 +1,165 @@
+from collections.abc import Callable, Iterable, Sequence
+
+from .codecs import coerce, column_kind
+
+
+# Условие pull(...) - "колонка" (равенство) или "колонка__оператор"
+OPERATORS: dict[str, Callable[[object, object], bool]] = {
+    'eq': lambda value, operand: value == operand,
+    'lt': lambda value, operand: value is not None and value < operand,
+    'le': lambda value, operand: value is not None and value <= operand,
+    'gt': lambda value, operand: value is not None and value > operand,
+    'ge': lambda value, operand: value is not None and value >= operand,
+    'between': lambda value, operand: value is not None and operand[0] <= value <= operand[1],
+    'in': lambda value, operand: value in operand,
+    'prefix': lambda value, operand: value is not None and value.startswith(operand),
+}
+RANGE_OPERATORS = {'lt', 'le', 'gt', 'ge', 'between', 'prefix'}
+# Те же проверки исходником для compile_predicate: {v} - значение колонки, {o} - операнд
+CHECKS: dict[str, str] = {
+    'eq': '{v} == {o}',
+    'lt': '{v} is not None and {v} < {o}',
+    'le': '{v} is not None and {v} <= {o}',
+    'gt': '{v} is not None and {v} > {o}',
+    'ge': '{v} is not None and {v} >= {o}',
+    'between': '{v} is not None and {o}[0] <= {v} <= {o}[1]',
+    'in': '{v} in {o}',
+    'prefix': '{v} is not None and {v}.startswith({o})',
+}
+HASHABLE_TYPES = (int, float, bool, str, bytes, type(None))
+
+# фабрики предикатов по форме условий: (позиция колонки, оператор) для каждого условия
+_predicate_factories: dict[tuple[tuple[int, str], ...], Callable[..., Callable[[Sequence], bool]]] = dict()
+
+# (колонка, оператор, приведённое к типу колонки значение)
+Filter = tuple[str, str, object]
+# (колонка, по убыванию)
+Order = list[tuple[str, bool]]
+# (нижняя граница, включительно, верхняя граница, включительно)
+Bounds = tuple[object, bool, object, bool]
+
+
+def parse_conditions(columns: dict[str, object],
+                     conditions: dict[str, object] | None) -> list[Filter]:
+    filters = []
+    for name, value in (conditions or {}).items():
+        column, operator = name, 'eq'
+        # колонка сама может содержать "__", поэтому суффикс отделяется только известный
+        if name not in columns and '__' in name:
+            column, operator = name.rsplit('__', 1)
+            if operator not in OPERATORS:
+                raise ValueError(f"Unknown operator '{operator}' passed!")
+        if column not in columns:
+            raise KeyError(f"Key {column} not presented in column list!")
+
+        annotation = columns[column]
+        if operator == 'in':
+            value = tuple(coerce(item, annotation) for item in value)
+        elif operator == 'between':
+            low, high = value
+            value = (coerce(low, annotation), coerce(high, annotation))
+        elif operator == 'prefix' and column_kind(annotation) not in ('str', 'bytes'):
+            raise ValueError(f"Prefix condition requires a str or bytes column, got {column}!")
+        else:
+            value = coerce(value, annotation)
+        filters.append((column, operator, value))
+    return filters
+
+
+# order_by: "колонка", "-колонка" (по убыванию) или их список
+def parse_order(columns: dict[str, object],
+                order_by: str | Iterable[str] | None) -> Order:
+    if order_by is None:
+        return []
+    if isinstance(order_by, str):
+        order_by = [order_by]
+    order = []
+    for name in order_by:
+        column = name.removeprefix('-')
+        if column not in columns:
+            raise KeyError(f"Key {column} not presented in column list!")
+        order.append((column, name.startswith('-')))
+    return order
+
+
+def check_window(limit: int | None, offset: int) -> None:
+    if limit is not None and limit < 0:
+        raise ValueError('"limit" must not be negative!')
+    if offset < 0:
+        raise ValueError('"offset" must not be negative!')
+
+
+def matches(data: dict[str, object], filters: list[Filter]) -> bool:
+    for column, operator, operand in filters:
+        if not OPERATORS[operator](data.get(column), operand):
+            return False
+    return True
+
+
+# Условия, собранные в одну функцию от значений колонок columns (в том же порядке).
+# Исходник строится один раз на форму условий, значения операндов подставляются при вызове
+def compile_predicate(filters: list[Filter], columns: tuple[str, ...]) -> Callable[[Sequence], bool]:
+    shape = tuple((columns.index(column), operator) for column, operator, _ in filters)
+    factory = _predicate_factories.get(shape)
+    if factory is None:
+        checks = [f"({CHECKS[operator].format(v=f'values[{position}]', o=f'o{number}')})"
+                  for number, (position, operator) in enumerate(shape)]
+        source = (f"def factory({', '.join(f'o{number}' for number in range(len(shape)))}):\n"
+                  f"    return lambda values: {' and '.join(checks) or 'True'}")
+        namespace = dict()
+        exec(source, namespace)
+        factory = _predicate_factories[shape] = namespace['factory']
+    operands = []
+    for _, operator, operand in filters:
+        # in по множеству, если значения колонки заведомо хэшируемые
+        if operator == 'in' and all(isinstance(item, HASHABLE_TYPES) for item in operand):
+            operand = frozenset(operand)
+        operands.append(operand)
+    return factory(*operands)
+
+
+# Сортировка в памяти для планов, не отдающих строки в нужном порядке; NULL идут первыми
+def sort_rows(rows: list, order: Order, row_data: Callable[[object], dict] | None = None) -> list:
+    row_data = row_data or (lambda row: row)
+    for column, descending in reversed(order):
+        rows.sort(key=lambda row: (row_data(row)[column] is not None, row_data(row)[column]), reverse=descending)
+    return rows
+
+
+def prefix_successor(prefix: str | bytes) -> str | bytes | None:
+    # наименьшее значение больше всех строк с этим префиксом; None - такого нет
+    if isinstance(prefix, bytes):
+        prefix = prefix.rstrip(b"\xff")
+        return prefix[:-1] + bytes([prefix[-1] + 1]) if prefix else None
+    prefix = prefix.rstrip(chr(0x10FFFF))
+    if not prefix:
+        return None
+    code = ord(prefix[-1]) + 1
+    # суррогаты не кодируются в UTF-8, следующий за ними символ - U+E000
+    return prefix[:-1] + chr(0xE000 if 0xD800 <= code < 0xE000 else code)
+
+
+# Сводит диапазонные условия на колонку к одному интервалу; None - условий на колонку нет
+def column_bounds(filters: list[Filter], column: str) -> Bounds | None:
+    low, low_inclusive, high, high_inclusive = None, True, None, True
+    found = False
+    for filter_column, operator, operand in filters:
+        if filter_column != column or operator not in RANGE_OPERATORS:
+            continue
+        found = True
+        if operator == 'between':
+            candidates = [(operand[0], True, 'low'), (operand[1], True, 'high')]
+        elif operator == 'prefix':
+            successor = prefix_successor(operand)
+            candidates = [(operand, True, 'low')]
+            if successor is not None:
+                candidates.append((successor, False, 'high'))
+        else:
+            side = 'low' if operator in ('gt', 'ge') else 'high'
+            candidates = [(operand, operator in ('ge', 'le'), side)]
+        for value, inclusive, side in candidates:
+            if side == 'low' and (low is None or value > low or value == low and not inclusive):
+                low, low_inclusive = value, inclusive
+            if side == 'high' and (high is None or value < high or value == high and not inclusive):
+                high, high_inclusive = value, inclusive
+    return (low, low_inclusive, high, high_inclusive) if found else None
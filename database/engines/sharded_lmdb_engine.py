@@ -0,0 +1,384 @@
+import asyncio
+from collections.abc import AsyncIterator, Callable, Iterable
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import cpu_count, get_context
+import os
+from zlib import crc32
+
+from .base_engine import BaseEngine, chunked, crc64
+from .codecs import BaseCodec
+from .lmdb_engine import LMDBEngine, LMDBTable
+from .query import check_window, sort_rows
+
+
+SHARD_DIRECTORY = "shard-{}"
+
+# Что нужно процессу-воркеру, чтобы открыть шард: путь, кодек, поколение схемы и описания таблиц
+# (колонки, ключ, индексы, автоинкремент)
+ShardSpec = tuple[str, str | type[BaseCodec], int, dict[str, tuple]]
+
+# шарды, открытые в процессе-воркере: путь -> (поколение схемы, движок)
+_worker_shards: dict[str, tuple[int, LMDBEngine]] = dict()
+
+
+# Воркер открывает шард только на чтение: таблицы, индексы и историю раскладок уже завёл
+# родительский процесс, а выросшую карту воркер лишь принимает при следующей транзакции
+def _worker_engine(spec: ShardSpec) -> LMDBEngine:
+    path, codec, generation, tables = spec
+    opened = _worker_shards.get(path)
+    # после переименования или удаления таблиц дескрипторы баз устарели - шард открывается заново
+    if opened is not None and opened[0] != generation:
+        opened[1].close()
+        opened = None
+    if opened is None:
+        opened = _worker_shards[path] = (generation, LMDBEngine(path, 1, codec=codec, readonly=True))
+    engine = opened[1]
+    for table_name, (columns, key, indexes, autoincrement) in tables.items():
+        if table_name not in engine.tables:
+            engine.create_table(table_name, columns, key, indexes, autoincrement)
+    return engine
+
+
+def _shard_select(spec: ShardSpec,
+                  table_name: str,
+                  conditions: dict[str, object] | None,
+                  order_by: str | Iterable[str] | None,
+                  limit: int | None,
+                  columns: tuple[str, ...] | None) -> list[dict]:
+    return _worker_engine(spec)._lmdb_select(table_name, conditions, order_by, limit, 0, columns)
+
+
+def _shard_count(spec: ShardSpec,
+                 table_name: str,
+                 conditions: dict[str, object] | None,
+                 limit: int | None) -> int:
+    return _worker_engine(spec)._lmdb_count(table_name, conditions, limit)
+
+
+# Таблицы, разложенные по N окружениям LMDB по хэшу ключа: у каждого шарда свой писатель.
+# Все записи и выборки по ключу идут в шарды этого процесса, а проходы по большим таблицам -
+# в пул процессов, где каждый воркер открывает шард только на чтение и фильтрует строки
+# у себя; результаты сливаются здесь. Пишет только этот процесс, поэтому рост карты
+# согласует ResizeLock его шардов, а воркеры лишь принимают новый размер из файла.
+# Процессы стартуют через spawn: главный модуль должен импортироваться без побочных эффектов
+class ShardedLMDBEngine(BaseEngine):
+    shards: list[LMDBEngine]
+    next_keys: dict[str, int]
+    process_pool: ProcessPoolExecutor | None
+    # ввод-вывод ведут шарды в своих потоках и процессы-воркеры
+    threaded_io = False
+
+    def __init__(self,
+                 path: str,
+                 shards: int | None = None,
+                 processes: int = -1,
+                 threads_count: int = -1,
+                 map_size: int = 2**26,
+                 chunk_size: int = 10_000,
+                 codec: str | type[BaseCodec] = 'binary',
+                 parallel_rows: int = 10_000,
+                 start_method: str = 'spawn',
+                 max_map_size: int | None = None,
+                 growth_factor: float = 2.0,
+                 high_water: float = 0.8) -> None:
+        super().__init__(path, chunk_size, threads_count)
+        if processes == -1:
+            processes = cpu_count()
+        elif processes <= 0:
+            raise ValueError('"processes" must be greater than zero or -1 to use all CPU cores!')
+        if parallel_rows <= 0:
+            raise ValueError('"parallel_rows" must be greater than zero!')
+        os.makedirs(path, exist_ok=True)
+        # число шардов задаёт раскладку ключей и не меняется после создания базы
+        existing = sum(1 for name in os.listdir(path) if name.startswith(SHARD_DIRECTORY.format("")))
+        if shards is None:
+            shards = existing or cpu_count()
+        elif shards <= 0:
+            raise ValueError('"shards" must be greater than zero!')
+        elif existing and existing != shards:
+            raise ValueError(f"Database {path} has {existing} shards, {shards} passed!")
+
+        # карта у каждого шарда своя и растёт независимо
+        self.map_options = {'map_size': map_size,
+                            'max_map_size': max_map_size,
+                            'growth_factor': growth_factor,
+                            'high_water': high_water}
+        self.codec = codec
+        self.processes = processes
+        self.parallel_rows = parallel_rows
+        self.start_method = start_method
+        self.shards = [LMDBEngine(os.path.join(path, SHARD_DIRECTORY.format(number)),
+                                  self.threads_count, chunk_size=chunk_size, codec=codec, **self.map_options)
+                       for number in range(shards)]
+        self.next_keys = dict()
+        # растёт при переименовании и удалении таблиц, воркеры по нему переоткрывают шарды
+        self.generation = 0
+        self.process_pool = None
+
+    def create_table(self,
+                     name: str,
+                     columns: dict[str, object],
+                     key: str | None = None,
+                     indexes: list[str | tuple[str, ...]] | None = None,
+                     autoincrement: bool = False) -> None:
+        for shard in self.shards:
+            shard.create_table(name, columns, key, indexes, autoincrement)
+        self.tables[name] = self.shards[0].tables[name]
+        if autoincrement:
+            self.next_keys[name] = max(self._last_key(shard, name) for shard in self.shards) + 1
+
+    def rename_table(self,
+                     old_name: str,
+                     new_name: str) -> None:
+        for shard in self.shards:
+            shard.rename_table(old_name, new_name)
+        self.tables[new_name] = self.tables.pop(old_name)
+        if old_name in self.next_keys:
+            self.next_keys[new_name] = self.next_keys.pop(old_name)
+        self.generation += 1
+
+    def delete_table(self, name: str) -> None:
+        for shard in self.shards:
+            shard.delete_table(name)
+        del self.tables[name]
+        self.next_keys.pop(name, None)
+        self.generation += 1
+
+    # Каталог имён сущностей хранится в первом шарде
+    def entity_names(self) -> dict[str, str]:
+        return self.shards[0].entity_names()
+
+    def save_entity_name(self,
+                         entity_name: str,
+                         table_name: str) -> None:
+        self.shards[0].save_entity_name(entity_name, table_name)
+
+    # Каждый шард отдаёт до offset + limit строк в нужном порядке, окно режется после слияния
+    async def select(self,
+                     table_name: str,
+                     conditions: dict[str, object] | None = None,
+                     order_by: str | Iterable[str] | None = None,
+                     limit: int | None = None,
+                     offset: int = 0,
+                     columns: Iterable[str] | None = None) -> list[dict]:
+        check_window(limit, offset)
+        table: LMDBTable = self.tables[table_name]
+        filters, order = table.filters(conditions), table.order(order_by)
+        columns = table.projection(columns)
+        # без order_by шарды отдают строки по ключу, и слияние сохраняет этот порядок;
+        # колонки сортировки нужны для слияния, даже если их нет в проекции
+        merge_order = order or ([(table.key, False)] if table.key is not None else [])
+        fetch = table.needed_columns(columns, [], merge_order)
+        shard_limit = offset + limit if limit is not None else None
+        with self._measure('select', table_name, conditions) as probe:
+            numbers = self._key_shards(table, filters)
+            if numbers is None and self._parallel(table_name):
+                parts = await self._fan_out(_shard_select, table_name, conditions, order_by, shard_limit, fetch)
+            else:
+                parts = await asyncio.gather(*(self.shards[number].select(table_name, conditions, order_by,
+                                                                          shard_limit, 0, fetch)
+                                               for number in self._numbers(numbers)))
+            rows = [data for part in parts for data in part]
+            if len(parts) > 1:
+                rows = sort_rows(rows, merge_order)
+            rows = rows[offset:shard_limit]
+            if fetch != columns:
+                rows = [{column: data.get(column) for column in columns} for data in rows]
+            return probe.returned(rows)
+
+    async def count(self,
+                    table_name: str,
+                    conditions: dict[str, object] | None = None) -> int:
+        with self._measure('count', table_name, conditions):
+            return sum(await self._count(table_name, conditions, None))
+
+    async def exists(self,
+                     table_name: str,
+                     conditions: dict[str, object] | None = None) -> bool:
+        with self._measure('exists', table_name, conditions):
+            return any(await self._count(table_name, conditions, 1))
+
+    # Шарды читаются по очереди, страницами каждого из них
+    async def select_batches(self,
+                             table_name: str,
+                             conditions: dict[str, object] | None = None,
+                             batch_size: int | None = None,
+                             columns: Iterable[str] | None = None) -> AsyncIterator[list[dict]]:
+        for shard in self.shards:
+            async for rows in shard.select_batches(table_name, conditions, batch_size, columns):
+                yield rows
+
+    async def select_many_by_key(self,
+                                 table_name: str,
+                                 keys: Iterable[object]) -> list[dict]:
+        table: LMDBTable = self.tables[table_name]
+        if table.key is None:
+            raise ValueError(f"Table {table_name} has no key!")
+        keys = list(keys)
+        encoded = [table.encode_key(key) for key in keys]
+        groups = dict()
+        for key, encoded_key in zip(keys, encoded):
+            groups.setdefault(self._shard_number(encoded_key), []).append(key)
+        with self._measure('select_many_by_key', table_name) as probe:
+            parts = await asyncio.gather(*(self.shards[number].select_many_by_key(table_name, group)
+                                           for number, group in groups.items()))
+            found = {table.encode_key(data[table.key]): data for part in parts for data in part}
+            return probe.returned([found[encoded_key] for encoded_key in encoded if encoded_key in found])
+
+    async def insert(self,
+                     table_name: str,
+                     row_data: dict[str, object]) -> None:
+        await self.write_batch([('insert', table_name, [row_data])])
+
+    async def delete(self,
+                     table_name: str,
+                     row_data: dict[str, object]) -> None:
+        await self.write_batch([('delete', table_name, [row_data])])
+
+    async def insert_many(self,
+                          table_name: str,
+                          rows: Iterable[dict[str, object]],
+                          chunk_size: int | None = None) -> None:
+        for chunk in chunked(rows, chunk_size or self.chunk_size):
+            await self.write_batch([('insert', table_name, chunk)])
+
+    async def delete_many(self,
+                          table_name: str,
+                          rows: Iterable[dict[str, object]],
+                          chunk_size: int | None = None) -> None:
+        for chunk in chunked(rows, chunk_size or self.chunk_size):
+            await self.write_batch([('delete', table_name, chunk)])
+
+    # Пачка раскладывается по шардам с сохранением порядка операций; каждый шард пишет свою
+    # часть одной транзакцией, шарды - параллельно. Атомарность пачки - в пределах шарда
+    async def write_batch(self, operations: list[tuple[str, str, list[dict[str, object]]]]) -> None:
+        with self._measure('write_batch', None):
+            per_shard = [[] for _ in self.shards]
+            for operation, table_name, rows in operations:
+                table: LMDBTable = self.tables[table_name]
+                if operation == 'insert' and table.autoincrement:
+                    self._assign_keys(table_name, rows)
+                parts = [[] for _ in self.shards]
+                for row_data in rows:
+                    number = self._row_shard(table, row_data)
+                    # строки без ключа удаляются по условиям во всех шардах
+                    for part in parts if number is None else [parts[number]]:
+                        part.append(row_data)
+                for shard_operations, part in zip(per_shard, parts):
+                    if part:
+                        shard_operations.append((operation, table_name, part))
+            await asyncio.gather(*(self.shards[number].write_batch(shard_operations)
+                                   for number, shard_operations in enumerate(per_shard) if shard_operations))
+
+    # Копия каждого шарда - в свой подкаталог path, как в самой базе
+    async def compact_backup(self, path: str) -> None:
+        await asyncio.gather(*(shard.compact_backup(os.path.join(path, SHARD_DIRECTORY.format(number)))
+                               for number, shard in enumerate(self.shards)))
+
+    def close(self) -> None:
+        if self.process_pool is not None:
+            self.process_pool.shutdown()
+        for shard in self.shards:
+            shard.close()
+        super().close()
+
+    async def _count(self,
+                     table_name: str,
+                     conditions: dict[str, object] | None,
+                     limit: int | None) -> list[int]:
+        table: LMDBTable = self.tables[table_name]
+        numbers = self._key_shards(table, table.filters(conditions))
+        if conditions and numbers is None and self._parallel(table_name):
+            return await self._fan_out(_shard_count, table_name, conditions, limit)
+        shards = [self.shards[number] for number in self._numbers(numbers)]
+        if limit == 1:
+            return await asyncio.gather(*(shard.exists(table_name, conditions) for shard in shards))
+        return await asyncio.gather(*(shard.count(table_name, conditions) for shard in shards))
+
+    async def _fan_out(self, func: Callable, table_name: str, *args) -> list:
+        loop = asyncio.get_running_loop()
+        pool = self._process_pool()
+        return await asyncio.gather(*(loop.run_in_executor(pool, func, self._spec(number, [table_name]),
+                                                           table_name, *args)
+                                      for number in range(len(self.shards))))
+
+    # Проход по процессам окупается только на больших таблицах
+    def _parallel(self, table_name: str) -> bool:
+        if self.processes == 1 or len(self.shards) == 1:
+            return False
+        return sum(self._entries(shard, table_name) for shard in self.shards) >= self.parallel_rows
+
+    def _process_pool(self) -> ProcessPoolExecutor:
+        if self.process_pool is None:
+            self.process_pool = ProcessPoolExecutor(self.processes, mp_context=get_context(self.start_method))
+        return self.process_pool
+
+    def _spec(self, number: int, table_names: Iterable[str]) -> ShardSpec:
+        tables = {table_name: (self.tables[table_name].columns,
+                               self.tables[table_name].key,
+                               self.tables[table_name].index_columns,
+                               self.tables[table_name].autoincrement)
+                  for table_name in table_names}
+        return (self.shards[number].path, self.codec, self.generation, tables)
+
+    def _numbers(self, numbers: list[int] | None) -> Iterable[int]:
+        return numbers if numbers is not None else range(len(self.shards))
+
+    def _shard_number(self, encoded_key: bytes) -> int:
+        return crc32(encoded_key) % len(self.shards)
+
+    # Шард строки: по ключу, у таблиц без ключа - по crc64 всей строки, как ключ LMDB.
+    # None - строку нельзя отнести к шарду (удаление по части колонок)
+    def _row_shard(self,
+                   table: LMDBTable,
+                   row_data: dict[str, object]) -> int | None:
+        if table.key is not None:
+            if row_data.get(table.key) is None:
+                return None
+            return self._shard_number(table.encode_key(row_data[table.key]))
+        if list(row_data) != list(table.columns):
+            return None
+        return self._shard_number(crc64({column: str(value) for column, value in row_data.items()}).to_bytes(8))
+
+    # Шарды, в которых могут быть строки при условии на ключ по равенству или in
+    def _key_shards(self,
+                    table: LMDBTable,
+                    filters: list) -> list[int] | None:
+        if table.key is None:
+            return None
+        for column, operator, operand in filters:
+            if column == table.key and operator in ('eq', 'in'):
+                values = [operand] if operator == 'eq' else operand
+                return sorted({self._shard_number(table.encode_key(value)) for value in values})
+        return None
+
+    # Ключи автоинкремента выдаются здесь, а не в шардах: они уникальны по всем шардам
+    def _assign_keys(self,
+                     table_name: str,
+                     rows: list[dict[str, object]]) -> None:
+        table: LMDBTable = self.tables[table_name]
+        next_key = self.next_keys[table_name]
+        # ключи, заданные явно в этой же пачке, тоже заняты
+        for row_data in rows:
+            if row_data.get(table.key) is not None:
+                next_key = max(next_key, table.coerce(table.key, row_data[table.key]) + 1)
+        for row_data in rows:
+            if row_data.get(table.key) is None:
+                row_data[table.key] = next_key
+                next_key += 1
+        self.next_keys[table_name] = next_key
+
+    def _last_key(self,
+                  shard: LMDBEngine,
+                  table_name: str) -> int:
+        table: LMDBTable = shard.tables[table_name]
+        with shard._lmdb_txn(db=shard.db_descriptors[table_name]) as txn:
+            cursor = txn.cursor()
+            return table.decode_key(cursor.key()) if cursor.last() else 0
+
+    def _entries(self,
+                 shard: LMDBEngine,
+                 table_name: str) -> int:
+        db = shard.db_descriptors[table_name]
+        with shard._lmdb_txn(db=db) as txn:
+            return txn.stat(db)["entries"]
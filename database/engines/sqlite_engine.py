@@ -1,99 +1,648 @@
+from ast import literal_eval
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Callable, Iterable
+import os
+from pickle import dumps, loads
 import sqlite3
+import threading
 
-from .base_engine import BaseEngine, Table
+from .base_engine import BULK_CHUNK_SIZE, BaseEngine, Table, chunked
+from .codecs import coerce, column_kind
+from .metrics import current_probe
+from .query import Filter, check_window, prefix_successor
+
+
+JOURNAL_MODES = {'delete', 'truncate', 'persist', 'memory', 'wal', 'off'}
+SYNCHRONOUS_MODES = {'off', 'normal', 'full', 'extra'}
+TEMP_STORES = {'default', 'file', 'memory'}
+COMPARISONS = {'eq': '=', 'lt': '<', 'le': '<=', 'gt': '>', 'ge': '>='}
+# Типы колонок по видам: значения привязываются как есть, object - через pickle
+COLUMN_TYPES = {'int': 'INTEGER', 'bool': 'INTEGER', 'float': 'REAL', 'str': 'TEXT', 'bytes': 'BLOB', 'object': 'BLOB'}
+# ANALYZE оценивает индекс по стольким строкам, а не по всей таблице
+ANALYSIS_LIMIT = 1000
+
+
+# Значение из таблицы, созданной до типизированных колонок: там всё хранилось через str()
+def legacy_value(value: object, annotation: object) -> object:
+    kind = column_kind(annotation)
+    if value is None or value == 'None' and kind != 'str':
+        return None
+    if kind == 'object' or not isinstance(value, str):
+        return value
+    if kind == 'bytes':
+        return literal_eval(value) if value.startswith(("b'", 'b"')) else value.encode()
+    try:
+        return coerce(value, annotation)
+    except ValueError:
+        # непереводимое значение остаётся как было, SQLite сохранит его текстом
+        return value
+
+
+def load_object(value: object) -> object:
+    # в перенесённых старых строках object-колонки остались текстом
+    return loads(value) if isinstance(value, bytes) else value
 
 
 class SQLiteTable(Table):
+    insert_sql: str
+    # преобразования значений колонок в привязываемые к SQL и обратно, только там, где они нужны
+    binders: dict[str, Callable[[object], object]]
+    loaders: dict[str, Callable[[object], object]]
+
+    def __init__(self,
+                 columns: dict[str, object],
+                 key: str | None = None,
+                 indexes: list[str | tuple[str, ...]] | None = None,
+                 autoincrement: bool = False) -> None:
+        super().__init__(columns, key, indexes, autoincrement)
+        kinds = {column: column_kind(annotation) for column, annotation in columns.items()}
+        self.binders = {column: dumps for column, kind in kinds.items() if kind == 'object'}
+        self.loaders = {column: bool if kind == 'bool' else load_object
+                        for column, kind in kinds.items() if kind in ('bool', 'object')}
+
     def process_db_row(self,
-                       row_data: tuple[str],
+                       row_data: tuple,
                        row_key: str,
-                       conditions: dict[str, object] | None = None) -> list[dict]:
-        data = dict(zip(self.columns, row_data))
+                       conditions: list[Filter] | None = None,
+                       columns: tuple[str, ...] | None = None) -> list[dict]:
+        data = dict(zip(columns or self.columns, row_data))
+        for column, load in self.loaders.items():
+            if data.get(column) is not None:
+                data[column] = load(data[column])
         return [data]
 
     def make_db_row(self,
-                    table_name: str,
                     row_data: dict) -> tuple:
-        key = f"INSERT OR REPLACE INTO {table_name} VALUES({','.join(['?'] * len(self.columns))})"
-        value = list(tuple(row_data.values()))
-        return (key, value)
+        value = [row_data[column] for column in self.columns]
+        if self.binders:
+            value = [self.bind(column, item) for column, item in zip(self.columns, value)]
+        return (self.insert_sql, value)
+
+    def bind(self,
+             column: str,
+             value: object) -> object:
+        binder = self.binders.get(column)
+        return binder(value) if binder is not None and value is not None else value
+
+    def column_types(self) -> list[tuple[str, str]]:
+        return [(column, COLUMN_TYPES[column_kind(annotation)]) for column, annotation in self.columns.items()]
+
+    def index_name(self,
+                   table_name: str,
+                   columns: tuple[str, ...]) -> str:
+        columns = ','.join(columns)
+        return f'"{table_name}:{columns}"'
 
 
 class SQLiteEngine(BaseEngine):
     connection: sqlite3.Connection
+    statements: OrderedDict[tuple, str]
 
     def __init__(self,
                  path: str,
-                 timeout: int = 5) -> None:
-        super().__init__(path)
-        self.connection = sqlite3.connect(path,
-                                          timeout=timeout,
-                                          check_same_thread=False,
-                                          autocommit=True)
+                 timeout: int = 5,
+                 chunk_size: int = 10_000,
+                 threads_count: int = -1,
+                 cached_statements: int = 256,
+                 journal_mode: str = 'wal',
+                 synchronous: str = 'normal',
+                 mmap_size: int = 2**28,
+                 cache_size: int = -2**16,
+                 temp_store: str = 'memory',
+                 analyze_rows: int = 100_000) -> None:
+        super().__init__(path, chunk_size, threads_count)
+        if analyze_rows <= 0:
+            raise ValueError('"analyze_rows" must be greater than zero!')
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+
+        # профиль производительности: WAL пускает читателей параллельно с писателем,
+        # synchronous=normal в WAL синхронизирует диск на чекпоинтах, а не на каждой транзакции
+        if journal_mode.lower() not in JOURNAL_MODES:
+            raise ValueError(f"Unknown journal_mode '{journal_mode}' passed!")
+        if synchronous.lower() not in SYNCHRONOUS_MODES:
+            raise ValueError(f"Unknown synchronous '{synchronous}' passed!")
+        if temp_store.lower() not in TEMP_STORES:
+            raise ValueError(f"Unknown temp_store '{temp_store}' passed!")
+        # journal_mode хранится в самом файле БД, поэтому выставляется только писателем
+        self.writer_pragmas = {'journal_mode': journal_mode.lower(),
+                               'synchronous': synchronous.lower(),
+                               'analysis_limit': ANALYSIS_LIMIT}
+        # cache_size < 0 - размер в КиБ, > 0 - в страницах
+        self.pragmas = {'mmap_size': int(mmap_size),
+                        'cache_size': int(cache_size),
+                        'temp_store': temp_store.lower()}
+        # шаблоны SQL по (вид запроса, таблица, колонки условий): значения идут параметрами,
+        # поэтому одинаковые по форме запросы попадают в кэш подготовленных выражений sqlite3.
+        # Форма зависит и от длины списков in, поэтому шаблонов - не больше cached_statements,
+        # давно не нужные вытесняются; строят их и потоки-читатели, и писатель
+        self.statements = OrderedDict()
+        self._statements_lock = threading.Lock()
+        # статистика индексов обновляется ANALYZE после каждых analyze_rows записанных в таблицу строк
+        self.analyze_rows = analyze_rows
+        self.written_rows: dict[str, int] = dict()
+        # соединение-писатель используется только из write_executor,
+        # у каждого потока-читателя своё соединение только на чтение
+        self.connection = self._sqlite_connect(readonly=False)
+        self._readers = threading.local()
+        self._reader_connections: list[sqlite3.Connection] = []
+        self._readers_lock = threading.Lock()
 
     def create_table(self,
                      name: str,
-                     columns: list[str],
-                     key: str | None = None) -> None:
-        self.tables[name] = SQLiteTable(columns, key)
-        cur = self.connection.cursor()
-        if key is not None:
-            columns.append(f"PRIMARY KEY({key})")
-        cur.execute(f"CREATE TABLE IF NOT EXISTS {name}({",".join(columns)})")
-        self.connection.commit()
-        cur.close()
+                     columns: dict[str, object],
+                     key: str | None = None,
+                     indexes: list[str | tuple[str, ...]] | None = None,
+                     autoincrement: bool = False) -> None:
+        table = self.tables[name] = SQLiteTable(columns, key, indexes, autoincrement)
+        table.insert_sql = f"INSERT OR REPLACE INTO {name} VALUES({','.join(['?'] * len(columns))})"
+        # колонки, их типы и ключ существующей таблицы; пусто - таблицы нет
+        layout = [(column, column_type, bool(pk)) for _, column, column_type, _, _, pk
+                  in self._sqlite_ddl(f"PRAGMA table_info({name})")]
+        if not layout:
+            self._sqlite_ddl(self._sqlite_create_sql(name, table))
+        elif layout != [(column, column_type, column == key) for column, column_type in table.column_types()]:
+            self.write_executor.submit(self._sqlite_rebuild_table, name, [column for column, _, _ in layout]).result()
+        self._sqlite_sync_indexes(name)
 
     def rename_table(self,
                      old_name: str,
                      new_name: str) -> None:
-        cur = self.connection.cursor()
-        cur.execute(f"ALTER TABLE `{old_name}` RENAME TO `{new_name}`")
-        self.connection.commit()
-        cur.close()
+        self._sqlite_ddl(f"ALTER TABLE `{old_name}` RENAME TO `{new_name}`")
+        self._sqlite_forget_statements(old_name)
+        table: SQLiteTable = self.tables.pop(old_name)
+        table.insert_sql = f"INSERT OR REPLACE INTO {new_name} VALUES({','.join(['?'] * len(table.columns))})"
+        self.tables[new_name] = table
+        self.written_rows.pop(old_name, None)
+        # индексы называются по таблице и переезжают под новые имена
+        for columns in table.index_columns:
+            self._sqlite_ddl(f"DROP INDEX IF EXISTS {table.index_name(old_name, columns)}")
+        self._sqlite_sync_indexes(new_name)
 
     def delete_table(self, name: str) -> None:
-        cur = self.connection.cursor()
-        cur.execute(f"DROP TABLE `{name}`")
-        self.connection.commit()
-        cur.close()
+        self._sqlite_ddl(f"DROP TABLE `{name}`")
+        self._sqlite_forget_statements(name)
+        self.written_rows.pop(name, None)
+        del self.tables[name]
+
+    def entity_names(self) -> dict[str, str]:
+        self._sqlite_ddl("CREATE TABLE IF NOT EXISTS __entities__(entity TEXT PRIMARY KEY, name TEXT)")
+        return dict(self._sqlite_ddl("SELECT entity, name FROM __entities__"))
+
+    def save_entity_name(self,
+                         entity_name: str,
+                         table_name: str) -> None:
+        self._sqlite_ddl("INSERT OR REPLACE INTO __entities__ VALUES(?, ?)", (entity_name, table_name))
 
     async def select(self,
                      table_name: str,
-                     conditions: dict[str, object] | None = None) -> list[dict]:
+                     conditions: dict[str, object] | None = None,
+                     order_by: str | Iterable[str] | None = None,
+                     limit: int | None = None,
+                     offset: int = 0,
+                     columns: Iterable[str] | None = None) -> list[dict]:
+        check_window(limit, offset)
+        with self._measure('select', table_name, conditions) as probe:
+            return probe.returned(await self._run_read(probe.wrap(self._sqlite_select), table_name,
+                                                       conditions, order_by, limit, offset, columns))
+
+    async def count(self,
+                    table_name: str,
+                    conditions: dict[str, object] | None = None) -> int:
+        sql, params = self._sqlite_make_query("SELECT COUNT(*)", table_name, conditions)
+        with self._measure('count', table_name, conditions) as probe:
+            return await self._run_read(probe.wrap(self._sqlite_scalar), sql, params)
+
+    async def exists(self,
+                     table_name: str,
+                     conditions: dict[str, object] | None = None) -> bool:
+        sql, params = self._sqlite_make_query("SELECT 1", table_name, conditions)
+        with self._measure('exists', table_name, conditions) as probe:
+            return bool(await self._run_read(probe.wrap(self._sqlite_scalar), f"SELECT EXISTS({sql})", params))
+
+    async def select_batches(self,
+                             table_name: str,
+                             conditions: dict[str, object] | None = None,
+                             batch_size: int | None = None,
+                             columns: Iterable[str] | None = None) -> AsyncIterator[list[dict]]:
         table: SQLiteTable = self.tables[table_name]
-        cur = self.connection.cursor()
-        sql = f"SELECT * FROM {table_name}" + self._sqlite_make_where(conditions)
-        cur.execute(sql)
+        columns = table.projection(columns)
+        kind = f"SELECT {','.join(columns)}" if columns is not None else "SELECT *"
+        # отдельное соединение: курсор живёт между страницами и может переходить между потоками
+        connection = await self._run_read(self._sqlite_connect, True)
+        try:
+            with self._measure('select_batches', table_name, conditions) as probe:
+                sql, params = self._sqlite_make_query(kind, table_name, conditions)
+                cur = await self._run_read(probe.wrap(self._sqlite_execute), connection, sql, params)
+                while values := await self._run_read(cur.fetchmany, batch_size or self.chunk_size):
+                    rows = []
+                    for row_values in probe.fetched(values):
+                        rows += table.process_db_row(row_values, "", columns=columns)
+                    yield probe.returned(rows)
+        finally:
+            connection.close()
 
-        result = []
-        for values in cur.fetchall():
-            result += table.process_db_row(values, "")
-        cur.close()
-        return result
+    async def select_many_by_key(self,
+                                 table_name: str,
+                                 keys: Iterable[object]) -> list[dict]:
+        table: SQLiteTable = self.tables[table_name]
+        if table.key is None:
+            raise ValueError(f"Table {table_name} has no key!")
+        with self._measure('select_many_by_key', table_name) as probe:
+            return probe.returned(await self._run_read(probe.wrap(self._sqlite_select_many_by_key),
+                                                       table_name, list(keys)))
 
     async def insert(self,
                      table_name: str,
                      row_data: dict[str, object]) -> None:
-        table: SQLiteTable = self.tables[table_name]
-        cur = self.connection.cursor()
-        key, value = table.make_db_row(table_name, row_data)
-        cur.execute(key, value)
-        self.connection.commit()
-        cur.close()
+        with self._measure('insert', table_name) as probe:
+            await self._run_write(probe.wrap(self._sqlite_write_batch), [('insert', table_name, [row_data])])
 
     async def delete(self,
                      table_name: str,
                      row_data: dict[str, object]) -> None:
-        cur = self.connection.cursor()
-        sql = f"DELETE FROM {table_name}" + self._sqlite_make_where(row_data)
-        cur.execute(sql)
-        self.connection.commit()
+        with self._measure('delete', table_name) as probe:
+            await self._run_write(probe.wrap(self._sqlite_write_batch), [('delete', table_name, [row_data])])
+
+    async def insert_many(self,
+                          table_name: str,
+                          rows: Iterable[dict[str, object]],
+                          chunk_size: int | None = None) -> None:
+        with self._measure('insert_many', table_name) as probe:
+            for chunk in chunked(rows, chunk_size or self.chunk_size):
+                await self._run_write(probe.wrap(self._sqlite_write_batch), [('insert', table_name, chunk)])
+
+    # Массовая загрузка по своему профилю: на время загрузки журнал и синхронизация диска
+    # выключены, а индексы пустой таблицы строятся один раз в конце, а не по строке.
+    # Сбой посреди загрузки может оставить таблицу загруженной частично
+    async def bulk_load(self,
+                        table_name: str,
+                        rows: Iterable[dict[str, object]],
+                        chunk_size: int | None = None) -> int:
+        table: SQLiteTable = self.tables[table_name]
+        loaded = 0
+        with self._measure('bulk_load', table_name) as probe:
+            deferred = await self._run_write(self._sqlite_begin_bulk, table_name)
+            try:
+                for chunk in chunked(rows, chunk_size or BULK_CHUNK_SIZE):
+                    # строки по возрастанию ключа дописываются в конец B-дерева
+                    if table.key is not None:
+                        chunk.sort(key=lambda row_data: (row_data.get(table.key) is not None,
+                                                         table.coerce(table.key, row_data.get(table.key))))
+                    await self._run_write(probe.wrap(self._sqlite_write_batch), [('insert', table_name, chunk)])
+                    loaded += len(chunk)
+            finally:
+                await self._run_write(self._sqlite_end_bulk, table_name, deferred)
+        return loaded
+
+    async def delete_many(self,
+                          table_name: str,
+                          rows: Iterable[dict[str, object]],
+                          chunk_size: int | None = None) -> None:
+        with self._measure('delete_many', table_name) as probe:
+            for chunk in chunked(rows, chunk_size or self.chunk_size):
+                await self._run_write(probe.wrap(self._sqlite_write_batch), [('delete', table_name, chunk)])
+
+    async def write_batch(self, operations: list[tuple[str, str, list[dict[str, object]]]]) -> None:
+        with self._measure('write_batch', None) as probe:
+            await self._run_write(probe.wrap(self._sqlite_write_batch), operations)
+
+    def close(self) -> None:
+        # статистика для планировщика по таблицам, которым она нужна, на следующий запуск
+        self._sqlite_ddl("PRAGMA optimize")
+        super().close()
+        for connection in self._reader_connections:
+            connection.close()
+        self.connection.close()
+
+    def _sqlite_connect(self, readonly: bool = True) -> sqlite3.Connection:
+        if readonly:
+            database, uri = f"file:{os.path.abspath(self.path)}?mode=ro", True
+        else:
+            database, uri = self.path, False
+        connection = sqlite3.connect(database,
+                                     timeout=self.timeout,
+                                     check_same_thread=False,
+                                     cached_statements=self.cached_statements,
+                                     uri=uri,
+                                     autocommit=True)
+        pragmas = self.pragmas if readonly else self.writer_pragmas | self.pragmas
+        for pragma, value in pragmas.items():
+            connection.execute(f"PRAGMA {pragma}={value}")
+        return connection
+
+    def _sqlite_reader(self) -> sqlite3.Connection:
+        connection = getattr(self._readers, "connection", None)
+        if connection is None:
+            connection = self._readers.connection = self._sqlite_connect(readonly=True)
+            with self._readers_lock:
+                self._reader_connections.append(connection)
+        return connection
+
+    def _sqlite_select(self,
+                       table_name: str,
+                       conditions: dict[str, object] | None = None,
+                       order_by: str | Iterable[str] | None = None,
+                       limit: int | None = None,
+                       offset: int = 0,
+                       columns: Iterable[str] | None = None) -> list[dict]:
+        table: SQLiteTable = self.tables[table_name]
+        columns = table.projection(columns)
+        kind = f"SELECT {','.join(columns)}" if columns is not None else "SELECT *"
+        sql, params = self._sqlite_make_query(kind, table_name, conditions, order_by, limit, offset)
+        cur = self._sqlite_execute(self._sqlite_reader(), sql, params)
+        values = cur.fetchall()
         cur.close()
+        if (probe := current_probe()) is not None:
+            probe.fetched(values)
+
+        result = []
+        for row_values in values:
+            result += table.process_db_row(row_values, "", columns=columns)
+        return result
+
+    def _sqlite_scalar(self, sql: str, params: list[object]) -> object:
+        (value,) = self._sqlite_execute(self._sqlite_reader(), sql, params).fetchone()
+        return value
+
+    # SQL запроса - план текущего замера: по нему в логе медленных запросов видно полный проход
+    def _sqlite_execute(self,
+                        connection: sqlite3.Connection,
+                        sql: str,
+                        params: list[object]) -> sqlite3.Cursor:
+        if (probe := current_probe()) is not None:
+            probe.plan = sql
+        return connection.execute(sql, params)
+
+    def _sqlite_select_many_by_key(self,
+                                   table_name: str,
+                                   keys: list[object]) -> list[dict]:
+        table: SQLiteTable = self.tables[table_name]
+        found = dict()
+        cur = self._sqlite_reader().cursor()
+        # SQLite ограничивает число параметров в одном выражении
+        keys = [table.coerce(table.key, key) for key in keys]
+        for chunk in chunked(keys, 500):
+            params = [table.bind(table.key, key) for key in chunk]
+            cur.execute(f"SELECT * FROM {table_name} WHERE {table.key} IN ({','.join(['?'] * len(params))})",
+                        params)
+            values = cur.fetchall()
+            if (probe := current_probe()) is not None:
+                probe.fetched(values)
+            for row_values in values:
+                data = table.process_db_row(row_values, "")[0]
+                found[data[table.key]] = data
+        cur.close()
+        return [found[key] for key in keys if key in found]
+
+    def _sqlite_create_sql(self,
+                           table_name: str,
+                           table: SQLiteTable) -> str:
+        definitions = [f"{column} {column_type}" for column, column_type in table.column_types()]
+        # ключ INTEGER становится самим rowid: поиск по нему идёт без отдельного индекса
+        if table.key is not None:
+            definitions.append(f"PRIMARY KEY({table.key})")
+        return f"CREATE TABLE {table_name}({', '.join(definitions)})"
+
+    # Переносит строки таблицы со старой раскладкой (нетипизированные колонки, другой набор
+    # колонок или ключ) в таблицу с типизированными колонками, одной транзакцией писателя
+    def _sqlite_rebuild_table(self,
+                              table_name: str,
+                              old_columns: list[str]) -> None:
+        table: SQLiteTable = self.tables[table_name]
+        legacy_name = f'"{table_name}:legacy"'
+        columns = [column for column in table.columns if column in old_columns]
+        annotations = [table.columns[column] for column in columns]
+        insert_sql = f"INSERT OR REPLACE INTO {table_name}({','.join(columns)}) VALUES({','.join(['?'] * len(columns))})"
+        cur = self.connection.cursor()
+        cur.execute("BEGIN")
+        try:
+            cur.execute(f"ALTER TABLE {table_name} RENAME TO {legacy_name}")
+            cur.execute(self._sqlite_create_sql(table_name, table))
+            source = self.connection.execute(f"SELECT {','.join(columns)} FROM {legacy_name}")
+            while values := source.fetchmany(self.chunk_size):
+                cur.executemany(insert_sql, [[table.bind(column, legacy_value(value, annotation))
+                                              for column, annotation, value in zip(columns, annotations, row_values)]
+                                             for row_values in values])
+            source.close()
+            # индексы старой таблицы удаляются вместе с ней
+            cur.execute(f"DROP TABLE {legacy_name}")
+        except BaseException:
+            cur.execute("ROLLBACK")
+            raise
+        finally:
+            cur.close()
+        self.connection.execute("COMMIT")
+
+    # Создаёт объявленные индексы и удаляет свои индексы, которых больше нет в объявлении.
+    # Статистика по новым индексам собирается сразу, иначе планировщик может их не выбрать
+    def _sqlite_sync_indexes(self, table_name: str) -> None:
+        table: SQLiteTable = self.tables[table_name]
+        existing = {index_name for (index_name,) in
+                    self._sqlite_ddl("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ?",
+                                     (table_name,))}
+        declared = {table.index_name(table_name, columns): columns for columns in table.index_columns}
+        for index_name in existing:
+            if index_name.startswith(f"{table_name}:") and f'"{index_name}"' not in declared:
+                self._sqlite_ddl(f'DROP INDEX "{index_name}"')
+        created = False
+        for index_name, columns in declared.items():
+            if index_name.strip('"') not in existing:
+                self._sqlite_ddl(self._sqlite_index_sql(table_name, columns))
+                created = True
+        if created:
+            self._sqlite_ddl(f"ANALYZE {table_name}")
+
+    def _sqlite_index_sql(self,
+                          table_name: str,
+                          columns: tuple[str, ...]) -> str:
+        index_name = self.tables[table_name].index_name(table_name, columns)
+        return f"CREATE INDEX IF NOT EXISTS {index_name} ON {table_name}({','.join(columns)})"
+
+    # Профиль массовой загрузки; отдаёт, отложено ли построение индексов. Индексы снимаются
+    # только с пустой таблицы: у заполненной их перестройка дороже обновления по строкам
+    def _sqlite_begin_bulk(self, table_name: str) -> bool:
+        table: SQLiteTable = self.tables[table_name]
+        self.connection.execute("PRAGMA synchronous=off")
+        # из WAL не выйти, пока базу держат другие соединения (читатели этого же движка):
+        # тогда загрузка идёт с журналом, и читатели не ждут её окончания
+        self.connection.execute("PRAGMA busy_timeout=0")
+        try:
+            self.connection.execute("PRAGMA journal_mode=off")
+        except sqlite3.OperationalError:
+            pass
+        finally:
+            self.connection.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+        deferred = (bool(table.index_columns)
+                    and self.connection.execute(f"SELECT 1 FROM {table_name} LIMIT 1").fetchone() is None)
+        if deferred:
+            for columns in table.index_columns:
+                self.connection.execute(f"DROP INDEX IF EXISTS {table.index_name(table_name, columns)}")
+        return deferred
+
+    def _sqlite_end_bulk(self,
+                         table_name: str,
+                         deferred: bool) -> None:
+        if deferred:
+            for columns in self.tables[table_name].index_columns:
+                self.connection.execute(self._sqlite_index_sql(table_name, columns))
+            self.connection.execute(f"ANALYZE {table_name}")
+            self.written_rows[table_name] = 0
+        for pragma in ('journal_mode', 'synchronous'):
+            self.connection.execute(f"PRAGMA {pragma}={self.writer_pragmas[pragma]}")
+
+    # Служебные выражения на соединении-писателе, синхронно; отдаёт строки результата
+    def _sqlite_ddl(self, sql: str, params: tuple = ()) -> list[tuple]:
+        return self.write_executor.submit(lambda: self.connection.execute(sql, params).fetchall()).result()
+
+    # Все операции пачки - в одной транзакции писателя,
+    # подряд идущие одинаковые выражения уходят одним executemany
+    def _sqlite_write_batch(self, operations: list[tuple[str, str, list[dict[str, object]]]]) -> None:
+        cur = self.connection.cursor()
+        cur.execute("BEGIN")
+        try:
+            for operation, table_name, rows in operations:
+                table: SQLiteTable = self.tables[table_name]
+                if operation == 'insert' and table.autoincrement:
+                    self._sqlite_assign_keys(cur, table_name, rows)
+
+                statements: list[tuple[str, list[list[str]]]] = []
+                for row_data in rows:
+                    if operation == 'insert':
+                        sql, params = table.make_db_row(row_data)
+                    else:
+                        sql, params = self._sqlite_make_query("DELETE", table_name, row_data)
+                    if statements and statements[-1][0] == sql:
+                        statements[-1][1].append(params)
+                    else:
+                        statements.append((sql, [params]))
+                for sql, values in statements:
+                    cur.executemany(sql, values)
+                if (probe := current_probe()) is not None:
+                    probe.rows_written += len(rows)
+                    probe.bytes_written += sum(len(value) for _, values in statements for params in values
+                                               for value in params if isinstance(value, (str, bytes)))
+        except BaseException:
+            cur.execute("ROLLBACK")
+            raise
+        finally:
+            cur.close()
+        self.connection.execute("COMMIT")
+        self._sqlite_analyze(operations)
+
+    # После analyze_rows записанных строк статистика индексов таблицы обновляется: с ней
+    # планировщик выбирает между индексами и полным проходом по актуальным размерам
+    def _sqlite_analyze(self, operations: list[tuple[str, str, list[dict[str, object]]]]) -> None:
+        for _, table_name, rows in operations:
+            if not self.tables[table_name].index_columns:
+                continue
+            written = self.written_rows.get(table_name, 0) + len(rows)
+            if written >= self.analyze_rows:
+                self.connection.execute(f"ANALYZE {table_name}")
+                written = 0
+            self.written_rows[table_name] = written
+
+    def _sqlite_assign_keys(self,
+                            cur: sqlite3.Cursor,
+                            table_name: str,
+                            rows: list[dict[str, object]]) -> None:
+        table: SQLiteTable = self.tables[table_name]
+        pending = [row_data for row_data in rows if row_data.get(table.key) is None]
+        if not pending:
+            return
+
+        (last_key,) = cur.execute(f"SELECT MAX({table.key}) FROM {table_name}").fetchone()
+        next_key = last_key + 1 if last_key is not None else 1
+        # ключи, заданные явно в этой же пачке, тоже заняты
+        for row_data in rows:
+            if row_data.get(table.key) is not None:
+                next_key = max(next_key, table.coerce(table.key, row_data[table.key]) + 1)
+        for row_data in pending:
+            row_data[table.key] = next_key
+            next_key += 1
+
+    def _sqlite_make_query(self,
+                           kind: str,
+                           table_name: str,
+                           conditions: dict[str, object] | None = None,
+                           order_by: str | Iterable[str] | None = None,
+                           limit: int | None = None,
+                           offset: int = 0) -> tuple[str, list[object]]:
+        table: SQLiteTable = self.tables[table_name]
+        filters, order = table.filters(conditions), table.order(order_by)
+        shape, params = [], []
+        for column, operator, operand in filters:
+            # "= NULL" в SQL не совпадает ни с чем, поэтому NULL в условии - отдельная форма
+            # запроса через IS NULL, как и в LMDB, где None равен None
+            if operator == 'eq' and operand is None:
+                operator = 'null'
+            elif operator == 'in' and None in operand:
+                operator, operand = 'in_null', [value for value in operand if value is not None]
+            values = self._sqlite_operands(table, column, operator, operand)
+            shape.append((column, operator, len(values)))
+            params += values
+        window = limit is not None or offset > 0
+        if window:
+            params += [limit if limit is not None else -1, offset]
+        return self._sqlite_statement(kind, table_name, tuple(shape), tuple(order), window), params
+
+    # Значения условия в порядке плейсхолдеров
+    def _sqlite_operands(self,
+                         table: SQLiteTable,
+                         column: str,
+                         operator: str,
+                         operand: object) -> list[object]:
+        if operator == 'null':
+            return []
+        if operator == 'prefix':
+            successor = prefix_successor(operand)
+            return [operand] + ([successor] if successor is not None else [])
+        values = list(operand) if operator in ('in', 'in_null', 'between') else [operand]
+        return [table.bind(column, value) for value in values]
+
+    def _sqlite_statement(self,
+                          kind: str,
+                          table_name: str,
+                          shape: tuple[tuple[str, str, int], ...],
+                          order: tuple[tuple[str, bool], ...] = (),
+                          window: bool = False) -> str:
+        statement_key = (kind, table_name, shape, order, window)
+        with self._statements_lock:
+            sql = self.statements.get(statement_key)
+            if sql is not None:
+                self.statements.move_to_end(statement_key)
+                return sql
+        clauses = []
+        for column, operator, arity in shape:
+            if operator == 'eq':
+                clauses.append(f"{column} = ?")
+            elif operator == 'null':
+                clauses.append(f"{column} IS NULL")
+            elif operator == 'in':
+                clauses.append(f"{column} IN ({','.join(['?'] * arity)})")
+            elif operator == 'in_null':
+                clauses.append(f"({column} IN ({','.join(['?'] * arity)}) OR {column} IS NULL)")
+            elif operator == 'prefix':
+                # диапазон вместо LIKE: регистрозависим и может идти по индексу
+                clauses.append(f"{column} >= ?" + (f" AND {column} < ?" if arity == 2 else ""))
+            elif operator == 'between':
+                clauses.append(f"{column} BETWEEN ? AND ?")
+            else:
+                clauses.append(f"{column} {COMPARISONS[operator]} ?")
+        sql = f"{kind} FROM {table_name}"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        if order:
+            sql += " ORDER BY " + ", ".join(column + (" DESC" if descending else "") for column, descending in order)
+        if window:
+            sql += " LIMIT ? OFFSET ?"
+        with self._statements_lock:
+            self.statements[statement_key] = sql
+            while len(self.statements) > self.cached_statements:
+                self.statements.popitem(last=False)
+        return sql
 
-    def _sqlite_make_where(self, conditions: dict[str, object] | None = None) -> str:
-        if conditions is not None:
-            where_statements = []
-            for key in conditions:
-                where_statements.append(f"{key} = '{str(conditions[key])}'")
-            return " WHERE " + " AND ".join(where_statements)
-        return ""
+    def _sqlite_forget_statements(self, table_name: str) -> None:
+        with self._statements_lock:
+            self.statements = OrderedDict((statement_key, sql) for statement_key, sql in self.statements.items()
+                                          if statement_key[1] != table_name)
@@ -0,0 +1,192 @@
+import asyncio
+from collections.abc import AsyncIterator, Iterable
+
+from .base_engine import BaseEngine
+from .memory_engine import MemoryEngine
+from .metrics import Metrics
+
+
+# Горячий уровень перед долговечным движком: выбранные таблицы целиком держатся в MemoryEngine
+# и читаются из памяти, без транзакций и раскодирования. Записи идут сначала в долговечный
+# движок, а после его успеха - в память. Горячая таблица загружается из долговечного движка
+# при первом обращении к ней; остальные таблицы и снимки обслуживает долговечный движок
+class TieredEngine(BaseEngine):
+    durable: BaseEngine
+    memory: MemoryEngine
+    hot_tables: set[str]
+    loaded: set[str]
+    # ввод-вывод ведут движки уровней
+    threaded_io = False
+
+    def __init__(self,
+                 durable: BaseEngine,
+                 hot_tables: Iterable[str]) -> None:
+        self.durable = durable
+        self.memory = MemoryEngine(durable.path, durable.chunk_size, durable.threads_count)
+        # BaseEngine выключает замеры, а они уже могли быть подключены к долговечному движку
+        metrics = durable.metrics
+        super().__init__(durable.path, durable.chunk_size, durable.threads_count)
+        self.metrics = metrics
+        # таблицы общие с долговечным движком: по ним Database решает, открыта ли таблица
+        self.tables = durable.tables
+        self.hot_tables = set(hot_tables)
+        self.loaded = set()
+        self.load_lock = asyncio.Lock()
+
+    # замеры ведут сами движки уровней
+    @property
+    def metrics(self) -> Metrics | None:
+        return self.durable.metrics
+
+    @metrics.setter
+    def metrics(self, metrics: Metrics | None) -> None:
+        self.durable.metrics = metrics
+        self.memory.metrics = metrics
+
+    def create_table(self,
+                     name: str,
+                     columns: dict[str, object],
+                     key: str | None = None,
+                     indexes: list[str | tuple[str, ...]] | None = None,
+                     autoincrement: bool = False) -> None:
+        self.durable.create_table(name, columns, key, indexes, autoincrement)
+        if name in self.hot_tables:
+            self.memory.create_table(name, columns, key, indexes, autoincrement)
+
+    def rename_table(self,
+                     old_name: str,
+                     new_name: str) -> None:
+        self.durable.rename_table(old_name, new_name)
+        if old_name in self.hot_tables:
+            self.memory.rename_table(old_name, new_name)
+            self.hot_tables.add(new_name)
+            if old_name in self.loaded:
+                self.loaded.add(new_name)
+        self.hot_tables.discard(old_name)
+        self.loaded.discard(old_name)
+
+    def delete_table(self, name: str) -> None:
+        self.durable.delete_table(name)
+        if name in self.hot_tables:
+            self.memory.delete_table(name)
+            self.hot_tables.discard(name)
+            self.loaded.discard(name)
+
+    def entity_names(self) -> dict[str, str]:
+        return self.durable.entity_names()
+
+    def save_entity_name(self,
+                         entity_name: str,
+                         table_name: str) -> None:
+        self.durable.save_entity_name(entity_name, table_name)
+
+    async def select(self,
+                     table_name: str,
+                     conditions: dict[str, object] | None = None,
+                     order_by: str | Iterable[str] | None = None,
+                     limit: int | None = None,
+                     offset: int = 0,
+                     columns: Iterable[str] | None = None) -> list[dict]:
+        return await (await self._tier(table_name)).select(table_name, conditions, order_by, limit, offset, columns)
+
+    async def count(self,
+                    table_name: str,
+                    conditions: dict[str, object] | None = None) -> int:
+        return await (await self._tier(table_name)).count(table_name, conditions)
+
+    async def exists(self,
+                     table_name: str,
+                     conditions: dict[str, object] | None = None) -> bool:
+        return await (await self._tier(table_name)).exists(table_name, conditions)
+
+    async def select_batches(self,
+                             table_name: str,
+                             conditions: dict[str, object] | None = None,
+                             batch_size: int | None = None,
+                             columns: Iterable[str] | None = None) -> AsyncIterator[list[dict]]:
+        engine = await self._tier(table_name)
+        async for rows in engine.select_batches(table_name, conditions, batch_size, columns):
+            yield rows
+
+    async def select_many_by_key(self,
+                                 table_name: str,
+                                 keys: Iterable[object]) -> list[dict]:
+        return await (await self._tier(table_name)).select_many_by_key(table_name, keys)
+
+    async def insert(self,
+                     table_name: str,
+                     row_data: dict[str, object]) -> None:
+        hot = await self._tier(table_name) is self.memory
+        await self.durable.insert(table_name, row_data)
+        # ключ автоинкремента уже проставлен долговечным движком
+        if hot:
+            await self.memory.insert(table_name, row_data)
+
+    async def delete(self,
+                     table_name: str,
+                     row_data: dict[str, object]) -> None:
+        hot = await self._tier(table_name) is self.memory
+        await self.durable.delete(table_name, row_data)
+        if hot:
+            await self.memory.delete(table_name, row_data)
+
+    async def insert_many(self,
+                          table_name: str,
+                          rows: Iterable[dict[str, object]],
+                          chunk_size: int | None = None) -> None:
+        hot = await self._tier(table_name) is self.memory
+        rows = list(rows)
+        await self.durable.insert_many(table_name, rows, chunk_size)
+        if hot:
+            await self.memory.insert_many(table_name, rows, chunk_size)
+
+    async def delete_many(self,
+                          table_name: str,
+                          rows: Iterable[dict[str, object]],
+                          chunk_size: int | None = None) -> None:
+        hot = await self._tier(table_name) is self.memory
+        rows = list(rows)
+        await self.durable.delete_many(table_name, rows, chunk_size)
+        if hot:
+            await self.memory.delete_many(table_name, rows, chunk_size)
+
+    async def bulk_load(self,
+                        table_name: str,
+                        rows: Iterable[dict[str, object]],
+                        chunk_size: int | None = None) -> int:
+        # горячая таблица пишется в оба уровня обычными пачками
+        if await self._tier(table_name) is self.memory:
+            return await super().bulk_load(table_name, rows, chunk_size)
+        return await self.durable.bulk_load(table_name, rows, chunk_size)
+
+    async def write_batch(self, operations: list[tuple[str, str, list[dict[str, object]]]]) -> None:
+        hot = {table_name for _, table_name, _ in operations if await self._tier(table_name) is self.memory}
+        await self.durable.write_batch(operations)
+        hot_operations = [operation for operation in operations if operation[1] in hot]
+        if hot_operations:
+            await self.memory.write_batch(hot_operations)
+
+    def snapshot(self) -> object:
+        return self.durable.snapshot()
+
+    async def compact_backup(self, path: str) -> None:
+        await self.durable.compact_backup(path)
+
+    def close(self) -> None:
+        self.memory.close()
+        self.durable.close()
+        super().close()
+
+    # Движок, который обслуживает таблицу; горячая таблица сначала загружается в память.
+    # Запись в горячую таблицу тоже ждёт загрузки, иначе загрузка может затереть её в памяти
+    async def _tier(self, table_name: str) -> BaseEngine:
+        if table_name in self.loaded:
+            return self.memory
+        if table_name not in self.hot_tables:
+            return self.durable
+        async with self.load_lock:
+            if table_name not in self.loaded:
+                async for rows in self.durable.select_batches(table_name):
+                    await self.memory.insert_many(table_name, rows)
+                self.loaded.add(table_name)
+        return self.memory
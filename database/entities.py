@@ -1,10 +1,15 @@
 from abc import ABC
+from collections.abc import Callable
 from re import sub
+from typing import ClassVar, get_origin
 
-import inflect
+from .engines.codecs import coerce, column_type
 
 
-p = inflect.engine()
+# inflect импортируется долго, поэтому только когда имя таблицы действительно надо вывести
+_inflect_engine = None
+# имена таблиц из каталогов открытых баз: имя класса -> имя таблицы
+known_table_names: dict[str, str] = dict()
 
 
 # https://gist.github.com/dubpirate/fdea9a67500a46613ad637269320d272
@@ -19,30 +24,155 @@ def to_table_name(s: str) -> str:
     snaked = to_snake(s)
     if '_to_' in snaked:
         return snaked
-    return p.plural(snaked)
+    return pluralize(snaked)
+
+
+def pluralize(word: str) -> str:
+    global _inflect_engine
+    if _inflect_engine is None:
+        import inflect
+        _inflect_engine = inflect.engine()
+    return _inflect_engine.plural(word)
+
+
+def collect_properties(cls: type) -> dict[str, object]:
+    properties = dict()
+    for klass in reversed(cls.__mro__):
+        if not issubclass(klass, BaseEntity) or klass is BaseEntity:
+            continue
+        for name, annotation in vars(klass).get('__annotations__', {}).items():
+            # служебные __атрибуты__ и ClassVar колонками не считаются
+            if name.startswith('__') or get_origin(annotation) is ClassVar or annotation is ClassVar:
+                continue
+            properties[name] = annotation
+    return properties
+
+
+# Генерирует функции загрузки/выгрузки под конкретный класс, как это делает dataclasses:
+# без цикла по колонкам, getattr/setattr и поиска типов на каждую строку
+def compile_codecs(cls: type) -> tuple[Callable, Callable, Callable]:
+    namespace = {'new': object.__new__, 'cls': cls, 'convert': coerce}
+    from_row = ['def from_row(row):', '    self = new(cls)']
+    from_tuple = ['def from_tuple(values):', '    self = new(cls)']
+    for position, (name, annotation) in enumerate(cls.__properties__.items()):
+        python_type = column_type(annotation)
+        if isinstance(python_type, type):
+            namespace[f'type_{name}'] = python_type
+            namespace[f'annotation_{name}'] = annotation
+            value = (f'value if value is None or value.__class__ is type_{name} '
+                     f'else convert(value, annotation_{name})')
+        else:
+            value = 'value'
+        from_row += [f'    if {name!r} in row:',
+                     f'        value = row[{name!r}]',
+                     f'        self.{name} = {value}']
+        from_tuple += [f'    value = values[{position}]',
+                       f'    self.{name} = {value}']
+    from_row.append('    return self')
+    from_tuple.append('    return self')
+    to_row = ['def to_row(self):',
+              '    return {' + ', '.join(f'{name!r}: self.{name}' for name in cls.__properties__) + '}']
+
+    exec('\n'.join(from_row + from_tuple + to_row), namespace)
+    return namespace['from_row'], namespace['from_tuple'], namespace['to_row']
+
+
+# Колонка ленивой сущности: значение читается из снимка при первом обращении
+class LazyColumn:
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __get__(self, instance: object, owner: type | None = None) -> object:
+        if instance is None:
+            return self
+        values = instance._lazy_values
+        if self.name not in values:
+            values[self.name] = instance._lazy_load(self.name)
+        return values[self.name]
+
+    def __set__(self, instance: object, value: object) -> None:
+        instance._lazy_values[self.name] = value
+
+
+# Наследник сущности, у которого колонки - LazyColumn; isinstance и методы сущности сохраняются
+def compile_lazy(cls: type) -> type:
+    namespace = {name: LazyColumn(name) for name in cls.__properties__}
+    namespace['__slots__'] = ('_lazy_values', '_lazy_load')
+    namespace['__lazy__'] = True
+    namespace['__qualname__'] = cls.__qualname__
+    return type(cls)(cls.__name__, (cls,), namespace, lazy=True)
+
+
+# Имя таблицы сущности выводится при первом обращении, а не при объявлении класса:
+# сначала берётся из каталога базы, и только для новых сущностей - через inflect
+class TableName:
+    def __get__(self, instance: object, owner: type) -> str:
+        table_name = owner.__dict__.get('_table_name')
+        if table_name is None:
+            table_name = known_table_names.get(owner.__name__) or to_table_name(owner.__name__)
+            owner._table_name = table_name
+        return table_name
 
 
 class BaseEntity(ABC):
-    __tablename__: str
+    # метаданные считаются один раз при объявлении класса-наследника
+    __tablename__ = TableName()
     __properties__: dict[str, object]
+    __columns__: tuple[str, ...]
+    # вторичные индексы: колонки или кортежи колонок составных индексов
+    __indexes__: tuple[str | tuple[str, ...], ...] = ()
+    # первичный ключ: выборка и удаление по нему идут напрямую, без прохода по таблице;
+    # с автоинкрементом ключ, оставленный None, выдаёт движок при записи
+    __key__: str | None = None
+    __autoincrement__: bool = False
+    # пустые слоты: наследник со своими __slots__ обходится без __dict__
+    __slots__ = ()
 
+    # ленивый наследник живёт на метаданных своей сущности
+    __lazy__: bool = False
+
+    def __init_subclass__(cls, lazy: bool = False, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+        if lazy:
+            return
+        cls.__properties__ = collect_properties(cls)
+        cls.__columns__ = tuple(cls.__properties__)
+        if cls.__key__ is not None and cls.__key__ not in cls.__properties__:
+            raise ValueError(f"Key {cls.__key__} not presented in {cls.__name__} annotations!")
+        from_row, from_tuple, to_row = compile_codecs(cls)
+        cls._from_row = staticmethod(from_row)
+        cls._from_tuple = staticmethod(from_tuple)
+        cls._serialize = to_row
+
+    @classmethod
+    def _from_lazy(cls, data: dict[str, object], load: Callable[[str], object]) -> 'BaseEntity':
+        lazy_cls = cls.__dict__.get('_lazy_cls')
+        if lazy_cls is None:
+            lazy_cls = cls._lazy_cls = compile_lazy(cls)
+        self = object.__new__(lazy_cls)
+        self._lazy_values = data
+        self._lazy_load = load
+        return self
+
+    # оставлен для совместимости: наследники вызывают его в конце конструктора
     def __init__(self) -> None:
-        self.__tablename__ = to_table_name(type(self).__name__)
-        self.__properties__ = self.__annotations__
+        pass
 
     def _get_props(self) -> list[str]:
-        return list(self.__properties__.keys())
+        return list(self.__columns__)
+
+    def _get_indexes(self) -> list[str | tuple[str, ...]]:
+        return list(self.__indexes__)
 
-    def _serialize(self) -> dict[str, str]:
+    def _serialize(self) -> dict[str, object]:
         result = dict()
         for property_name in self.__properties__:
-            property_value = getattr(self, property_name)
-            result[property_name] = str(property_value)
+            result[property_name] = getattr(self, property_name)
         return result
 
-    def _unserialize(self, data: dict[str, str]) -> object:
+    def _unserialize(self, data: dict[str, object]) -> object:
         for property_name in data:
             property_value = data[property_name]
             property_type = self.__properties__[property_name]
-            setattr(self, property_name, property_type(property_value))
+            setattr(self, property_name, coerce(property_value, property_type))
         return self
@@ -0,0 +1,63 @@
+from array import array
+from math import nan
+
+from .engines.codecs import coerce, column_kind, column_type
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Числовые колонки копятся в непрерывных array.array, остальные - в списках
+TYPECODES = {'int': 'q', 'float': 'd', 'bool': 'b'}
+NUMPY_DTYPES = {'q': 'int64', 'd': 'float64', 'b': 'bool'}
+
+
+class ColumnBuffer:
+    def __init__(self, annotation: object) -> None:
+        self.annotation = annotation
+        self.python_type = column_type(annotation)
+        self.typecode = TYPECODES.get(column_kind(annotation))
+        self.values = array(self.typecode) if self.typecode is not None else []
+
+    def extend(self, values: list[object]) -> None:
+        python_type, annotation = self.python_type, self.annotation
+        values = [value if value is None or value.__class__ is python_type else coerce(value, annotation)
+                  for value in values]
+        if self.typecode is None:
+            self.values += values
+            return
+        if None in values:
+            # NULL в числовой колонке - NaN, поэтому целые и bool переходят во float64, как в pandas
+            if self.typecode != 'd':
+                self.typecode, self.values = 'd', array('d', self.values)
+            values = [nan if value is None else value for value in values]
+        self.values.extend(values)
+
+    def result(self, as_numpy: bool) -> object:
+        if not as_numpy:
+            return self.values
+        if self.typecode is None:
+            column = numpy.empty(len(self.values), dtype=object)
+            column[:] = self.values
+            return column
+        if not self.values:
+            return numpy.empty(0, dtype=NUMPY_DTYPES[self.typecode])
+        # без копирования: массив NumPy смотрит в буфер array.array
+        return numpy.frombuffer(self.values, dtype=NUMPY_DTYPES[self.typecode])
+
+
+class FrameBuilder:
+    def __init__(self, columns: dict[str, object], as_numpy: bool | None = None) -> None:
+        if as_numpy and numpy is None:
+            raise ImportError("NumPy is not installed!")
+        self.as_numpy = numpy is not None if as_numpy is None else as_numpy
+        self.buffers = {column: ColumnBuffer(annotation) for column, annotation in columns.items()}
+
+    def extend(self, rows: list[dict[str, object]]) -> None:
+        for column, buffer in self.buffers.items():
+            buffer.extend([data.get(column) for data in rows])
+
+    def result(self) -> dict[str, object]:
+        return {column: buffer.result(self.as_numpy) for column, buffer in self.buffers.items()}
@@ -0,0 +1,120 @@
+from base64 import b64decode, b64encode
+from collections.abc import Callable, Iterable, Iterator
+import csv
+import json
+import os
+from typing import TextIO
+
+from .engines.codecs import coerce, column_kind
+
+
+# Форматы файлов выгрузки и загрузки: JSON Lines (строка файла - объект) и CSV с заголовком
+FORMATS = {'.jsonl': 'jsonl', '.ndjson': 'jsonl', '.csv': 'csv'}
+# bool в CSV пишется как True/False, принимаются и другие привычные написания
+TRUE_VALUES = {'true', '1', 'yes'}
+
+
+def file_format(target: str | os.PathLike | TextIO, format: str | None) -> str:
+    if format is None:
+        if not isinstance(target, (str, os.PathLike)):
+            raise ValueError('"format" is required for file objects!')
+        format = FORMATS.get(os.path.splitext(target)[1].lower())
+        if format is None:
+            raise ValueError(f'Unknown file format of {target}, pass "format" explicitly!')
+    if format not in FORMATS.values():
+        raise ValueError(f"Unknown format '{format}' passed!")
+    return format
+
+
+# Значение колонки в текст файла и обратно: bytes - base64, object - JSON (в CSV - его текстом).
+# NULL в JSON Lines - null, в CSV - пустое поле: пустая строка из CSV тоже читается как NULL,
+# точную копию таблицы даёт только JSON Lines
+def dumper(annotation: object, format: str) -> Callable[[object], object] | None:
+    kind = column_kind(annotation)
+    if kind == 'bytes':
+        return lambda value: b64encode(value).decode()
+    if kind == 'object' and format == 'csv':
+        return json.dumps
+    return None
+
+
+def loader(annotation: object, format: str) -> Callable[[object], object]:
+    kind = column_kind(annotation)
+    if kind == 'bytes':
+        return lambda value: b64decode(value)
+    if kind == 'object':
+        return json.loads if format == 'csv' else lambda value: value
+    if kind == 'bool' and format == 'csv':
+        return lambda value: value.lower() in TRUE_VALUES
+    return lambda value: coerce(value, annotation)
+
+
+# Строки таблицы из файла по одной: в памяти только текущая строка файла.
+# Колонки, которых нет в файле, - NULL; лишние колонки файла - ошибка
+def read_rows(source: str | os.PathLike | TextIO,
+              columns: dict[str, object],
+              format: str | None = None) -> Iterator[dict[str, object]]:
+    format = file_format(source, format)
+    loaders = {column: loader(annotation, format) for column, annotation in columns.items()}
+    file = open(source, newline='', encoding='utf-8') if isinstance(source, (str, os.PathLike)) else source
+    try:
+        if format == 'csv':
+            records = csv.DictReader(file)
+            for column in records.fieldnames or []:
+                if column not in columns:
+                    raise KeyError(f"Key {column} not presented in column list!")
+        else:
+            records = (json.loads(line) for line in file if line.strip())
+        for record in records:
+            if format == 'jsonl' and not record.keys() <= loaders.keys():
+                column = next(column for column in record if column not in loaders)
+                raise KeyError(f"Key {column} not presented in column list!")
+            row_data = dict()
+            for column, load in loaders.items():
+                value = record.get(column)
+                row_data[column] = None if value is None or value == '' and format == 'csv' else load(value)
+            yield row_data
+    finally:
+        if file is not source:
+            file.close()
+
+
+class RowWriter:
+    def __init__(self,
+                 sink: str | os.PathLike | TextIO,
+                 columns: dict[str, object],
+                 format: str | None = None) -> None:
+        self.format = file_format(sink, format)
+        self.columns = list(columns)
+        # (позиция, преобразование) только для колонок, которым оно нужно
+        self.dumpers = [(position, dump) for position, annotation in enumerate(columns.values())
+                        if (dump := dumper(annotation, self.format)) is not None]
+        self.file = open(sink, 'w', newline='', encoding='utf-8') if isinstance(sink, (str, os.PathLike)) else sink
+        self.owns_file = self.file is not sink
+        self.rows_written = 0
+        if self.format == 'csv':
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(self.columns)
+
+    def write(self, rows: Iterable[dict[str, object]]) -> None:
+        columns, dumpers = self.columns, self.dumpers
+        records = []
+        for data in rows:
+            record = [data.get(column) for column in columns]
+            for position, dump in dumpers:
+                if record[position] is not None:
+                    record[position] = dump(record[position])
+            records.append(record)
+        if self.format == 'csv':
+            self.writer.writerows(records)
+        else:
+            # пачка строк уходит в файл одной записью
+            self.file.write(''.join(json.dumps(dict(zip(columns, record)), ensure_ascii=False) + '\n'
+                                    for record in records))
+        self.rows_written += len(records)
+
+    def close(self) -> None:
+        if self.owns_file:
+            self.file.close()
+        else:
+            self.file.flush()
@@ -7,6 +7,7 @@ from database import BaseEntity, Database
 
 
 class User(BaseEntity):
+    __indexes__ = ("name",)  # вторичные индексы: выборка по name без полного прохода, без аннотации!
     name: str  # колонки должны начинаться с буквы и должны быть указаны в аннотациях
     dick_size: int = 666
 
@@ -21,16 +22,17 @@ class User(BaseEntity):
 
 @dataclass
 class PhotoRequest(BaseEntity):
-    photo_id: int  # TODO: автоинкремент ключа
+    __key__ = "photo_id"  # первичный ключ: pull/drop по нему без прохода по таблице
+    __autoincrement__ = True  # ключ None при записи выдаёт БД
     path: str
+    photo_id: int | None = None
 
     def __post_init__(self) -> None:
         super().__init__()  # если используется dataclass, то обязательно прописать это в конце __post_init__
 
 
-# инициализация Database обязательно после появления в globals всех entities!
-# то бишь либо сначала импортишь их
-# либо если в одном файле, то после объявления
+# таблицы открываются при первом обращении к сущности, поэтому Database можно создавать
+# и до объявления entities; имена таблиц запоминаются в самой базе
 db = Database("/tmp/wabada")
 
 users = [User("Bob")] + [User("r" * int(uniform(1, 15))) for i in range(3)]
@@ -38,7 +40,7 @@ new_users = []
 bob = []
 print(f"Table: {users[0].__tablename__}, columns: {users[0].__properties__}")
 
-photo_requests = [PhotoRequest(int(uniform(1, 15)), "r" * int(uniform(1, 15))) for i in range(4)]
+photo_requests = [PhotoRequest("r" * int(uniform(1, 15))) for i in range(4)]
 new_requests = []
 print(f"Table: {photo_requests[0].__tablename__}, columns: {photo_requests[0].__properties__}")
 
@@ -58,8 +60,10 @@ async def get_from_db():
     bob = await db.pull(User, name="Bob")  # выставляем хрюсловие
     low_penis = await db.pull(User, dick_size=1)
 
-    new_requests = await db.pull(PhotoRequest)
-    return new_users, bob, new_requests, low_penis
+    new_requests = await db.pull_many_by_key(PhotoRequest, [request.photo_id for request in photo_requests])
+    # диапазоны, порядок и limit считаются в движке: проход обрывается на двух последних ключах
+    last_requests = await db.pull(PhotoRequest, photo_id__ge=2, order_by="-photo_id", limit=2)
+    return new_users, bob, new_requests + last_requests, low_penis
 
 
 async def main():
@@ -0,0 +1,10 @@
+import pytest
+
+
+# движки, которые работают в одном процессе; шардированный проверяется отдельно
+ENGINES = ['lmdb', 'sqlite', 'memory']
+
+
+@pytest.fixture(params=ENGINES)
+def engine(request) -> str:
+    return request.param
@@ -0,0 +1,103 @@
+import asyncio
+from dataclasses import dataclass
+
+from database import BaseEntity, Database
+from database.cache import EntityCache
+
+
+@dataclass
+class Account(BaseEntity):
+    __key__ = 'id'
+    id: int
+    owner: str
+    balance: int
+
+    def __post_init__(self) -> None:
+        super().__init__()
+
+
+def test_invalidation(tmp_path, engine):
+    async def main():
+        db = Database(str(tmp_path / 'db'), engine=engine)
+        try:
+            cache = db.enable_cache(Account)
+            await db.push_many([Account(i, f"o{i % 2}", i * 10) for i in range(6)])
+            assert [a.balance for a in await db.pull(Account, id=3)] == [30]
+            assert len(await db.pull(Account, owner='o1')) == 3
+            # повторные чтения приходят из кэша
+            hits = cache.hits
+            assert [a.balance for a in await db.pull(Account, id=3)] == [30]
+            assert len(await db.pull(Account, owner='o1')) == 3
+            assert cache.hits == hits + 2
+
+            # запись заменяет строку по ключу и сбрасывает результаты по условиям
+            await db.push(Account(3, 'o0', 33))
+            assert [a.balance for a in await db.pull(Account, id=3)] == [33]
+            assert len(await db.pull(Account, owner='o1')) == 2
+            assert [a.owner for a in await db.pull_many_by_key(Account, [3, 1])] == ['o0', 'o1']
+
+            await db.drop(Account(1, 'o1', 10))
+            assert await db.pull(Account, id=1) == []
+            assert [a.id for a in await db.pull_many_by_key(Account, [3, 1])] == [3]
+            assert len(await db.pull(Account, owner='o1')) == 1
+
+            # bulk_load сбрасывает кэш целиком
+            await db.bulk_load(Account, [Account(5, 'o1', 55), Account(7, 'o1', 70)])
+            assert [a.balance for a in await db.pull(Account, id=5)] == [55]
+            assert sorted(a.id for a in await db.pull(Account, owner='o1')) == [5, 7]
+        finally:
+            await db.close()
+
+    asyncio.run(main())
+
+
+def test_invalidation_coerces_key(tmp_path, engine):
+    async def main():
+        db = Database(str(tmp_path / 'db'), engine=engine)
+        try:
+            db.enable_cache(Account)
+            await db.push_many([Account(3, 'o0', 30), Account(4, 'o0', 40)])
+            assert [a.balance for a in await db.pull(Account, id=3)] == [30]
+            assert [a.balance for a in await db.pull(Account, id='4')] == [40]
+            # ключ записи другого типа попадает в ту же запись кэша, что и чтение по 3
+            await db.push(Account('3', 'o1', 33))
+            assert [a.balance for a in await db.pull(Account, id=3)] == [33]
+            await db.drop(Account(4.0, 'o0', 40))
+            assert await db.pull(Account, id=4) == []
+        finally:
+            await db.close()
+
+    asyncio.run(main())
+
+
+def test_write_behind_invalidation(tmp_path):
+    async def main():
+        db = Database(str(tmp_path / 'db'), engine='memory', write_behind=True)
+        try:
+            db.enable_cache(Account)
+            await db.push(Account(1, 'o0', 10), durable=True)
+            assert [a.balance for a in await db.pull(Account, id=1)] == [10]
+            await db.push(Account(1, 'o0', 11))
+            await db.flush()
+            assert [a.balance for a in await db.pull(Account, id=1)] == [11]
+        finally:
+            await db.close()
+
+    asyncio.run(main())
+
+
+def test_eviction():
+    cache = EntityCache('id', max_entries=2)
+    for key in range(3):
+        cache.put(('key', key), {'id': key})
+    assert cache.get(('key', 0)) is None and len(cache) == 2 and cache.evictions == 1
+
+    # результат чтения, начатого до записи, не кэшируется
+    generation = cache.generation
+    cache.invalidate('insert', [{'id': 1}])
+    cache.put(('query', (), None, None, 0), [{'id': 1}], generation)
+    assert cache.get(('query', (), None, None, 0)) is None
+
+    cache = EntityCache('id', max_entries=10, max_bytes=1000)
+    cache.put(('key', 0), {'id': 0, 'data': 'x' * 2000})
+    assert len(cache) == 0
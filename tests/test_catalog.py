@@ -0,0 +1,84 @@
+import asyncio
+from dataclasses import dataclass
+from pathlib import Path
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from database import BaseEntity, Database
+
+
+@dataclass
+class Note(BaseEntity):
+    __key__ = 'id'
+    __indexes__ = ('topic',)
+    id: int
+    topic: str
+
+    def __post_init__(self) -> None:
+        super().__init__()
+
+
+def test_concurrent_open(tmp_path, engine):
+    async def main():
+        db = Database(str(tmp_path / 'db'), engine=engine)
+        create_table = db.engine.create_table
+        threads = []
+
+        def counted(*args) -> None:
+            threads.append(threading.current_thread())
+            create_table(*args)
+
+        db.engine.create_table = counted
+        try:
+            # первые обращения из нескольких задач открывают таблицу один раз
+            results = await asyncio.gather(db.push(Note(1, 'a')), db.count(Note), db.pull(Note, topic='a'),
+                                           db.exists(Note, id=1))
+            assert len(threads) == 1
+            assert results[0] is None and await db.count(Note) == 1
+            # DDL и построение индексов идут не в потоке событий
+            assert (threads[0] is threading.current_thread()) == (engine == 'memory')
+        finally:
+            await db.close()
+
+    asyncio.run(main())
+
+
+# Скрипт для отдельного процесса: только там видно, импортировался ли inflect
+SCRIPT = """
+import asyncio, sys
+from dataclasses import dataclass
+from database import BaseEntity, Database
+
+@dataclass
+class Person(BaseEntity):
+    name: str
+
+    def __post_init__(self) -> None:
+        super().__init__()
+
+async def main():
+    db = Database(sys.argv[1], engine=sys.argv[2])
+    assert not db.engine.tables
+    await db.push(Person(sys.argv[3]))
+    print(sorted(person.name for person in await db.pull(Person)), Person.__tablename__,
+          'inflect' in sys.modules, sorted(db.engine.tables))
+    await db.close()
+
+asyncio.run(main())
+"""
+
+
+@pytest.mark.parametrize('engine', ['lmdb', 'sqlite'])
+def test_names_persist_across_reopen(tmp_path, engine):
+    def run(name: str) -> str:
+        result = subprocess.run([sys.executable, '-c', SCRIPT, str(tmp_path / 'db'), engine, name],
+                                cwd=Path(__file__).parents[1], capture_output=True, text=True, check=True)
+        return result.stdout.strip()
+
+    # при первом запуске имя таблицы выводится через inflect и сохраняется в каталоге базы,
+    # дальше берётся оттуда; таблица открывается только при обращении к сущности
+    assert run('a') == "['a'] people True ['people']"
+    assert run('b') == "['a', 'b'] people False ['people']"
@@ -0,0 +1,111 @@
+import asyncio
+from pickle import dumps
+
+import pytest
+
+from database import BaseEntity, Database
+from database.engines.codecs import BinaryCodec, PickleCodec
+
+
+V1 = {'name': str, 'height': int, 'mass': float}
+V2 = {'name': str, 'height': float, 'alive': bool | None, 'photo': bytes | None}
+
+
+def test_binary_roundtrip_with_nulls():
+    codec = BinaryCodec(V2)
+    row = {'name': 'Luke', 'height': 1.72, 'alive': None, 'photo': b'\x00\xff'}
+    assert codec.decode(codec.encode(row)) == row
+    assert codec.decode(codec.encode(row), ('photo', 'alive')) == {'photo': b'\x00\xff', 'alive': None}
+    assert codec.extractor(('height', 'name'))(codec.encode(row)) == [1.72, 'Luke']
+
+
+def test_old_version_decodes_with_new_schema():
+    old = BinaryCodec(V1)
+    value = old.encode({'name': 'Leia', 'height': 150, 'mass': 49.0})
+    new = BinaryCodec(V2, old.history)
+    assert new.version == 1 and new.history[0] == old.history[0]
+    # колонка сменила тип - приводится; новой в старой строке нет, удалённая не отдаётся
+    assert new.decode(value) == {'name': 'Leia', 'height': 150.0}
+    assert isinstance(new.decode(value)['height'], float)
+    # та же раскладка снова получает свою прежнюю версию
+    assert BinaryCodec(V1, new.history).version == 0
+
+
+def test_legacy_pickle_rows():
+    codec = BinaryCodec(V1)
+    value = PickleCodec(V1).encode({'name': 'Han', 'height': '180', 'mass': 80.0})
+    assert codec.decode(value) == {'name': 'Han', 'height': 180, 'mass': 80.0}
+    assert codec.decode(dumps({'name': 'Chewie', 'height': 228}), ('height',)) == {'height': 228}
+
+
+def test_ints_out_of_int64():
+    codec = BinaryCodec(V1)
+    for height in (2**63, -2**63 - 1, 10**30):
+        value = codec.encode({'name': 'Yoda', 'height': height, 'mass': 13.0})
+        # строка уходит в pickle, но читается тем же кодеком
+        assert codec.decode(value) == {'name': 'Yoda', 'height': height, 'mass': 13.0}
+        assert codec.extractor(('height',))(value) == [height]
+    assert codec.encode({'name': 'Yoda', 'height': 2**63 - 1, 'mass': 13.0})[0] != dumps({})[0]
+
+
+# Две версии одной сущности: имя класса (а значит, и таблица) у них общее
+def entity_class(columns: dict[str, object], **defaults) -> type[BaseEntity]:
+    def __init__(self, **values) -> None:
+        for column, value in values.items():
+            setattr(self, column, value)
+        BaseEntity.__init__(self)
+
+    namespace = {'__annotations__': columns, '__key__': 'name', '__init__': __init__} | defaults
+    return type('Pilot', (BaseEntity,), namespace)
+
+
+def test_lmdb_reopen_with_changed_schema(tmp_path):
+    path = str(tmp_path / 'db')
+
+    async def main():
+        db = Database(path, engine='lmdb')
+        await db.push(entity_class(V1)(name='Wedge', height=170, mass=77.0))
+        await db.close()
+
+        db = Database(path, engine='lmdb')
+        # колонки, которых не было в старых строках, берут значение по умолчанию класса
+        pilot_cls = entity_class(V2, alive=True, photo=None)
+        await db.push(pilot_cls(name='Biggs', height=1.8, alive=False, photo=None))
+        pilots = {pilot.name: pilot for pilot in await db.pull(pilot_cls)}
+        await db.close()
+        assert (pilots['Wedge'].height, pilots['Wedge'].alive) == (170.0, True)
+        assert isinstance(pilots['Wedge'].height, float)
+        assert (pilots['Biggs'].height, pilots['Biggs'].alive) == (1.8, False)
+
+    asyncio.run(main())
+
+
+def test_lmdb_big_ints(tmp_path):
+    async def main():
+        db = Database(str(tmp_path / 'db'), engine='lmdb')
+        pilot_cls = entity_class(V1)
+        try:
+            await db.push_many([pilot_cls(name='Yoda', height=2**64, mass=13.0),
+                                pilot_cls(name='Rex', height=-2**70, mass=80.0),
+                                pilot_cls(name='Jyn', height=160, mass=50.0)])
+            assert {pilot.name: pilot.height for pilot in await db.pull(pilot_cls)} == {
+                'Yoda': 2**64, 'Rex': -2**70, 'Jyn': 160}
+            assert [pilot.name for pilot in await db.pull(pilot_cls, height__gt=2**63)] == ['Yoda']
+            assert await db.pull_columns(pilot_cls, 'height', name='Rex') == [-2**70]
+        finally:
+            await db.close()
+
+    asyncio.run(main())
+
+
+def test_int_key_out_of_range(tmp_path):
+    async def main():
+        db = Database(str(tmp_path / 'db'), engine='lmdb')
+        pilot_cls = entity_class({'name': int, 'height': int})
+        try:
+            with pytest.raises(ValueError):
+                await db.push(pilot_cls(name=2**63, height=1))
+        finally:
+            await db.close()
+
+    asyncio.run(main())
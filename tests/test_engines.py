@@ -0,0 +1,79 @@
+import asyncio
+from dataclasses import dataclass
+import threading
+
+import pytest
+
+from database import BaseEntity, Database, Metrics, MetricsRegistry
+
+
+@dataclass
+class Tag(BaseEntity):
+    __key__ = 'name'
+    name: str
+
+    def __post_init__(self) -> None:
+        super().__init__()
+
+
+@pytest.mark.parametrize('engine', ['lmdb', 'sqlite'])
+def test_reader_and_writer_threads(tmp_path, engine):
+    async def main():
+        db = Database(str(tmp_path / 'db'), engine=engine, threads_count=2)
+        try:
+            # записи из многих задач сразу проходят через единственный поток-писатель,
+            # чтения - через пул из threads_count потоков
+            await asyncio.gather(*(db.push(Tag(f"t{i}")) for i in range(50)))
+            pulled = await asyncio.gather(*(db.pull(Tag, name=f"t{i}") for i in range(50)))
+            assert [tags[0].name for tags in pulled] == [f"t{i}" for i in range(50)]
+            prefix = type(db.engine).__name__
+            names = [thread.name for thread in threading.enumerate()]
+            assert sum(name.startswith(f"{prefix}-writer") for name in names) == 1
+            assert 1 <= sum(name.startswith(f"{prefix}-reader") for name in names) <= 2
+        finally:
+            await db.close()
+        names = [thread.name for thread in threading.enumerate()]
+        assert not any(name.startswith(f"{prefix}-") for name in names)
+
+    asyncio.run(main())
+
+
+# пулы потоков есть только у движков, которые сами ведут ввод-вывод
+def test_thread_pools(tmp_path):
+    async def main():
+        db = Database(str(tmp_path / 'db'), hot=[Tag])
+        memory = Database(str(tmp_path / 'memory'), engine='memory')
+        sharded = Database(str(tmp_path / 'sharded'), engine='lmdb-sharded', shards=2)
+        try:
+            assert db.engine.read_executor is None and db.engine.memory.read_executor is None
+            assert db.engine.durable.read_executor is not None
+            assert memory.engine.write_executor is None
+            assert sharded.engine.write_executor is None
+            assert all(shard.write_executor is not None for shard in sharded.engine.shards)
+            for database in (db, memory, sharded):
+                await database.push(Tag('a'))
+                assert [tag.name for tag in await database.pull(Tag)] == ['a']
+        finally:
+            for database in (db, memory, sharded):
+                await database.close()
+
+    asyncio.run(main())
+
+
+def test_hot_metrics(tmp_path):
+    async def main():
+        registry = MetricsRegistry()
+        db = Database(str(tmp_path / 'db'), metrics=Metrics([registry]), hot=[Tag])
+        try:
+            assert db.engine.durable.metrics is db.engine.memory.metrics is db.metrics
+            await db.push(Tag('a'))
+            assert [tag.name for tag in await db.pull(Tag)] == ['a']
+            table_name = Tag.__tablename__
+            stats = registry.snapshot()
+            # запись идёт в оба уровня, чтение - только из памяти
+            assert stats[('insert', table_name)]['count'] == 2
+            assert stats[('select', table_name)]['rows_returned'] == 1
+        finally:
+            await db.close()
+
+    asyncio.run(main())
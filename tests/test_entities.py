@@ -0,0 +1,64 @@
+from dataclasses import dataclass
+from typing import ClassVar
+
+import pytest
+
+from database import BaseEntity
+from database.entities import to_table_name
+
+
+@dataclass
+class Animal(BaseEntity):
+    __key__ = 'name'
+    registry: ClassVar[dict] = {}
+    name: str
+    legs: int = 4
+
+    def __post_init__(self) -> None:
+        super().__init__()
+
+
+@dataclass
+class Bird(Animal):
+    wingspan: float | None = None
+    tags: list | None = None
+
+
+class Slotted(BaseEntity):
+    __slots__ = ('code', 'weight')
+    code: str
+    weight: float
+
+    def __init__(self, code: str, weight: float) -> None:
+        self.code = code
+        self.weight = weight
+        super().__init__()
+
+
+def test_metadata():
+    # колонки наследника идут после колонок предка; ClassVar и служебные атрибуты - не колонки
+    assert Bird.__columns__ == ('name', 'legs', 'wingspan', 'tags')
+    assert Animal.__columns__ == ('name', 'legs')
+    assert Bird.__key__ == 'name'
+    with pytest.raises(ValueError):
+        type('Broken', (BaseEntity,), {'__annotations__': {'a': int}, '__key__': 'b'})
+
+
+def test_row_loaders():
+    bird = Bird('Tweety', 2, 0.25, ['yellow'])
+    assert bird._serialize() == {'name': 'Tweety', 'legs': 2, 'wingspan': 0.25, 'tags': ['yellow']}
+    # значения приводятся к типам колонок, отсутствующих в строке колонок не трогает
+    loaded = Bird._from_row({'name': 'Polly', 'legs': '2', 'wingspan': 1})
+    assert (loaded.name, loaded.legs, loaded.wingspan, loaded.tags) == ('Polly', 2, 1.0, None)
+    assert isinstance(loaded.wingspan, float) and isinstance(loaded, Bird)
+    assert Bird._from_tuple(('Kiwi', 2, None, [])) == Bird('Kiwi', 2, None, [])
+
+    slotted = Slotted._from_row({'code': 'x', 'weight': '1.5'})
+    assert (slotted.code, slotted.weight) == ('x', 1.5) and not hasattr(slotted, '__dict__')
+
+
+def test_table_names():
+    assert to_table_name('PhotoRequest') == 'photo_requests'
+    assert to_table_name('HTTPProxy') == 'http_proxies'
+    assert to_table_name('UserToGroup') == 'user_to_group'
+    assert Bird.__tablename__ == 'birds'
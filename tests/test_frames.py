@@ -0,0 +1,70 @@
+import asyncio
+from array import array
+from dataclasses import dataclass
+from math import isnan
+
+import pytest
+
+from database import BaseEntity, Database
+
+
+@dataclass
+class Trade(BaseEntity):
+    __key__ = 'id'
+    id: int
+    symbol: str
+    price: float
+    size: int | None
+    buy: bool
+
+    def __post_init__(self) -> None:
+        super().__init__()
+
+
+TRADES = [Trade(i, f"s{i % 3}", i * 0.5, i if i % 4 else None, i % 2 == 0) for i in range(25)]
+
+
+def test_array_frame(tmp_path, engine):
+    async def main():
+        db = Database(str(tmp_path / 'db'), engine=engine)
+        try:
+            await db.push_many(TRADES)
+            frame = await db.pull_frame(Trade, ['id', 'price', 'symbol', 'buy'], batch_size=7, as_numpy=False)
+            assert list(frame) == ['id', 'price', 'symbol', 'buy']
+            # числовые колонки - непрерывные буферы по аннотациям, остальные - списки
+            assert (frame['id'].typecode, frame['price'].typecode, frame['buy'].typecode) == ('q', 'd', 'b')
+            order = sorted(range(25), key=frame['id'].__getitem__)
+            assert [frame['id'][i] for i in order] == list(range(25))
+            assert [frame['price'][i] for i in order] == [i * 0.5 for i in range(25)]
+            assert [frame['symbol'][i] for i in order] == [f"s{i % 3}" for i in range(25)]
+
+            frame = await db.pull_frame(Trade, ['size'], as_numpy=False, symbol='s1')
+            # NULL в целой колонке переводит её во float с NaN
+            assert frame['size'].typecode == 'd' and len(frame['size']) == 8
+            assert sum(isnan(value) for value in frame['size']) == 2
+            assert await db.pull_frame(Trade, ['id'], as_numpy=False, symbol='none') == {'id': array('q')}
+        finally:
+            await db.close()
+
+    asyncio.run(main())
+
+
+def test_numpy_frame(tmp_path):
+    numpy = pytest.importorskip('numpy')
+
+    async def main():
+        db = Database(str(tmp_path / 'db'))
+        try:
+            await db.push_many(TRADES)
+            frame = await db.pull_frame(Trade, batch_size=10)
+            assert list(frame) == list(Trade.__columns__)
+            assert [frame[column].dtype for column in ('id', 'symbol', 'price', 'size', 'buy')] == \
+                [numpy.dtype('int64'), numpy.dtype(object), numpy.dtype('float64'), numpy.dtype('float64'),
+                 numpy.dtype('bool')]
+            assert numpy.array_equal(numpy.sort(frame['id']), numpy.arange(25))
+            assert int(numpy.isnan(frame['size']).sum()) == 7
+            assert frame['buy'].sum() == 13
+        finally:
+            await db.close()
+
+    asyncio.run(main())
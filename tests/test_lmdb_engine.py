@@ -0,0 +1,171 @@
+import asyncio
+from dataclasses import dataclass
+
+import pytest
+
+from database import BaseEntity, Database, Metrics
+
+
+@dataclass
+class Ship(BaseEntity):
+    __key__ = 'id'
+    __indexes__ = ('fleet',)
+    id: int
+    fleet: str
+    crew: int
+
+    def __post_init__(self) -> None:
+        super().__init__()
+
+
+SHIPS = [Ship(i, f"f{i % 10}", i % 7) for i in range(200)]
+
+
+# Замеры операций списком: по ним видно, каким планом шла выборка и сколько строк прочитано
+def recorded(db: Database) -> list:
+    probes = []
+    db.engine.metrics = Metrics([probes.append])
+    return probes
+
+
+def ship_class(indexes: tuple) -> type[BaseEntity]:
+    def __init__(self, id: int, fleet: str, crew: int) -> None:
+        self.id, self.fleet, self.crew = id, fleet, crew
+        BaseEntity.__init__(self)
+
+    namespace = {'__annotations__': {'id': int, 'fleet': str, 'crew': int}, '__key__': 'id',
+                 '__indexes__': indexes, '__init__': __init__}
+    return type('Ship', (BaseEntity,), namespace)
+
+
+def test_secondary_index(tmp_path):
+    async def main():
+        db = Database(str(tmp_path / 'db'))
+        probes = recorded(db)
+        try:
+            await db.push_many(SHIPS)
+            assert sorted(ship.id for ship in await db.pull(Ship, fleet='f3')) == list(range(3, 200, 10))
+            assert (probes[-1].plan, probes[-1].rows_scanned) == ('index fleet', 20)
+            # без индекса - проход по таблице
+            assert len(await db.pull(Ship, crew=2)) == 29
+            assert (probes[-1].plan, probes[-1].rows_scanned) == ('full scan', 200)
+
+            # индекс следует за заменой и удалением строк
+            await db.push(Ship(3, 'f4', 0))
+            await db.drop(Ship(13, 'f3', 6))
+            assert sorted(ship.id for ship in await db.pull(Ship, fleet='f3')) == list(range(23, 200, 10))
+            assert 3 in {ship.id for ship in await db.pull(Ship, fleet='f4')}
+            assert await db.count(Ship, fleet__in=['f3', 'f4']) == 39
+        finally:
+            await db.close()
+
+    asyncio.run(main())
+
+
+def test_index_built_for_existing_rows(tmp_path):
+    path = str(tmp_path / 'db')
+
+    async def main():
+        db = Database(path)
+        plain_cls = ship_class(())
+        await db.push_many([plain_cls(i, f"f{i % 10}", i % 7) for i in range(200)])
+        await db.close()
+
+        # индекс, объявленный позже, достраивается по уже лежащим строкам
+        db = Database(path)
+        probes = recorded(db)
+        indexed_cls = ship_class(('crew',))
+        try:
+            assert len(await db.pull(indexed_cls, crew=6)) == 28
+            assert probes[-1].plan == 'index crew'
+        finally:
+            await db.close()
+
+    asyncio.run(main())
+
+
+def test_rename_and_delete_table(tmp_path):
+    path = str(tmp_path / 'db')
+    columns = {'id': int, 'fleet': str, 'crew': int}
+    rows = [{'id': i, 'fleet': f"f{i % 3}", 'crew': i} for i in range(30)]
+
+    async def main():
+        db = Database(path)
+        engine = db.engine
+        engine.create_table('ships', columns, 'id', ['fleet'])
+        await engine.insert_many('ships', [dict(row) for row in rows])
+        # переименование меняет только запись в каталоге: строки и индексы остаются на месте
+        engine.rename_table('ships', 'vessels')
+        assert await engine.count('vessels', {'fleet': 'f1'}) == 10
+        engine.create_table('ships', columns, 'id', ['fleet'])
+        assert await engine.count('ships') == 0
+        with pytest.raises(ValueError):
+            engine.rename_table('ships', 'vessels')
+        engine.delete_table('ships')
+        await db.close()
+
+        db = Database(path)
+        engine = db.engine
+        try:
+            engine.create_table('vessels', columns, 'id', ['fleet'])
+            engine.create_table('ships', columns, 'id', ['fleet'])
+            assert await engine.count('vessels') == 30
+            assert [row['id'] for row in await engine.select('vessels', {'fleet': 'f2'}, limit=2)] == [2, 5]
+            # удалённая таблица не оставила строк под своим именем
+            assert await engine.count('ships') == 0
+        finally:
+            await db.close()
+
+    asyncio.run(main())
+
+
+def test_snapshot_lazy_entities(tmp_path):
+    async def main():
+        db = Database(str(tmp_path / 'db'))
+        try:
+            await db.push_many(SHIPS)
+            async with db.snapshot() as snapshot:
+                ships = await snapshot.pull(Ship, fleet='f3', order_by='id', limit=3)
+                # из буфера разобраны только колонки условия и сортировки, остальные - при первом обращении
+                assert all(isinstance(ship, Ship) and set(ship._lazy_values) == {'fleet', 'id'} for ship in ships)
+                assert [(ship.id, ship.crew) for ship in ships] == [(3, 3), (13, 6), (23, 2)]
+                assert set(ships[0]._lazy_values) == {'id', 'fleet', 'crew'}
+                # записи после открытия снимка в нём не видны
+                await db.push(Ship(500, 'f3', 1))
+                await db.drop(Ship(3, 'f3', 3))
+                assert len(await snapshot.pull(Ship, fleet='f3')) == 20
+                assert await db.count(Ship, fleet='f3') == 20
+                assert 500 in {ship.id for ship in await db.pull(Ship, fleet='f3')}
+                untouched = (await snapshot.pull(Ship, id=7))[0]
+            # прочитанные колонки остаются, непрочитанные после закрытия снимка недоступны
+            assert ships[1].crew == 6
+            with pytest.raises(RuntimeError):
+                untouched.crew
+        finally:
+            await db.close()
+
+    asyncio.run(main())
+
+
+def test_scan_decodes_only_matching_rows(tmp_path):
+    async def main():
+        db = Database(str(tmp_path / 'db'))
+        try:
+            await db.push_many(SHIPS)
+            table = db.engine.tables[Ship.__tablename__]
+            decoded = []
+            decode = table.codec.decode
+
+            def counted(value: bytes, columns: tuple[str, ...] | None = None) -> dict:
+                decoded.append(value)
+                return decode(value, columns)
+
+            table.codec.decode = counted
+            # условия проверяются по сырой строке, целиком раскодируются только подошедшие
+            assert len(await db.pull(Ship, crew=2, id__lt=100)) == 14
+            assert len(decoded) == 14
+            assert await db.count(Ship, crew__in=[1, 2]) == 58 and len(decoded) == 14
+        finally:
+            await db.close()
+
+    asyncio.run(main())
@@ -0,0 +1,112 @@
+import asyncio
+from dataclasses import dataclass
+import threading
+
+import lmdb
+import pytest
+
+from database import BaseEntity, Database
+from database.engines.lmdb_engine import ResizeLock
+
+
+@dataclass
+class Record(BaseEntity):
+    __key__ = 'id'
+    __indexes__ = ('group',)
+    id: int
+    group: int
+    payload: str
+
+    def __post_init__(self) -> None:
+        super().__init__()
+
+
+def records(count: int, start: int = 0) -> list[Record]:
+    return [Record(i, i % 10, f"{i:08d}" * 8) for i in range(start, start + count)]
+
+
+def test_grows_on_full(tmp_path):
+    async def main():
+        path = str(tmp_path / 'db')
+        db = Database(path, map_size=2**16)
+        try:
+            for start in range(0, 6000, 1500):
+                await db.push_many(records(1500, start))
+            # пачки не влезали в начальную карту: она выросла, записи не потерялись
+            assert db.engine.map_size > 2**16
+            assert await db.count(Record) == 6000
+            assert await db.count(Record, group=3) == 600
+            assert [r.payload for r in await db.pull(Record, id=4321)] == ['00004321' * 8]
+        finally:
+            await db.close()
+
+        # при открытии размер карты берётся из файла, если он больше заданного
+        db = Database(path, map_size=2**16)
+        try:
+            assert db.engine.map_size > 2**16
+            assert await db.count(Record) == 6000
+        finally:
+            await db.close()
+
+    asyncio.run(main())
+
+
+def test_max_map_size(tmp_path):
+    async def main():
+        db = Database(str(tmp_path / 'db'), map_size=2**16, max_map_size=2**18)
+        try:
+            await db.push_many(records(100))
+            with pytest.raises(lmdb.MapFullError):
+                await db.push_many(records(20_000, 100))
+            # упавшая пачка отменена целиком, прежние строки на месте
+            assert db.engine.map_size == 2**18
+            assert await db.count(Record) == 100
+            assert await db.count(Record, group=0) == 10
+        finally:
+            await db.close()
+
+    asyncio.run(main())
+
+
+def test_compact_backup(tmp_path):
+    async def main():
+        db = Database(str(tmp_path / 'db'), map_size=2**16)
+        try:
+            await db.push_many(records(3000))
+            await db.drop_many(records(2000))
+            await db.compact_backup(str(tmp_path / 'backup'))
+        finally:
+            await db.close()
+
+        backup = Database(str(tmp_path / 'backup'))
+        try:
+            assert await backup.count(Record) == 1000
+            assert await backup.count(Record, group=5) == 100
+        finally:
+            await backup.close()
+
+    asyncio.run(main())
+
+
+def test_resize_lock():
+    lock = ResizeLock()
+    lock.acquire_shared()
+    # рост не начинается, пока есть транзакция
+    assert not lock.acquire_exclusive(0.05)
+    lock.release_shared()
+    assert lock.acquire_exclusive(0.05)
+
+    # во время роста новые транзакции ждут его конца
+    entered = threading.Event()
+
+    def reader() -> None:
+        lock.acquire_shared()
+        entered.set()
+        lock.release_shared()
+
+    thread = threading.Thread(target=reader)
+    thread.start()
+    assert not entered.wait(0.05)
+    lock.release_exclusive()
+    assert entered.wait(1)
+    thread.join()
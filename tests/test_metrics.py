@@ -0,0 +1,70 @@
+import asyncio
+from dataclasses import dataclass
+import logging
+
+import pytest
+
+from database import BaseEntity, Database, LoggingSink, Metrics, MetricsRegistry
+
+
+@dataclass
+class Quote(BaseEntity):
+    __key__ = 'id'
+    id: int
+    symbol: str
+
+    def __post_init__(self) -> None:
+        super().__init__()
+
+
+QUOTES = [Quote(i, f"s{i % 5}") for i in range(50)]
+
+
+def test_registry(tmp_path, engine):
+    async def main():
+        registry = MetricsRegistry()
+        db = Database(str(tmp_path / 'db'), engine=engine, metrics=Metrics([registry]))
+        try:
+            await db.push_many(QUOTES)
+            for _ in range(3):
+                assert len(await db.pull(Quote, symbol='s2')) == 10
+            with pytest.raises(KeyError):
+                await db.pull(Quote, unknown=1)
+            table_name = Quote.__tablename__
+            stats = registry.snapshot()
+            assert stats[('insert_many', table_name)]['rows_written'] == 50
+            select = stats[('select', table_name)]
+            # ошибки считаются вместе с остальными операциями
+            assert (select['count'], select['errors'], select['rows_returned']) == (4, 1, 30)
+            if engine != 'memory':
+                assert select['rows_scanned'] >= 30 and select['transactions'] >= 3
+            assert 0 < select['p50'] <= select['p99'] <= select['max']
+            registry.reset()
+            assert registry.snapshot() == {}
+        finally:
+            await db.close()
+
+    asyncio.run(main())
+
+
+def test_logging(tmp_path, caplog):
+    async def main():
+        sink_logger = logging.getLogger('test.metrics')
+        # порог 0 - в лог медленных запросов попадает каждая операция
+        metrics = Metrics([LoggingSink(sink_logger, logging.INFO)], slow_query_threshold=0)
+        db = Database(str(tmp_path / 'db'), metrics=metrics)
+        try:
+            await db.push_many(QUOTES)
+            caplog.clear()
+            await db.pull(Quote, symbol='s1')
+        finally:
+            await db.close()
+
+    with caplog.at_level(logging.INFO):
+        asyncio.run(main())
+    messages = {record.name: record.getMessage() for record in caplog.records if 'select on' in record.getMessage()}
+    assert messages['test.metrics'].startswith(f"select on {Quote.__tablename__}:")
+    assert 'plan full scan' in messages['test.metrics'] and 'returned 10' in messages['test.metrics']
+    assert messages['database.slow_queries'].startswith('Slow select')
+    with pytest.raises(ValueError):
+        Metrics(slow_query_threshold=-1)
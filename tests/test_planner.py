@@ -0,0 +1,124 @@
+import asyncio
+from dataclasses import dataclass
+import random
+
+import pytest
+
+from database import BaseEntity, Database
+
+
+@dataclass
+class Score(BaseEntity):
+    __key__ = 'id'
+    __indexes__ = ('team', ('score', 'team'))
+    id: int
+    team: str | None
+    score: int | None
+    note: str
+
+    def __post_init__(self) -> None:
+        super().__init__()
+
+
+def make_scores() -> list[Score]:
+    rng = random.Random(7)
+    # мало различных значений: много совпадений и NULL в индексированных колонках
+    return [Score(i, rng.choice(['red', 'blue', 'green', None]), rng.choice([1, 2, 3, None]), f"n{i % 5}")
+            for i in rng.sample(range(-200, 200), 300)]
+
+
+SCORES = make_scores()
+
+# условия pull и эквивалентная проверка строки
+QUERIES = [
+    ({'team': 'red'}, lambda s: s.team == 'red'),
+    ({'team': None}, lambda s: s.team is None),
+    ({'team__in': ['red', None]}, lambda s: s.team in ('red', None)),
+    ({'score': 2, 'team': 'blue'}, lambda s: s.score == 2 and s.team == 'blue'),
+    ({'score__ge': 2}, lambda s: s.score is not None and s.score >= 2),
+    ({'score__lt': 3, 'note': 'n1'}, lambda s: s.score is not None and s.score < 3 and s.note == 'n1'),
+    ({'score__between': (2, 3), 'team__prefix': 'gr'},
+     lambda s: s.score is not None and 2 <= s.score <= 3 and s.team is not None and s.team.startswith('gr')),
+    ({'id__between': (-50, 50)}, lambda s: -50 <= s.id <= 50),
+    ({'id__gt': 150}, lambda s: s.id > 150),
+    ({'id__in': [5, -7, 1000]}, lambda s: s.id in (5, -7, 1000)),
+    ({'note__prefix': 'n'}, lambda s: True),
+    ({}, lambda s: True),
+]
+
+
+def null_first(value: object) -> tuple:
+    return (value is not None, value)
+
+
+@pytest.fixture(params=['lmdb', 'sqlite', 'memory', 'lmdb-sharded'])
+def planner_db(request, tmp_path):
+    options = {'shards': 2} if request.param == 'lmdb-sharded' else {}
+    return lambda: Database(str(tmp_path / 'db'), engine=request.param, **options)
+
+
+@pytest.mark.parametrize('conditions, check', QUERIES)
+def test_conditions(planner_db, conditions, check):
+    async def main():
+        db = planner_db()
+        try:
+            await db.push_many(SCORES)
+            expected = sorted(s.id for s in SCORES if check(s))
+            assert sorted(s.id for s in await db.pull(Score, **conditions)) == expected
+            assert await db.count(Score, **conditions) == len(expected)
+            assert await db.exists(Score, **conditions) == bool(expected)
+            # постраничный проход с курсором after: без пропусков и повторов
+            streamed = [s.id async for s in db.stream(Score, batch_size=7, **conditions)]
+            assert sorted(streamed) == expected and len(set(streamed)) == len(streamed)
+        finally:
+            await db.close()
+
+    asyncio.run(main())
+
+
+def test_order_and_window(planner_db):
+    async def main():
+        db = planner_db()
+        try:
+            await db.push_many(SCORES)
+            # при совпадениях порядок внутри группы не задан: сверяются значения колонки сортировки
+            rows = await db.pull(Score, order_by='score')
+            assert [s.score for s in rows] == sorted((s.score for s in SCORES), key=null_first)
+            rows = await db.pull(Score, order_by='-team', team__in=['red', 'blue', None])
+            expected = sorted((s.team for s in SCORES if s.team in ('red', 'blue', None)), key=null_first, reverse=True)
+            assert [s.team for s in rows] == expected
+
+            # окно по полному порядку однозначно
+            ordered = sorted(SCORES, key=lambda s: (null_first(s.score), -s.id))
+            rows = await db.pull(Score, order_by=['score', '-id'], limit=25, offset=40)
+            assert [s.id for s in rows] == [s.id for s in ordered[40:65]]
+            rows = await db.pull(Score, order_by='-id', limit=5, offset=3, team='green')
+            greens = sorted((s.id for s in SCORES if s.team == 'green'), reverse=True)
+            assert [s.id for s in rows] == greens[3:8]
+            assert await db.pull(Score, order_by='id', limit=0) == []
+            rows = await db.pull(Score, order_by='id', offset=290)
+            assert [s.id for s in rows] == sorted(s.id for s in SCORES)[290:]
+        finally:
+            await db.close()
+
+    asyncio.run(main())
+
+
+def test_index_follows_updates_and_deletes(planner_db):
+    async def main():
+        db = planner_db()
+        try:
+            await db.push_many(SCORES)
+            moved = [Score(s.id, 'red', s.score, s.note) for s in SCORES if s.team is None]
+            await db.push_many(moved)
+            await db.drop_many([s for s in SCORES if s.team == 'blue'])
+            assert await db.count(Score, team=None) == 0
+            assert await db.count(Score, team='blue') == 0
+            expected = sum(s.team in ('red', None) for s in SCORES)
+            assert await db.count(Score, team='red') == expected
+            assert len(await db.pull(Score, team='red', score__ge=1)) == sum(
+                s.team in ('red', None) and s.score is not None for s in SCORES)
+        finally:
+            await db.close()
+
+    asyncio.run(main())
@@ -0,0 +1,169 @@
+import asyncio
+from dataclasses import dataclass
+
+from database import BaseEntity, Database, Metrics, MetricsRegistry
+
+
+@dataclass
+class Reading(BaseEntity):
+    sensor: str
+    value: float | None
+    note: str | None
+
+    def __post_init__(self) -> None:
+        super().__init__()
+
+
+@dataclass
+class Sensor(BaseEntity):
+    __key__ = 'name'
+    name: str
+    unit: str
+
+    def __post_init__(self) -> None:
+        super().__init__()
+
+
+@dataclass
+class Job(BaseEntity):
+    __key__ = 'id'
+    __autoincrement__ = True
+    title: str
+    id: int | None = None
+
+    def __post_init__(self) -> None:
+        super().__init__()
+
+
+READINGS = [Reading('a', None, 'x'), Reading('b', 1.5, None), Reading('c', None, None), Reading('d', 2.5, 'y')]
+
+
+def sensors(readings: list[Reading]) -> list[str]:
+    return sorted(reading.sensor for reading in readings)
+
+
+def test_none_equality(tmp_path, engine):
+    async def main():
+        db = Database(str(tmp_path / 'db'), engine=engine)
+        try:
+            await db.push_many(READINGS)
+            assert sensors(await db.pull(Reading, value=None)) == ['a', 'c']
+            assert sensors(await db.pull(Reading, value=None, note=None)) == ['c']
+            assert sensors(await db.pull(Reading, value__in=[None, 2.5])) == ['a', 'c', 'd']
+            assert await db.count(Reading, note=None) == 2
+            assert await db.exists(Reading, value=None, note='x')
+        finally:
+            await db.close()
+
+    asyncio.run(main())
+
+
+def test_drop_keyless_with_none(tmp_path, engine):
+    async def main():
+        db = Database(str(tmp_path / 'db'), engine=engine)
+        try:
+            await db.push_many(READINGS)
+            await db.drop(Reading('a', None, 'x'))
+            await db.drop_many([Reading('c', None, None)])
+            assert sensors(await db.pull(Reading)) == ['b', 'd']
+        finally:
+            await db.close()
+
+    asyncio.run(main())
+
+
+def test_push_and_drop_many(tmp_path, engine):
+    async def main():
+        registry = MetricsRegistry()
+        db = Database(str(tmp_path / 'db'), engine=engine, metrics=Metrics([registry]))
+        try:
+            # сущности разных классов раскладываются по своим таблицам
+            readings = [Reading(f"s{i}", i / 2, None) for i in range(10)]
+            await db.push_many(readings + [Sensor('s1', 'C'), Sensor('s2', 'F')], chunk_size=4)
+            assert await db.count(Reading) == 10 and await db.count(Sensor) == 2
+            if engine != 'memory':
+                # пачка по chunk_size строк - одна транзакция
+                assert registry.snapshot()[('insert_many', Reading.__tablename__)]['transactions'] == 3
+            await db.drop_many(readings[::2] + [Sensor('s1', 'C')], chunk_size=2)
+            assert sensors(await db.pull(Reading)) == ['s1', 's3', 's5', 's7', 's9']
+            assert [sensor.name for sensor in await db.pull(Sensor)] == ['s2']
+            await db.push_many([])
+            await db.drop_many([])
+            assert await db.count(Reading) == 5
+        finally:
+            await db.close()
+
+    asyncio.run(main())
+
+
+def test_stream(tmp_path, engine):
+    async def main():
+        db = Database(str(tmp_path / 'db'), engine=engine)
+        try:
+            await db.push_many([Reading(f"s{i:02d}", float(i), 'odd' if i % 2 else None) for i in range(25)])
+            batches = [batch async for batch in db.stream(Reading, batch_size=10, batched=True)]
+            assert [len(batch) for batch in batches] == [10, 10, 5]
+            assert sensors([reading for batch in batches for reading in batch]) == [f"s{i:02d}" for i in range(25)]
+            streamed = [reading.sensor async for reading in db.stream(Reading, batch_size=4, note='odd')]
+            assert sorted(streamed) == [f"s{i:02d}" for i in range(1, 25, 2)]
+            # брошенный на середине поток не мешает дальнейшей работе
+            async for reading in db.stream(Reading, batch_size=3):
+                break
+            await db.push(Reading('late', None, None))
+            assert await db.count(Reading) == 26
+        finally:
+            await db.close()
+
+    asyncio.run(main())
+
+
+def test_key_lookups(tmp_path, engine):
+    async def main():
+        db = Database(str(tmp_path / 'db'), engine=engine)
+        try:
+            await db.push_many([Sensor('t1', 'C'), Sensor('t2', 'F'), Sensor('t3', 'K')])
+            # запись с тем же ключом заменяет строку, а не добавляет новую
+            await db.push(Sensor('t2', 'C'))
+            assert await db.count(Sensor) == 3
+            assert await db.pull(Sensor, name='t2') == [Sensor('t2', 'C')]
+            # порядок ключей сохраняется, отсутствующие пропускаются
+            found = await db.pull_many_by_key(Sensor, ['t3', 'missing', 't1'])
+            assert [sensor.name for sensor in found] == ['t3', 't1']
+            await db.drop(Sensor('t1', 'C'))
+            assert not await db.exists(Sensor, name='t1')
+
+            # ключ, оставленный None, выдаёт движок
+            jobs = [Job('a'), Job('b')]
+            await db.push_many(jobs)
+            single = Job('c')
+            await db.push(single)
+            assert [job.id for job in jobs] == [1, 2] and single.id == 3
+            assert [job.title for job in await db.pull_many_by_key(Job, [3, 1])] == ['c', 'a']
+        finally:
+            await db.close()
+
+    asyncio.run(main())
+
+
+def test_projections_and_counts(tmp_path, engine):
+    async def main():
+        probes = []
+        db = Database(str(tmp_path / 'db'), engine=engine, metrics=Metrics([probes.append]))
+        try:
+            await db.push_many(READINGS)
+            assert await db.count(Reading) == 4
+            if engine == 'lmdb':
+                # счёт без условий берётся из статистики таблицы, строки не читаются
+                assert (probes[-1].plan, probes[-1].rows_scanned) == ('entries', 0)
+            assert await db.count(Reading, value__gt=2) == 1
+            assert await db.exists(Reading, sensor='b')
+            assert not await db.exists(Reading, sensor='z')
+
+            # одна колонка - плоский список, несколько - кортежи
+            assert await db.pull_columns(Reading, 'sensor', order_by='sensor') == ['a', 'b', 'c', 'd']
+            assert await db.pull_columns(Reading, ['sensor', 'value'], order_by='sensor', limit=2, offset=1,
+                                         sensor__in=['a', 'b', 'd']) == [('b', 1.5), ('d', 2.5)]
+        finally:
+            await db.close()
+
+    asyncio.run(main())
@@ -0,0 +1,32 @@
+import pytest
+
+from database.engines.query import compile_predicate, parse_conditions
+
+
+COLUMNS = {'name': str, 'height': int, 'mass': float | None}
+
+
+def test_compiled_predicate():
+    filters = parse_conditions(COLUMNS, {'height__between': ('150', 200), 'mass': None, 'name__in': ['Leia', 'Luke']})
+    # условия разобраны и приведены к типам колонок один раз
+    assert filters == [('height', 'between', (150, 200)), ('mass', 'eq', None), ('name', 'in', ('Leia', 'Luke'))]
+    # значения колонок - в порядке columns, а не условий
+    check = compile_predicate(filters, ('name', 'height', 'mass'))
+    assert check(['Leia', 150, None]) and check(('Luke', 172, None))
+    assert not check(['Han', 180, None]) and not check(['Luke', 172, 73.0]) and not check(['Leia', None, None])
+
+    # та же форма условий с другими значениями
+    check = compile_predicate(parse_conditions(COLUMNS, {'height__between': (1, 2), 'mass': 3,
+                                                         'name__in': ['Yoda']}), ('name', 'height', 'mass'))
+    assert check(['Yoda', 1, 3.0]) and not check(['Leia', 150, None])
+    assert compile_predicate([], ())([])
+    assert not compile_predicate(parse_conditions(COLUMNS, {'name__prefix': 'L'}), ('name',))([None])
+
+
+def test_invalid_conditions():
+    with pytest.raises(KeyError):
+        parse_conditions(COLUMNS, {'age': 1})
+    with pytest.raises(ValueError):
+        parse_conditions(COLUMNS, {'height__like': 1})
+    with pytest.raises(ValueError):
+        parse_conditions(COLUMNS, {'height__prefix': 1})
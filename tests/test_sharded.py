@@ -0,0 +1,123 @@
+import asyncio
+from dataclasses import dataclass
+
+import pytest
+
+from database import BaseEntity, Database
+
+
+@dataclass
+class Photo(BaseEntity):
+    __key__ = 'photo_id'
+    __autoincrement__ = True
+    __indexes__ = ('album',)
+    path: str
+    album: str
+    photo_id: int | None = None
+
+    def __post_init__(self) -> None:
+        super().__init__()
+
+
+def photos(count: int, start: int = 0) -> list[Photo]:
+    return [Photo(f"/p/{i}", f"a{i % 3}") for i in range(start, start + count)]
+
+
+def shard_keys(db: Database) -> list[set[int]]:
+    keys = []
+    for shard in db.engine.shards:
+        table_name = Photo.__tablename__
+        table = shard.tables[table_name]
+        with shard._lmdb_txn(db=shard.db_descriptors[table_name]) as txn:
+            keys.append({table.decode_key(key) for key, _ in txn.cursor()})
+    return keys
+
+
+def test_routing(tmp_path):
+    async def main():
+        db = Database(str(tmp_path / 'db'), engine='lmdb-sharded', shards=3)
+        try:
+            await db.push_many(photos(60))
+            keys = shard_keys(db)
+            # каждая строка ровно в одном шарде, и это шард её ключа
+            assert sum(map(len, keys)) == 60 and set().union(*keys) == set(range(1, 61))
+            table = db.engine.tables[Photo.__tablename__]
+            for number, shard in enumerate(keys):
+                assert shard and all(db.engine._shard_number(table.encode_key(key)) == number for key in shard)
+
+            assert [p.path for p in await db.pull(Photo, photo_id=17)] == ['/p/16']
+            found = await db.pull_many_by_key(Photo, [40, 3, 1000, 22])
+            assert [p.photo_id for p in found] == [40, 3, 22]
+            assert sorted(p.photo_id for p in await db.pull(Photo, photo_id__in=[5, 6, 7])) == [5, 6, 7]
+            await db.drop(found[0])
+            assert await db.count(Photo) == 59 and not await db.exists(Photo, photo_id=40)
+        finally:
+            await db.close()
+
+    asyncio.run(main())
+
+
+def test_reopen_and_next_key(tmp_path):
+    async def main():
+        path = str(tmp_path / 'db')
+        db = Database(path, engine='lmdb-sharded', shards=4)
+        try:
+            await db.push_many(photos(30))
+            # явный ключ больше выданных сдвигает следующий
+            await db.push(Photo('/p/explicit', 'a0', 100))
+        finally:
+            await db.close()
+
+        with pytest.raises(ValueError):
+            Database(path, engine='lmdb-sharded', shards=2)
+
+        # без shards число шардов берётся из каталога базы
+        db = Database(path, engine='lmdb-sharded')
+        try:
+            assert len(db.engine.shards) == 4
+            assert await db.count(Photo) == 31
+            added = photos(5, 30)
+            await db.push_many(added)
+            assert [p.photo_id for p in added] == [101, 102, 103, 104, 105]
+            keys = shard_keys(db)
+            assert sum(map(len, keys)) == len(set().union(*keys)) == 36
+        finally:
+            await db.close()
+
+    asyncio.run(main())
+
+
+def test_process_pool(tmp_path):
+    async def main():
+        db = Database(str(tmp_path / 'db'), engine='lmdb-sharded', shards=2, processes=2, parallel_rows=10)
+        try:
+            await db.push_many(photos(50))
+            # таблица больше parallel_rows: выборки по условиям идут через процессы, удаление - в этом процессе
+            assert sorted(p.photo_id for p in await db.pull(Photo, album='a1')) == list(range(2, 51, 3))
+            assert await db.count(Photo, album='a1') == 17
+            assert db.engine.process_pool is not None
+            assert [p.photo_id for p in await db.pull(Photo, order_by='photo_id', limit=3, offset=10)] == [11, 12, 13]
+            await db.drop_many([Photo(f"/p/{i}", 'a0', i + 1) for i in range(0, 50, 3)])
+            assert await db.count(Photo) == 33 and not await db.exists(Photo, album='a0')
+        finally:
+            await db.close()
+
+    asyncio.run(main())
+
+
+def test_process_pool_after_growth(tmp_path):
+    async def main():
+        db = Database(str(tmp_path / 'db'), engine='lmdb-sharded', shards=2, processes=2, parallel_rows=10,
+                      map_size=2**16)
+        try:
+            await db.push_many(photos(20))
+            assert await db.count(Photo, album='a2') == 6
+            # карты шардов растут в этом процессе, воркеры с открытыми шардами принимают новый размер
+            await db.push_many(photos(3000, 20))
+            assert all(shard.map_size > 2**16 for shard in db.engine.shards)
+            assert await db.count(Photo, album='a2') == 1006
+            assert len(await db.pull(Photo, album='a0', path__prefix='/p/29')) == 36
+        finally:
+            await db.close()
+
+    asyncio.run(main())
@@ -0,0 +1,84 @@
+import asyncio
+from dataclasses import dataclass
+import sqlite3
+
+import pytest
+
+from database import BaseEntity, Database
+
+
+@dataclass
+class Order(BaseEntity):
+    __key__ = 'id'
+    __indexes__ = ('customer',)
+    id: int
+    customer: str
+    total: float
+
+    def __post_init__(self) -> None:
+        super().__init__()
+
+
+ORDERS = [Order(i, f"c{i % 4}", i * 1.5) for i in range(40)]
+
+
+def test_statement_cache_is_bounded(tmp_path):
+    async def main():
+        db = Database(str(tmp_path / 'db'), engine='sqlite', cached_statements=8)
+        try:
+            await db.push_many(ORDERS)
+            # у каждой длины списка in своя форма запроса
+            for length in range(1, 30):
+                found = await db.pull(Order, id__in=list(range(length)))
+                assert sorted(order.id for order in found) == list(range(length))
+            assert len(db.engine.statements) == 8
+            # давно не нужные шаблоны вытеснены, свежие на месте
+            assert all(statement_key[2] != (('id', 'in', 1),) for statement_key in db.engine.statements)
+            assert len(await db.pull_many_by_key(Order, [3, 1, 2])) == 3
+        finally:
+            await db.close()
+
+    asyncio.run(main())
+
+
+def test_values_are_bound_as_parameters(tmp_path):
+    async def main():
+        db = Database(str(tmp_path / 'db'), engine='sqlite')
+        try:
+            tricky = ["O'Brien", "x' OR '1'='1", 'a"; DROP TABLE orders; --', '%_\\']
+            await db.push_many([Order(i, customer, 1.0) for i, customer in enumerate(tricky)])
+            for i, customer in enumerate(tricky):
+                assert [order.id for order in await db.pull(Order, customer=customer)] == [i]
+            assert await db.count(Order, customer__prefix="x'") == 1
+            await db.drop(Order(1, tricky[1], 1.0))
+            assert await db.count(Order) == 3
+            # запросы одной формы с разными значениями идут по одному шаблону
+            assert [shape for kind, _, shape, _, _ in db.engine.statements
+                    if kind == 'SELECT *' and shape[:1] == (('customer', 'eq', 1),)] == [(('customer', 'eq', 1),)]
+        finally:
+            await db.close()
+
+    asyncio.run(main())
+
+
+def test_performance_profile(tmp_path):
+    async def main():
+        db = Database(str(tmp_path / 'db'), engine='sqlite', synchronous='full', cache_size=-1024)
+        try:
+            await db.push_many(ORDERS)
+            writer = db.engine.connection
+            assert writer.execute("PRAGMA journal_mode").fetchone() == ('wal',)
+            assert writer.execute("PRAGMA synchronous").fetchone() == (2,)
+            # читатели получают общие настройки и открываются только на чтение
+            reader = db.engine._sqlite_reader()
+            assert reader is db.engine._sqlite_reader()
+            assert reader.execute("PRAGMA cache_size").fetchone() == (-1024,)
+            with pytest.raises(sqlite3.OperationalError, match="readonly"):
+                reader.execute("DELETE FROM orders")
+            assert await db.count(Order, customer='c1') == 10
+        finally:
+            await db.close()
+
+    asyncio.run(main())
+    with pytest.raises(ValueError):
+        Database(str(tmp_path / 'other'), engine='sqlite', journal_mode='fast')
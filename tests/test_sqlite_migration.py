@@ -0,0 +1,38 @@
+import asyncio
+import sqlite3
+
+from database import Database
+
+from .test_queries import Reading, sensors
+
+
+# Таблица в старой раскладке: колонки без типов, значения - через str(), NULL - строкой 'None'
+def make_legacy_table(path: str) -> None:
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE readings(sensor, value, note)")
+    connection.executemany("INSERT INTO readings VALUES(?, ?, ?)",
+                           [('a', 'None', 'x'), ('b', '1.5', None), ('c', None, 'None'), ('d', '2.5', 'y')])
+    connection.commit()
+    connection.close()
+
+
+def test_legacy_rebuild_keeps_nulls(tmp_path):
+    path = str(tmp_path / 'db')
+    make_legacy_table(path)
+
+    async def main():
+        db = Database(path, engine='sqlite')
+        try:
+            assert sensors(await db.pull(Reading)) == ['a', 'b', 'c', 'd']
+            assert sensors(await db.pull(Reading, value=None)) == ['a', 'c']
+            # строковая колонка хранила 'None' как обычный текст
+            assert sensors(await db.pull(Reading, note=None)) == ['b']
+            assert [reading.value for reading in await db.pull(Reading, sensor='b')] == [1.5]
+            await db.drop(Reading('a', None, 'x'))
+            assert sensors(await db.pull(Reading, value=None)) == ['c']
+        finally:
+            await db.close()
+        column_types = [row[2] for row in sqlite3.connect(path).execute("PRAGMA table_info(readings)")]
+        assert column_types == ['TEXT', 'REAL', 'TEXT']
+
+    asyncio.run(main())
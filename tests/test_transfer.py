@@ -0,0 +1,75 @@
+import asyncio
+from dataclasses import dataclass
+import io
+
+import pytest
+
+from database import BaseEntity, Database
+
+
+@dataclass
+class Item(BaseEntity):
+    __key__ = 'id'
+    id: int
+    name: str | None
+    price: float
+    active: bool
+    blob: bytes | None
+    tags: list
+
+    def __post_init__(self) -> None:
+        super().__init__()
+
+
+ITEMS = [Item(1, 'pen', 1.5, True, b'\x00\xff', ['a', 'b']),
+         Item(2, None, 0.25, False, None, []),
+         Item(3, 'чашка, "синяя"', 10.0, True, b'', [{'x': 1}])]
+
+
+@pytest.mark.parametrize('suffix', ['.jsonl', '.csv'])
+def test_round_trip(tmp_path, engine, suffix):
+    async def main():
+        source = Database(str(tmp_path / 'source'), engine=engine)
+        target = Database(str(tmp_path / 'target'), engine=engine)
+        path = tmp_path / f"items{suffix}"
+        try:
+            await source.push_many(ITEMS)
+            assert await source.export(Item, path, batch_size=2) == 3
+            assert await target.bulk_load(Item, path, chunk_size=2) == 3
+            loaded = await target.pull(Item, order_by='id')
+            if suffix == '.csv':
+                # пустое поле CSV читается как NULL
+                assert loaded[2].blob is None
+                loaded[2].blob = b''
+            assert loaded == ITEMS
+        finally:
+            await source.close()
+            await target.close()
+
+    asyncio.run(main())
+
+
+def test_file_objects_and_errors(tmp_path):
+    async def main():
+        db = Database(str(tmp_path / 'db'), engine='memory')
+        try:
+            await db.push_many(ITEMS)
+            sink = io.StringIO()
+            assert await db.export(Item, sink, format='jsonl', active=True) == 2
+            assert [line.count('"id"') for line in sink.getvalue().splitlines()] == [1, 1]
+
+            with pytest.raises(ValueError):
+                await db.export(Item, io.StringIO())
+            with pytest.raises(ValueError):
+                await db.export(Item, tmp_path / 'items.txt')
+            with pytest.raises(KeyError):
+                await db.bulk_load(Item, io.StringIO('{"id": 9, "color": "red"}\n'), format='jsonl')
+            with pytest.raises(KeyError):
+                await db.bulk_load(Item, io.StringIO('id,color\n9,red\n'), format='csv')
+            # недостающие колонки файла - NULL
+            assert await db.bulk_load(Item, io.StringIO('id,price,active,tags\n9,2,yes,[]\n'), format='csv') == 1
+            assert await db.pull(Item, id=9) == [Item(9, None, 2.0, True, None, [])]
+        finally:
+            await db.close()
+
+    asyncio.run(main())
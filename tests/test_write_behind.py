@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from database import Database
+
+from .test_queries import Reading
+
+
+def failing_write_batch(operations: list) -> None:
+    raise RuntimeError("disk is gone")
+
+
+def test_background_error_reaches_flush(tmp_path, engine, monkeypatch):
+    async def main():
+        db = Database(str(tmp_path / 'db'), engine=engine, write_behind=True, flush_interval=0.01)
+        try:
+            await db.count(Reading)
+            monkeypatch.setattr(db.engine, 'write_batch', failing_write_batch)
+            await db.push(Reading('a', 1.0, None))
+            await asyncio.sleep(0.1)
+            monkeypatch.undo()
+            with pytest.raises(RuntimeError, match="disk is gone"):
+                await db.flush()
+            # ошибка поднимается один раз, следующие записи идут как обычно
+            await db.push(Reading('b', 2.0, None))
+            await db.flush()
+            assert [reading.sensor for reading in await db.pull(Reading)] == ['b']
+        finally:
+            await db.close()
+
+    asyncio.run(main())
+
+
+def test_durable_error_is_not_raised_again(tmp_path, engine, monkeypatch):
+    async def main():
+        db = Database(str(tmp_path / 'db'), engine=engine, write_behind=True, flush_interval=0.01)
+        try:
+            await db.count(Reading)
+            monkeypatch.setattr(db.engine, 'write_batch', failing_write_batch)
+            with pytest.raises(RuntimeError):
+                await db.push(Reading('a', 1.0, None), durable=True)
+            monkeypatch.undo()
+            await db.flush()
+        finally:
+            await db.close()
+
+    asyncio.run(main())
+
+
+def test_close_raises_lost_write_and_closes_engine(tmp_path, engine, monkeypatch):
+    async def main():
+        db = Database(str(tmp_path / 'db'), engine=engine, write_behind=True, flush_interval=0.01)
+        await db.count(Reading)
+        monkeypatch.setattr(db.engine, 'write_batch', failing_write_batch)
+        await db.drop(Reading('a', 1.0, None))
+        await asyncio.sleep(0.1)
+        closed = []
+        close = db.engine.close
+        monkeypatch.setattr(db.engine, 'close', lambda: closed.append(close()))
+        with pytest.raises(RuntimeError):
+            await db.close()
+        assert closed
+
+    asyncio.run(main())